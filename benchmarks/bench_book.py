@@ -0,0 +1,242 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import pypandoc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import convert_to_docx  # noqa: E402
+import convert_to_pub_docx  # noqa: E402
+from asset_index import AssetIndex  # noqa: E402
+from generate_metadata import parse_metadata  # noqa: E402
+from synthetic_book import add_book_arguments, book_from_args  # noqa: E402
+
+# Whole-pipeline benchmark on a synthetic book (see synthetic_book.py).
+#
+# Usage:
+#   uv run benchmarks/bench_book.py run --output bench.json [--chapters 10] [--repeat 3]
+#   uv run benchmarks/bench_book.py compare bench.json baseline.json [--threshold 10]
+#
+# "run" generates the book, then times each stage separately: parse_metadata once, and
+# for every converter variant the section lookup, preprocessing, pandoc call and
+# post_process_docx summed over all chapters (see src/stage_timer.py). Every chapter is
+# rebuilt (force) in this process, one chapter at a time, so the numbers are not
+# affected by the number of cores. The best of --repeat runs is kept per stage.
+# "compare" flags stages that got slower than a stored baseline and exits with 1.
+
+RESULTS_VERSION = 1
+
+# name -> (converter module, options)
+VARIANTS = {
+    "regular": (convert_to_docx, {}),
+    "publisher": (convert_to_pub_docx, {}),
+    "publisher-ast": (convert_to_pub_docx, {"engine": "ast"}),
+    "publisher-stream": (convert_to_pub_docx, {"postprocess": "stream"}),
+}
+DEFAULT_VARIANTS = "regular,publisher"
+
+# compare: slower by more than this percentage ...
+DEFAULT_THRESHOLD = 10.0
+# ... and by more than this many milliseconds (timer noise on tiny stages)
+DEFAULT_MIN_MS = 5.0
+
+
+@contextlib.contextmanager
+def quiet():
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def time_parse_metadata(manuscript_path):
+    start = time.perf_counter()
+    with quiet():
+        book_data = parse_metadata(manuscript_path)
+    return time.perf_counter() - start, book_data
+
+
+def time_variant(name, chapters, output_dir):
+    """
+    Builds every chapter with one converter variant. Returns {stage: seconds} summed
+    over the chapters, plus "total" (wall time of the whole variant).
+    """
+    module, variant_options = VARIANTS[name]
+    os.makedirs(output_dir, exist_ok=True)
+    options = dict(variant_options, force=True, debug_tex="off",
+                   assets=AssetIndex.scan("input/latex_files")[0])
+    stages = {}
+    start = time.perf_counter()
+    for chapter in chapters:
+        with quiet():
+            result = module.build_chapter(chapter, output_dir, options)
+        for stage, seconds in (result or {}).get('stage_times', {}).items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+    stages["total"] = time.perf_counter() - start
+    return stages
+
+
+def run_benchmark(args):
+    variants = [v.strip() for v in args.variants.split(',') if v.strip()]
+    unknown = [v for v in variants if v not in VARIANTS]
+    if unknown:
+        print(f"Error: Unknown variant(s) {', '.join(unknown)}; choose from {', '.join(VARIANTS)}")
+        sys.exit(1)
+
+    book = book_from_args(args)
+    book_dir = args.book or tempfile.mkdtemp(prefix="bench_book_")
+    samples = {}
+
+    def add(key, seconds):
+        samples.setdefault(key, []).append(seconds)
+
+    try:
+        if not os.path.exists(os.path.join(book_dir, "input", "latex_files")):
+            latex_bytes = book.write(book_dir)
+            print(f"Synthetic book: {book.chapters} chapters x {book.sections} sections, "
+                  f"{latex_bytes / 1024:.0f} KB of LaTeX in {book_dir}")
+
+        with working_directory(book_dir):
+            for run in range(1, args.repeat + 1):
+                seconds, book_data = time_parse_metadata("input/Master Production Manuscript.txt")
+                add("parse_metadata", seconds)
+                chapters = book_data["chapters"]
+                for name in variants:
+                    stages = time_variant(name, chapters, os.path.join("output", name))
+                    for stage, value in stages.items():
+                        add(f"{name}/{stage}", value)
+                    print(f"  run {run}/{args.repeat} {name}: {stages['total']:.2f} s")
+    finally:
+        if not args.book and not args.keep:
+            shutil.rmtree(book_dir, ignore_errors=True)
+
+    results = {
+        "version": RESULTS_VERSION,
+        "created": datetime.datetime.now().isoformat(timespec='seconds'),
+        "python": platform.python_version(),
+        "pandoc": pypandoc.get_pandoc_version(),
+        "platform": platform.platform(),
+        "book": book.describe(),
+        "repeat": args.repeat,
+        "stages": {key: {"best": min(values), "samples": values} for key, values in samples.items()},
+    }
+    print_stages(results["stages"])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+    return results
+
+
+def print_stages(stages):
+    width = max(len(key) for key in stages)
+    for key, value in stages.items():
+        print(f"{key:<{width}}  {value['best'] * 1000:10.1f} ms")
+
+
+def load_results(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            results = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error: Could not read benchmark results {path}: {e}")
+        sys.exit(1)
+    if results.get("version") != RESULTS_VERSION:
+        print(f"Error: {path} was written by an incompatible benchmark version")
+        sys.exit(1)
+    return results
+
+
+def compare_results(current, baseline, threshold=DEFAULT_THRESHOLD, min_ms=DEFAULT_MIN_MS):
+    """
+    Prints current vs. baseline per stage. Returns the stages that regressed: slower
+    by more than threshold percent and by more than min_ms milliseconds.
+    """
+    if current.get("book") != baseline.get("book"):
+        print("Warning: the results were measured on different synthetic books; "
+              f"current {current.get('book')}, baseline {baseline.get('book')}")
+
+    keys = [k for k in baseline["stages"] if k in current["stages"]]
+    width = max([len(k) for k in keys] + [5])
+    print(f"{'stage':<{width}}  {'baseline ms':>12}  {'current ms':>11}  {'change':>8}")
+    regressions = []
+    for key in keys:
+        before = baseline["stages"][key]["best"]
+        after = current["stages"][key]["best"]
+        change = (after - before) / before * 100 if before else 0.0
+        flag = ""
+        if change > threshold and (after - before) * 1000 > min_ms:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        elif change < -threshold and (before - after) * 1000 > min_ms:
+            flag = "  faster"
+        print(f"{key:<{width}}  {before * 1000:>12.1f}  {after * 1000:>11.1f}  {change:>+7.1f}%{flag}")
+
+    for key in sorted(set(current["stages"]) - set(baseline["stages"])):
+        print(f"{key}: not in baseline")
+    for key in sorted(set(baseline["stages"]) - set(current["stages"])):
+        print(f"{key}: not measured")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark both converters stage by stage on a synthetic book.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Generate a synthetic book and time every stage")
+    add_book_arguments(run_parser)
+    run_parser.add_argument("--variants", default=DEFAULT_VARIANTS,
+                            help=f"Comma-separated converter variants: {', '.join(VARIANTS)} (default: {DEFAULT_VARIANTS})")
+    run_parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is kept, default: 3)")
+    run_parser.add_argument("--output", help="Write the results as JSON to this file")
+    run_parser.add_argument("--book", help="Use (or generate once into) this directory instead of a temporary one")
+    run_parser.add_argument("--keep", action="store_true", help="Keep the temporary book directory")
+    run_parser.add_argument("--baseline", help="Compare against this results file after running")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                            help=f"Regression threshold in percent (default: {DEFAULT_THRESHOLD})")
+    run_parser.add_argument("--min-ms", type=float, default=DEFAULT_MIN_MS,
+                            help=f"Ignore differences smaller than this many ms (default: {DEFAULT_MIN_MS})")
+
+    compare_parser = commands.add_parser("compare", help="Compare a results file against a baseline")
+    compare_parser.add_argument("current", help="Results JSON of the new run")
+    compare_parser.add_argument("baseline", help="Stored baseline results JSON")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help=f"Regression threshold in percent (default: {DEFAULT_THRESHOLD})")
+    compare_parser.add_argument("--min-ms", type=float, default=DEFAULT_MIN_MS,
+                                help=f"Ignore differences smaller than this many ms (default: {DEFAULT_MIN_MS})")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        current = run_benchmark(args)
+        if not args.baseline:
+            return
+        baseline = load_results(args.baseline)
+    else:
+        current = load_results(args.current)
+        baseline = load_results(args.baseline)
+
+    regressions = compare_results(current, baseline, args.threshold, args.min_ms)
+    if regressions:
+        print(f"{len(regressions)} stage(s) regressed: {', '.join(regressions)}")
+        sys.exit(1)
+    print("No regressions.")
+
+
+if __name__ == "__main__":
+    main()
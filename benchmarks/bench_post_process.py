@@ -0,0 +1,185 @@
+import argparse
+import base64
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+import pypandoc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import convert_to_docx  # noqa: E402
+import convert_to_pub_docx  # noqa: E402
+from ooxml_stream import stream_post_process_docx  # noqa: E402
+from paragraph_rules import PublisherParagraphRules, body_paragraphs, last_conclusion_index  # noqa: E402
+
+# Post-processing benchmark on a synthetic chapter.
+#
+# Usage: uv run benchmarks/bench_post_process.py [--paragraphs 5000] [--repeat 3]
+#
+# Times the paragraph walk on its own (the previous multi-pass walk that serialized each
+# paragraph to detect drawings vs. the single classify/dispatch walk of paragraph_rules)
+# and the whole post-processing of both converters, including the streaming one.
+
+# 1x1 PNG
+PIXEL_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=="
+)
+
+
+def synthetic_chapter(paragraphs):
+    """
+    LaTeX for one chapter with about the given number of body paragraphs: sections,
+    subsections, figures with captions, [FIGURE DETAIL] notes, code and a Conclusion.
+    """
+    parts = [
+        "\\begin{flushright}", "CHAPTER 1", "", "Synthetic Benchmark Chapter", "\\end{flushright}", "",
+        "\\chapter{Synthetic Benchmark Chapter}", "",
+    ]
+    count = 0
+    section = 0
+    while count < paragraphs:
+        section += 1
+        parts += [f"\\section{{Section {section}}}", ""]
+        for sub in range(1, 4):
+            parts += [f"\\subsection{{Topic {section}.{sub}}}", ""]
+            for n in range(8):
+                parts += [f"Paragraph {n} of topic {section}.{sub} with \\textbf{{bold}} and \\emph{{italic}} "
+                          "text, long enough to wrap over a couple of lines in the rendered document.", ""]
+            parts += [
+                "\\begin{figure}[h]", "\\centering", "\\includegraphics{pixel.png}",
+                f"\\caption{{Figure for topic {section}.{sub}}}", "\\end{figure}", "",
+                f"[FIGURE DETAIL] Detail note for figure {section}.{sub}", "",
+                "\\begin{verbatim}", "print('code')", "\\end{verbatim}", "",
+            ]
+            count += 12
+        parts += ["\\subsection{Conclusion}", "", "Closing remarks.", ""]
+        count += 2
+    return "\n".join(parts)
+
+
+def legacy_paragraph_walk(doc):
+    """
+    The previous publisher paragraph pass: separate walks for the title page, the
+    duplicate heading, the Conclusion pre-scan, images/captions/headings and the figure
+    details, detecting drawings by serializing every paragraph.
+    """
+    from docx.shared import Pt, RGBColor
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+
+    for p in doc.paragraphs[:20]:
+        p.text.strip()
+    for p in doc.paragraphs:
+        if p.style.name == 'Heading 1':
+            p._element.getparent().remove(p._element)
+            break
+    target = -1
+    for i, p in enumerate(doc.paragraphs):
+        if p.style.name == 'Heading 3':
+            if re.search(r'^\s*[\d\.]+\s+Conclusion\s*$', p.text, re.IGNORECASE) or p.text.strip().lower() == "conclusion":
+                target = i
+    for i, paragraph in enumerate(doc.paragraphs):
+        if 'w:drawing' in paragraph._element.xml or 'w:pict' in paragraph._element.xml:
+            paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        if "Caption" in paragraph.style.name:
+            paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+            for run in paragraph.runs:
+                run.font.name = "Lora"
+                run.font.size = Pt(9)
+                run.font.italic = True
+        if i == target:
+            paragraph.style = doc.styles['Heading 2']
+            paragraph.text = "Conclusion"
+        if paragraph.style.name in ['Heading 2', 'Heading 3', 'Heading 1', 'Heading 4']:
+            if '\t' in paragraph.text:
+                paragraph.text = paragraph.text.replace('\t', ' ')
+            for run in paragraph.runs:
+                run.font.name = "Lora"
+                run.font.bold = True
+                run.font.size = Pt(20)
+    for para in doc.paragraphs:
+        if "[FIGURE DETAIL]" in para.text:
+            clean_text = para.text.replace("[FIGURE DETAIL]", "").strip()
+            for r in para.runs:
+                para._element.remove(r._element)
+            new_run = para.add_run(clean_text)
+            new_run.font.color.rgb = RGBColor(255, 0, 0)
+
+
+def single_paragraph_walk(doc):
+    body = doc.element.body
+    rules = PublisherParagraphRules(doc.styles)
+    rules.conclusion_index = last_conclusion_index(body_paragraphs(body), rules)
+    rules.apply_to_body(body)
+
+
+def best_of(repeat, fn):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DOCX post-processing on a synthetic chapter.")
+    parser.add_argument("--paragraphs", type=int, default=5000, help="Approximate number of body paragraphs")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    from docx import Document
+
+    work_dir = tempfile.mkdtemp(prefix="bench_post_process_")
+    try:
+        with open(os.path.join(work_dir, "pixel.png"), 'wb') as f:
+            f.write(PIXEL_PNG)
+        raw_path = os.path.join(work_dir, "raw.docx")
+        pypandoc.convert_text(synthetic_chapter(args.paragraphs), 'docx', format='latex', outputfile=raw_path,
+                              extra_args=['--number-sections', f'--resource-path={work_dir}'])
+        paragraph_count = len(Document(raw_path).paragraphs)
+        print(f"Synthetic chapter: {paragraph_count} paragraphs")
+
+        def fresh_copy():
+            path = os.path.join(work_dir, "run.docx")
+            shutil.copyfile(raw_path, path)
+            return path
+
+        def quietly(fn, *fn_args, **fn_kwargs):
+            stdout = sys.stdout
+            sys.stdout = open(os.devnull, 'w')
+            try:
+                fn(*fn_args, **fn_kwargs)
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+
+        def walk(fn):
+            doc = Document(raw_path)
+            start = time.perf_counter()
+            quietly(fn, doc)
+            return time.perf_counter() - start
+
+        results = [
+            ("paragraph walk: legacy multi-pass", min(walk(legacy_paragraph_walk) for _ in range(args.repeat))),
+            ("paragraph walk: single pass", min(walk(single_paragraph_walk) for _ in range(args.repeat))),
+            ("convert_to_docx post_process_docx",
+             best_of(args.repeat, lambda: quietly(convert_to_docx.post_process_docx, fresh_copy()))),
+            ("convert_to_pub_docx post_process_docx",
+             best_of(args.repeat, lambda: quietly(convert_to_pub_docx.post_process_docx, fresh_copy()))),
+            ("convert_to_pub_docx --postprocess stream",
+             best_of(args.repeat, lambda: quietly(stream_post_process_docx, fresh_copy()))),
+        ]
+        width = max(len(name) for name, _ in results)
+        for name, seconds in results:
+            print(f"{name:<{width}}  {seconds * 1000:9.1f} ms")
+        print(f"Paragraph walk speedup: {results[0][1] / results[1][1]:.1f}x")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+import argparse
+import os
+import random
+import struct
+import zlib
+
+# Synthetic book generator for the benchmarks.
+#
+# Usage: uv run benchmarks/synthetic_book.py BOOK_DIR [--chapters 10] [--sections 8]
+#
+# Writes BOOK_DIR/input/Master Production Manuscript.txt and
+# BOOK_DIR/input/latex_files/Chapter_N/Section_N.M.tex with the constructs the
+# converters handle: figure blocks with "% Image Prompt:" comments, placeholder figures,
+# missing images, inline \includegraphics, citations ([cite: ...] and \cite), house-style
+# text (e.g., vs., Figure N.M, quotes, em dashes, **bold**), lists, code, math and a
+# thebibliography block per section. Image files are real PNGs. The same seed always
+# produces the same book.
+
+WORDS = (
+    "model data feature pipeline training inference latency batch stream metric signal "
+    "forecast window sample variance baseline drift label cluster vector embedding loss "
+    "gradient schedule deployment monitoring dataset partition schema query index cache "
+    "throughput accuracy residual horizon seasonal trend anomaly threshold estimate"
+).split()
+
+TOPICS = (
+    "Foundations", "Data Preparation", "Feature Engineering", "Model Selection", "Evaluation",
+    "Deployment", "Monitoring", "Scaling", "Case Study", "Best Practices",
+)
+
+
+def png_bytes(width, height, seed=0):
+    """
+    An RGB PNG of the given size (a gradient with some noise, so it does not compress
+    to almost nothing).
+    """
+    rng = random.Random(seed)
+    rows = []
+    for y in range(height):
+        row = bytearray([0])
+        for x in range(width):
+            row += bytes(((x * 255 // max(1, width - 1)) ^ rng.randrange(16),
+                          (y * 255 // max(1, height - 1)) ^ rng.randrange(16),
+                          (x + y + seed) % 256))
+        rows.append(bytes(row))
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data
+                + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(b"".join(rows), 6)) + chunk(b"IEND", b""))
+
+
+def figure_name(chapter, section, n, figures):
+    """
+    "figure_<chapter>_<figure number in the chapter>", the naming the authors use.
+    """
+    return f"figure_{chapter}_{(section - 1) * figures + n}"
+
+
+class SyntheticBook:
+    """
+    Builds the manuscript and section sources of a synthetic book.
+    """
+
+    def __init__(self, chapters=10, sections=8, paragraphs=12, figures=4, image_size=(400, 300), seed=1):
+        self.chapters = chapters
+        self.sections = sections
+        self.paragraphs = paragraphs
+        self.figures = figures
+        self.image_size = image_size
+        self.seed = seed
+
+    def describe(self):
+        return {"chapters": self.chapters, "sections": self.sections, "paragraphs": self.paragraphs,
+                "figures": self.figures, "image_size": list(self.image_size), "seed": self.seed}
+
+    def sentence(self, rng, chapter, section):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(10, 22))]
+        extra = rng.random()
+        if extra < 0.1:
+            words.insert(3, "(e.g., a rolling")
+            words.insert(5, "average)")
+        elif extra < 0.2:
+            words.insert(4, "vs.")
+        elif extra < 0.3:
+            words.append(f"as shown in Figure {chapter}.{rng.randint(1, max(1, self.figures))}")
+        elif extra < 0.4:
+            words.insert(2, "``quoted''")
+        elif extra < 0.5:
+            words.insert(5, "—")
+        elif extra < 0.55:
+            words.insert(1, "**key**")
+        text = " ".join(words)
+        text = text[0].upper() + text[1:] + "."
+        cite = rng.random()
+        if cite < 0.2:
+            text += f" \\cite{{ref{chapter}_{section}_{rng.randint(1, 4)}}}"
+        elif cite < 0.3:
+            text += f" [cite: {rng.randint(1, 40)}]"
+        elif cite < 0.35:
+            text = "[cite_start]" + text
+        return text
+
+    def paragraph(self, rng, chapter, section):
+        return " ".join(self.sentence(rng, chapter, section) for _ in range(rng.randint(3, 6)))
+
+    def figure(self, rng, chapter, section, n):
+        kind = n % 4
+        label = f"fig:{chapter}_{section}_{n}"
+        if kind == 1:
+            # Placeholder figure (no image yet)
+            return (f"\\begin{{figure}}[h]\n\\centering\n"
+                    f"\\fbox{{\\textbf{{Figure Placeholder: {rng.choice(TOPICS)} diagram {n}}}}}\n"
+                    f"% Prompt: draw the {rng.choice(WORDS)} flow\n"
+                    f"\\caption{{Placeholder for the {rng.choice(WORDS)} diagram.}}\n\\label{{{label}}}\n\\end{{figure}}")
+        if kind == 3:
+            # Image that was never delivered
+            return (f"\\begin{{figure}}[h]\n\\centering\n\\includegraphics[width=0.6\\textwidth]"
+                    f"{{missing_{chapter}_{section}_{n}.png}}\n\\caption{{Missing figure {n}.}}\n\\end{{figure}}\n"
+                    f"% Image Prompt: a chart of {rng.choice(WORDS)} over time")
+        return (f"\\begin{{figure}}[h]\n\\centering\n\\includegraphics[width=0.8\\textwidth]"
+                f"{{{figure_name(chapter, section, n, self.figures)}.png}}\n"
+                f"\\caption{{The {rng.choice(WORDS)} {rng.choice(WORDS)} with \\texttt{{{rng.choice(WORDS)}}} "
+                f"\\cite{{ref{chapter}_{section}_1}}.}}\n\\label{{{label}}}\n\\end{{figure}}\n"
+                f"% Image Prompt: a {rng.choice(WORDS)} plot with labelled axes")
+
+    def section_source(self, chapter, section):
+        rng = random.Random(f"{self.seed}:{chapter}:{section}")
+        parts = [f"\\section{{{rng.choice(TOPICS)} {chapter}.{section}: Overview:}}", ""]
+        figure_at = {int(i * self.paragraphs / (self.figures + 1)) for i in range(1, self.figures + 1)}
+        n = 0
+        for p in range(self.paragraphs):
+            if p and p % 4 == 0:
+                parts += [f"\\subsection{{{rng.choice(TOPICS)} {rng.choice(WORDS)}}}", ""]
+            parts += [self.paragraph(rng, chapter, section), ""]
+            if p in figure_at:
+                n += 1
+                parts += [self.figure(rng, chapter, section, n), ""]
+                parts += [f"[FIGURE DETAIL] Figure {chapter}.{n} shows the {rng.choice(WORDS)} step.", ""]
+            if p % 5 == 2:
+                parts += ["\\begin{itemize}"] + [f"\\item {self.sentence(rng, chapter, section)}" for _ in range(3)]
+                parts += ["\\end{itemize}", ""]
+            if p % 7 == 3:
+                parts += ["\\begin{verbatim}", "def score(a, b):", "    return a ** b  # e.g. power",
+                          "\\end{verbatim}", ""]
+            if p % 6 == 4:
+                parts += ["\\begin{equation}", "\\hat{y}_t = \\alpha y_{t-1} + (1 - \\alpha) \\hat{y}_{t-1}",
+                          "\\end{equation}", ""]
+        parts += [f"Inline icon \\includegraphics{{icon_{chapter}.png}} in the text.", ""]
+        parts += ["\\subsection{Conclusion}", "", self.paragraph(rng, chapter, section), ""]
+        parts += ["\\section*{References}", "\\begin{thebibliography}{9}"]
+        for k in range(1, 5):
+            parts.append(f"\\bibitem{{ref{chapter}_{section}_{k}}} Author {k}, {rng.choice(WORDS).title()} "
+                         f"{rng.choice(WORDS)}. Journal of {rng.choice(TOPICS)}, 20{10 + k}.")
+        parts.append("\\bibitem{shared} Shared, A. A reference cited in every section. 2019.")
+        parts += ["\\end{thebibliography}", ""]
+        return "\n".join(parts)
+
+    def manuscript(self):
+        rng = random.Random(self.seed)
+        lines = ["**Book Title:** Synthetic Benchmark Book", ""]
+        for chapter in range(1, self.chapters + 1):
+            lines += [f"### Chapter {chapter}: {rng.choice(TOPICS)} {chapter}", ""]
+            for section in range(1, self.sections + 1):
+                lines.append(f"* **{chapter}.{section} {rng.choice(TOPICS)} {rng.choice(WORDS)}**")
+            lines.append("")
+        return "\n".join(lines)
+
+    def write(self, book_dir):
+        """
+        Writes the book under book_dir/input. Returns the number of bytes of LaTeX written.
+        """
+        input_dir = os.path.join(book_dir, "input")
+        latex_dir = os.path.join(input_dir, "latex_files")
+        os.makedirs(latex_dir, exist_ok=True)
+        with open(os.path.join(input_dir, "Master Production Manuscript.txt"), 'w', encoding='utf-8') as f:
+            f.write(self.manuscript())
+
+        image = png_bytes(*self.image_size, seed=self.seed)
+        latex_bytes = 0
+        for chapter in range(1, self.chapters + 1):
+            chapter_dir = os.path.join(latex_dir, f"Chapter_{chapter}")
+            os.makedirs(os.path.join(chapter_dir, "images"), exist_ok=True)
+            with open(os.path.join(chapter_dir, f"icon_{chapter}.png"), 'wb') as f:
+                f.write(png_bytes(16, 16, seed=chapter))
+            for section in range(1, self.sections + 1):
+                source = self.section_source(chapter, section)
+                latex_bytes += len(source.encode('utf-8'))
+                with open(os.path.join(chapter_dir, f"Section_{chapter}.{section}.tex"), 'w', encoding='utf-8') as f:
+                    f.write(source)
+                for n in range(1, self.figures + 1):
+                    if n % 4 in (0, 2):
+                        # Named with a suffix so the "figure_N_M" prefix lookup is exercised
+                        # for every other image, and stored in images/ for the rest
+                        name = f"{figure_name(chapter, section, n, self.figures)}.png"
+                        folder = chapter_dir
+                        if n % 4 == 2:
+                            name = f"{figure_name(chapter, section, n, self.figures)}_plot.png"
+                        else:
+                            folder = os.path.join(chapter_dir, "images")
+                        with open(os.path.join(folder, name), 'wb') as f:
+                            f.write(image)
+        return latex_bytes
+
+
+def add_book_arguments(parser):
+    """
+    Adds the book size options shared by the benchmark scripts.
+    """
+    parser.add_argument("--chapters", type=int, default=10, help="Number of chapters (default: 10)")
+    parser.add_argument("--sections", type=int, default=8, help="Sections per chapter (default: 8)")
+    parser.add_argument("--paragraphs", type=int, default=12, help="Paragraphs per section (default: 12)")
+    parser.add_argument("--figures", type=int, default=4, help="Figure blocks per section (default: 4)")
+    parser.add_argument("--image-size", default="400x300", help="Pixel size of the figure images (default: 400x300)")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (default: 1)")
+
+
+def book_from_args(args):
+    width, height = (int(n) for n in args.image_size.lower().split('x'))
+    return SyntheticBook(args.chapters, args.sections, args.paragraphs, args.figures, (width, height), args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic book for the benchmarks.")
+    parser.add_argument("book_dir", help="Directory to write input/ into")
+    add_book_arguments(parser)
+    args = parser.parse_args()
+
+    book = book_from_args(args)
+    latex_bytes = book.write(args.book_dir)
+    print(f"Wrote {book.chapters} chapters x {book.sections} sections "
+          f"({latex_bytes / 1024:.0f} KB of LaTeX) to {os.path.join(args.book_dir, 'input')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+import difflib
+import json
+import os
+import re
+
+from rule_registry import prefix_pattern
+
+# Image lookup for \includegraphics.
+#
+# The file listings of every chapter directory of input/latex_files and its images/
+# subfolder are collected once per run and cached in output/.asset_index.json, keyed by
+# each directory's mtime (which changes whenever a file is added, removed or renamed).
+# A reference is resolved in its chapter: exact name, then the "figure_d_d" prefix, then
+# a ranked fuzzy match, and finally an exact name from another chapter. The resolved
+# absolute path is written into the LaTeX, so pandoc never has to search for images.
+
+ASSET_INDEX_FILENAME = ".asset_index.json"
+ASSET_INDEX_VERSION = 1
+IMAGES_SUBDIR = "images"
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.svg', '.pdf', '.eps', '.emf', '.wmf'}
+
+# Minimum similarity (difflib ratio of the lower-case names) for a fuzzy match. Names
+# must also carry the same numbers, so figure_1_9 never stands in for figure_1_8.
+FUZZY_CUTOFF = 0.8
+_numbers = re.compile(r'\d+')
+
+
+def latex_path(path):
+    """
+    A path as written inside \\includegraphics (forward slashes, also on Windows).
+    """
+    return path.replace(os.sep, '/')
+
+
+def _listing(path):
+    try:
+        return sorted(entry.name for entry in os.scandir(path) if entry.is_file())
+    except OSError:
+        return []
+
+
+class AssetIndex:
+    """
+    File listings of the chapter directories (and their images/ subfolders),
+    keyed by absolute directory path: {dir: {"mtime_ns": ..., "files": [...]}}.
+    """
+
+    def __init__(self, dirs=None):
+        self.dirs = dirs or {}
+        self._by_stem = None
+
+    @classmethod
+    def scan(cls, base_dir, known=None):
+        """
+        Lists every chapter directory under base_dir, reusing the known listing of any
+        directory whose mtime is unchanged. Returns (index, rescanned_count).
+        """
+        known = known or {}
+        dirs = {}
+        rescanned = 0
+        chapter_dirs = []
+        if os.path.isdir(base_dir):
+            chapter_dirs = [entry.path for entry in os.scandir(base_dir) if entry.is_dir()]
+        for chapter_dir in sorted(chapter_dirs):
+            for path in (chapter_dir, os.path.join(chapter_dir, IMAGES_SUBDIR)):
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                except OSError:
+                    continue
+                abs_path = os.path.abspath(path)
+                entry = known.get(abs_path)
+                if not entry or entry.get("mtime_ns") != mtime_ns:
+                    entry = {"mtime_ns": mtime_ns, "files": _listing(path)}
+                    rescanned += 1
+                dirs[abs_path] = entry
+        return cls(dirs), rescanned
+
+    def files_in(self, path):
+        """
+        The filenames of an indexed directory (listed directly if it is not indexed).
+        """
+        entry = self.dirs.get(os.path.abspath(path))
+        if entry is None:
+            return _listing(path)
+        return list(entry["files"])
+
+    def images_in(self, path):
+        return [os.path.join(os.path.abspath(path), f) for f in self.files_in(path)
+                if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS]
+
+    def images_by_stem(self):
+        """
+        The images of every indexed directory by lower-case name without extension,
+        built on first use.
+        """
+        if self._by_stem is None:
+            by_stem = {}
+            for directory in self.dirs:
+                for path in self.images_in(directory):
+                    by_stem.setdefault(_stem(path), []).append(path)
+            self._by_stem = by_stem
+        return self._by_stem
+
+    def chapter_images(self, chapter_dir, notes=None):
+        return ChapterImages(self, chapter_dir, notes)
+
+
+def load_asset_index(base_dir, output_dir):
+    """
+    Builds the asset index for base_dir, reusing and updating the on-disk cache.
+    """
+    cache_path = os.path.join(output_dir, ASSET_INDEX_FILENAME)
+    known = {}
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get("version") == ASSET_INDEX_VERSION:
+            known = cached.get("dirs", {})
+    except (OSError, ValueError):
+        pass
+
+    index, rescanned = AssetIndex.scan(base_dir, known)
+    if rescanned or set(known) != set(index.dirs):
+        os.makedirs(output_dir, exist_ok=True)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": ASSET_INDEX_VERSION, "dirs": index.dirs}, f)
+        os.replace(temp_path, cache_path)
+    print(f"Asset index: {len(index.dirs)} directories ({rescanned} rescanned)")
+    return index
+
+
+def _stem(path):
+    return os.path.splitext(os.path.basename(path))[0].lower()
+
+
+class ChapterImages:
+    """
+    Resolves image references of one chapter against the asset index.
+    Warnings are printed, or appended to notes when a list is given (see preflight).
+    """
+
+    def __init__(self, index, chapter_dir, notes=None):
+        self.index = index
+        self.notes = notes
+        self.chapter_dir = os.path.abspath(chapter_dir)
+        images = (index.images_in(self.chapter_dir)
+                  + index.images_in(os.path.join(self.chapter_dir, IMAGES_SUBDIR)))
+        self.by_stem = {}
+        self.by_prefix = {}
+        for path in images:
+            stem = _stem(path)
+            self.by_stem.setdefault(stem, []).append(path)
+            pmatch = prefix_pattern.match(stem)
+            if pmatch:
+                self.by_prefix.setdefault(pmatch.group(1), []).append(path)
+        self._warned = set()
+
+    def _warn(self, message):
+        if self.notes is None:
+            print(f"  Warning: {message}")
+        else:
+            self.notes.append(message)
+
+    def _warn_collision(self, ref_path, candidates, chosen):
+        key = (ref_path, tuple(candidates))
+        if key in self._warned:
+            return
+        self._warned.add(key)
+        names = ", ".join(os.path.relpath(c, self.chapter_dir) for c in candidates)
+        self._warn(f"'{ref_path}' matches several images ({names}); "
+                   f"using {os.path.relpath(chosen, self.chapter_dir)}")
+
+    def _pick(self, ref_path, candidates):
+        """
+        Ranks candidates for a reference: same extension first, then the chapter
+        directory before images/, then by name.
+        """
+        ref_ext = os.path.splitext(ref_path)[1].lower()
+
+        def rank(path):
+            return (os.path.splitext(path)[1].lower() != ref_ext,
+                    os.path.dirname(path) != self.chapter_dir,
+                    os.path.basename(path).lower())
+
+        ranked = sorted(candidates, key=rank)
+        if len(ranked) > 1:
+            self._warn_collision(ref_path, ranked, ranked[0])
+        return ranked[0]
+
+    def candidates(self, ref_path, limit=3):
+        """
+        Ranked fuzzy candidates (best first) among the chapter's images.
+        """
+        stem = _stem(ref_path)
+        numbers = [int(n) for n in _numbers.findall(stem)]
+        same_numbers = [name for name in self.by_stem if [int(n) for n in _numbers.findall(name)] == numbers]
+        names = difflib.get_close_matches(stem, same_numbers, n=limit, cutoff=FUZZY_CUTOFF)
+        return [path for name in names for path in self.by_stem[name]]
+
+    def find(self, ref_path):
+        """
+        The absolute path of the image a reference points to, or None.
+        """
+        stem = _stem(ref_path)
+        # 1. Exact match (any extension)
+        if stem in self.by_stem:
+            return self._pick(ref_path, self.by_stem[stem])
+        # 2. "figure_d_d" prefix
+        pmatch = prefix_pattern.match(stem)
+        if pmatch and pmatch.group(1) in self.by_prefix:
+            return self._pick(ref_path, self.by_prefix[pmatch.group(1)])
+        # 3. Closest name in the chapter
+        candidates = self.candidates(ref_path, limit=1)
+        if candidates:
+            chosen = self._pick(ref_path, candidates)
+            self._warn(f"no image named '{ref_path}', using closest match "
+                       f"{os.path.relpath(chosen, self.chapter_dir)}")
+            return chosen
+        # 4. Exact name in another chapter
+        own_dirs = (self.chapter_dir, os.path.join(self.chapter_dir, IMAGES_SUBDIR))
+        elsewhere = [path for path in self.index.images_by_stem().get(stem, [])
+                     if os.path.dirname(path) not in own_dirs]
+        if len(elsewhere) == 1:
+            self._warn(f"image '{ref_path}' found in another chapter: {elsewhere[0]}")
+            return elsewhere[0]
+        return None
@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import re
+import unicodedata
+
+# Book-wide bibliography index for the publisher converter.
+#
+# Each chapter's thebibliography blocks are collected into one References section. An
+# entry is identified by a hash of its authors' surnames, year and title rather than by
+# its \bibitem key, so the same reference typed with different keys, LaTeX markup,
+# punctuation, case or publisher details is listed once. Entries whose authors, year
+# or title differ are always kept apart. Entries are listed in author-year order.
+#
+# The index (output/.bibliography.json) keeps, for every chapter, the entries its
+# current sources cite, and from those every entry of the book with its sort key and
+# the chapters citing it. The normalization of every raw entry text is looked up there,
+# so a handbook with thousands of references is not re-normalized on every build. A
+# chapter always renders the entry texts of its own sources. Chapters are converted in
+# worker processes with a read-only copy of the index; convert_book replaces the
+# entries of each converted chapter with what it found and saves it.
+
+BIBLIOGRAPHY_FILENAME = ".bibliography.json"
+# Bump when entries are identified differently
+BIBLIOGRAPHY_VERSION = 2
+
+_LATEX_MARKUP = re.compile(r'\\[a-zA-Z]+\*?|\\.|[{}~$]')
+_NON_WORD = re.compile(r'[^\w\s]')
+_SPACES = re.compile(r'\s+')
+_YEAR = re.compile(r'\b(1[5-9]\d\d|20\d\d)[a-z]?\b')
+# End of the author list: the parenthesis before the year, a full stop after a word, or
+# a comma or a full stop after an initial unless the list goes on with "and", "&", a
+# comma or another name ("Smith, J. and Jones, A.", "J. K. Rowling", "Doe, Jane (2019)")
+_AUTHOR_END = re.compile(r"\((?=\s*\d)|(?<=\w\w)\.|(?:(?<![\w.])\w\.|,)"
+                         r"(?!\s*(?:and\b|&|,|[A-Z][\w'-]*\s*(?:,|\.|\(|and\b|&)))")
+# What may stand between the author list and the year ("Smith, J. (2020)", "Smith, J., 2020")
+_AUTHOR_YEAR_GAP = re.compile(r'[\s(),.]*')
+# Words of an author list that are not surnames
+_NOT_SURNAMES = {"and", "et", "al"}
+
+
+def _text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+
+
+def normalize_text(text):
+    """
+    Lower-case words without LaTeX markup, accents or punctuation.
+    """
+    text = _LATEX_MARKUP.sub(' ', text)
+    text = unicodedata.normalize('NFKD', text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return _SPACES.sub(' ', _NON_WORD.sub(' ', text.lower())).strip()
+
+
+def entry_fields(text):
+    """
+    (authors, year, short title, title) of a plain-text bibliography entry, normalized.
+    The author list runs to the first full stop or comma that is not followed by more
+    names (or to the year right after it), the year is the first 4-digit year and
+    the title the first following sentence that is not just the year; the short title
+    is the title up to its first comma. Entries without that shape still get a stable
+    key from their whole text.
+    """
+    plain = _LATEX_MARKUP.sub(' ', text)
+    year_match = _YEAR.search(plain)
+    year = year_match.group(1) if year_match else ""
+    author_end = _AUTHOR_END.search(plain)
+    if author_end is None:
+        whole = normalize_text(plain)
+        return whole, year, whole, whole
+    authors, rest = plain[:author_end.end()], plain[author_end.end():]
+    # "Smith, J. (2020). Title." and "Smith, J., 2020. Title.": the title follows the year
+    if year_match and (year_match.start() < author_end.start()
+                       or _AUTHOR_YEAR_GAP.fullmatch(plain, author_end.end(), year_match.start())):
+        authors = plain[:min(author_end.end(), year_match.start())]
+        rest = plain[max(author_end.end(), year_match.end()):]
+    sentences = (_YEAR.sub(' ', s) for s in rest.split('.'))
+    title = next((s for s in sentences if len(normalize_text(s)) > 3), "")
+    if not title:
+        whole = normalize_text(plain)
+        return normalize_text(authors), year, whole, whole
+    return normalize_text(authors), year, normalize_text(title.split(',')[0]), normalize_text(title)
+
+
+def normalize_entry(text):
+    """
+    (entry id, sort key) of a bibliography entry: the id hashes the authors' surnames
+    (so "Smith, J." and "J. Smith" agree), year and short title, the sort key orders by
+    authors, then year, then title.
+    """
+    authors, year, short_title, title = entry_fields(text)
+    surnames = " ".join(w for w in authors.split() if len(w) > 1 and w not in _NOT_SURNAMES)
+    entry_id = _text_hash(f"{surnames}\x1f{year}\x1f{short_title}")
+    return entry_id, [authors, year or "9999", title]
+
+
+def titles_agree(title, other):
+    """
+    Whether two normalized titles are the same, one possibly followed by more words
+    ("deep learning" and "deep learning mit press", not "deep learning part i" and
+    "deep learning part ii").
+    """
+    words, other_words = title.split(), other.split()
+    return words[:len(other_words)] == other_words[:len(words)]
+
+
+class BibliographyIndex:
+    """
+    chapters: chapter number (str) -> the chapter's ChapterReferences.snapshot()
+    entries:  entry id -> {"text", "sort_key", "keys", "chapters"}, built from the chapters
+    texts:    hash of a raw entry text -> [entry id, sort key], built from the chapters
+    """
+
+    def __init__(self, chapters=None):
+        self.chapters = chapters or {}
+        self.entries = {}
+        self.texts = {}
+        self.rebuild()
+
+    def rebuild(self):
+        # In chapter order, so an entry cited by several chapters takes its text from
+        # the first of them
+        self.entries = {}
+        self.texts = {}
+        for chapter in sorted(self.chapters, key=int):
+            references = self.chapters[chapter]
+            self.texts.update(references["texts"])
+            for entry_id, found in references["entries"].items():
+                entry = self.entries.setdefault(entry_id, {
+                    "text": found["text"], "sort_key": found["sort_key"], "keys": [], "chapters": []})
+                entry["keys"] = sorted(set(entry["keys"]) | set(found["keys"]))
+                entry["chapters"].append(int(chapter))
+
+    @classmethod
+    def load(cls, output_dir):
+        path = os.path.join(output_dir, BIBLIOGRAPHY_FILENAME)
+        if not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"  Warning: Ignoring unreadable bibliography index {path}: {e}")
+            return cls()
+        if data.get("version") != BIBLIOGRAPHY_VERSION:
+            return cls()
+        return cls(data.get("chapters"))
+
+    def save(self, output_dir):
+        path = os.path.join(output_dir, BIBLIOGRAPHY_FILENAME)
+        temp_path = path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": BIBLIOGRAPHY_VERSION, "chapters": self.chapters, "entries": self.entries},
+                      f, indent=1, sort_keys=True)
+        os.replace(temp_path, path)
+
+    def normalize(self, text):
+        """
+        (entry id, sort key) of a raw entry text, from the index when it was seen before.
+        """
+        known = self.texts.get(_text_hash(text))
+        if known is not None:
+            return known[0], known[1]
+        return normalize_entry(text)
+
+    def merge(self, chapter_num, references):
+        """
+        Replaces what the index holds for a chapter with the references it collected
+        from its current sources (ChapterReferences.snapshot()). Entries no chapter
+        cites any more are dropped, as is a chapter without references.
+        """
+        if references["entries"]:
+            self.chapters[str(chapter_num)] = references
+        else:
+            self.chapters.pop(str(chapter_num), None)
+        self.rebuild()
+
+    def retain(self, chapter_numbers):
+        """
+        Drops the chapters that are no longer in the book.
+        """
+        keep = {str(n) for n in chapter_numbers}
+        for chapter in list(self.chapters):
+            if chapter not in keep:
+                del self.chapters[chapter]
+        self.rebuild()
+
+
+class ChapterReferences:
+    """
+    The references of one chapter, de-duplicated by \\bibitem key and by entry id. Two
+    entries only share an id when their authors, year and titles agree (titles_agree).
+    """
+
+    def __init__(self, index=None):
+        self.index = index or BibliographyIndex()
+        self.keys = set()
+        self.entries = {}
+        self.texts = {}
+        self.duplicates = 0
+
+    def add(self, key, text):
+        if key in self.keys:
+            return
+        self.keys.add(key)
+        entry_id, sort_key = self.index.normalize(text)
+        self.texts[_text_hash(text)] = [entry_id, sort_key]
+        entry = self.entries.get(entry_id)
+        if entry is not None and not titles_agree(entry["sort_key"][2], sort_key[2]):
+            # Same authors, year and title up to its first comma, but another title
+            entry_id = _text_hash(f"{entry_id}\x1f{sort_key[2]}")
+            entry = self.entries.get(entry_id)
+        if entry is not None:
+            entry["keys"].append(key)
+            self.duplicates += 1
+            return
+        self.entries[entry_id] = {"text": text, "sort_key": sort_key, "keys": [key]}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def sorted_texts(self):
+        return [entry["text"] for entry in sorted(self.entries.values(), key=lambda e: e["sort_key"])]
+
+    def render(self):
+        """
+        The chapter's References section as LaTeX, in author-year order.
+        """
+        items = "".join(f"\\item {text}\n" for text in self.sorted_texts())
+        return f"\n\\newpage\n\\section*{{References}}\n\\begin{{itemize}}\n{items}\\end{{itemize}}\n"
+
+    def snapshot(self):
+        """
+        What convert_book merges into the book index (plain dicts for the worker result).
+        """
+        return {"entries": self.entries, "texts": self.texts}
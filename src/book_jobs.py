@@ -0,0 +1,186 @@
+import gzip
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+def parse_chapter_spec(spec):
+    """
+    Parses a chapter list such as "1-5,8" into a sorted list of chapter numbers.
+    """
+    numbers = set()
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            start, end = part.split('-', 1)
+            start, end = int(start), int(end)
+            if start > end:
+                raise ValueError(f"Invalid chapter range: {part}")
+            numbers.update(range(start, end + 1))
+        else:
+            numbers.add(int(part))
+    return sorted(numbers)
+
+
+# chapter_numbers_from_args without a selection: the first chapter in the metadata, the
+# converters' default from before --chapters/--all
+FIRST_CHAPTER = "first"
+
+
+def chapter_numbers_from_args(args):
+    """
+    Resolves --chapter / --chapters / --all into a list of chapter numbers.
+    Returns None when every chapter should be built (also for --watch and --check without
+    a selection) and FIRST_CHAPTER when nothing was selected.
+    """
+    if getattr(args, 'all', False):
+        return None
+    if getattr(args, 'chapters', None):
+        try:
+            return parse_chapter_spec(args.chapters)
+        except ValueError as e:
+            print(f"Error: Could not parse --chapters '{args.chapters}': {e}")
+            sys.exit(1)
+    if getattr(args, 'chapter', None) is not None:
+        return [args.chapter]
+    if getattr(args, 'watch', False) or getattr(args, 'check', False):
+        return None
+    print("No chapter selected, converting the first chapter (use --chapters or --all for more).")
+    return FIRST_CHAPTER
+
+
+def add_chapter_arguments(parser):
+    """
+    Adds the chapter selection and parallelism options shared by the converters.
+    """
+    parser.add_argument("--chapter", type=int, help="Specific chapter number to convert (e.g. 1)")
+    parser.add_argument("--chapters", help="Chapter list to convert, e.g. 1-5,8")
+    parser.add_argument("--all", action="store_true", help="Convert every chapter in the metadata")
+    parser.add_argument("--jobs", type=int,
+                        help="Number of chapters to convert in parallel (default: CPU count; "
+                             "a single chapter always runs in this process)")
+
+
+def job_count(jobs):
+    """
+    The number of parallel jobs for a --jobs value; None (not given) means one per CPU.
+    """
+    return jobs if jobs is not None else os.cpu_count() or 1
+
+
+def sanitize_title(title):
+    """
+    A title as used in output filenames: letters, digits, "_" and "-", spaces as "_".
+    """
+    sanitized = "".join(c for c in title if c.isalnum() or c in (' ', '_', '-')).strip()
+    return sanitized.replace(" ", "_")
+
+
+# --debug-tex: how the assembled chapter LaTeX is kept next to the .docx
+DEBUG_TEX_MODES = ("off", "plain", "gzip")
+
+
+def write_debug_tex(docx_path, latex, mode="plain"):
+    """
+    Saves the LaTeX a chapter was built from as <name>.tex (or <name>.tex.gz).
+    Returns the path written, or None when mode is "off".
+    """
+    if mode == "off":
+        return None
+    tex_path = os.path.splitext(docx_path)[0] + ".tex"
+    if mode == "gzip":
+        tex_path += ".gz"
+        with gzip.open(tex_path, 'wt', encoding='utf-8') as f:
+            f.write(latex)
+    else:
+        with open(tex_path, 'w', encoding='utf-8') as f:
+            f.write(latex)
+    return tex_path
+
+
+def select_chapters(chapters, chapter_numbers):
+    """
+    Filters the metadata chapters down to the requested numbers, keeping metadata order.
+    """
+    if chapter_numbers is None:
+        return list(chapters)
+    if chapter_numbers == FIRST_CHAPTER:
+        return list(chapters[:1])
+
+    wanted = set(chapter_numbers)
+    selected = [c for c in chapters if c['number'] in wanted]
+    missing = wanted - {c['number'] for c in selected}
+    for num in sorted(missing):
+        print(f"Error: Chapter {num} not found in metadata.")
+    return selected
+
+
+def run_chapter_jobs(worker, chapters, output_dir, jobs=1, options=None, on_result=None,
+                     initializer=None, initargs=()):
+    """
+    Runs worker(chapter, output_dir, options) for every chapter.
+
+    With jobs > 1 the chapters are spread over a process pool, each process doing the
+    preprocessing, pandoc call and post-processing for its own chapter.
+    initializer(*initargs) is called once in every process that runs chapters (e.g.
+    pandoc_runner.configure). on_result(chapter, result) is called in this process as
+    each chapter finishes. Ctrl+C cancels the chapters that have not started.
+    Returns (results, failed_chapter_numbers) with results in metadata order.
+    """
+    options = options or {}
+    jobs = job_count(jobs)
+    if jobs <= 1 or len(chapters) <= 1:
+        if initializer:
+            initializer(*initargs)
+        results = []
+        failed = []
+        for chapter in chapters:
+            chapter_num = chapter['number']
+            try:
+                result = worker(chapter, output_dir, options)
+                if on_result:
+                    on_result(chapter, result)
+                results.append(result)
+            except SystemExit:
+                # Same as in the pool below: a failing chapter does not stop the others
+                print(f"FAILED: Chapter {chapter_num} (see errors above)")
+                failed.append(chapter_num)
+            except Exception as e:
+                print(f"FAILED: Chapter {chapter_num}: {e}")
+                failed.append(chapter_num)
+        return results, failed
+
+    workers = min(jobs, len(chapters))
+    print(f"Converting {len(chapters)} chapters with {workers} parallel jobs...")
+
+    results = {}
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as executor:
+        futures = {executor.submit(worker, chapter, output_dir, options): chapter for chapter in chapters}
+        try:
+            for future in as_completed(futures):
+                chapter = futures[future]
+                chapter_num = chapter['number']
+                try:
+                    results[chapter_num] = future.result()
+                    if on_result:
+                        on_result(chapter, results[chapter_num])
+                    print(f"Finished Chapter {chapter_num}")
+                except SystemExit:
+                    # Workers keep the strict sys.exit(1) error handling of the serial path
+                    print(f"FAILED: Chapter {chapter_num} (see errors above)")
+                    failed.append(chapter_num)
+                except Exception as e:
+                    print(f"FAILED: Chapter {chapter_num}: {e}")
+                    failed.append(chapter_num)
+        except KeyboardInterrupt:
+            # Queued chapters are dropped; the running ones stop on the same Ctrl+C
+            # (pandoc_runner kills their pandoc processes)
+            print("Interrupted, cancelling the remaining chapters...")
+            executor.shutdown(wait=True, cancel_futures=True)
+            raise
+
+    ordered = [results[c['number']] for c in chapters if c['number'] in results]
+    return ordered, sorted(failed)
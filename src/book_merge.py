@@ -0,0 +1,516 @@
+import hashlib
+import importlib.util
+import json
+import os
+import posixpath
+import zipfile
+
+from book_jobs import sanitize_title
+from ooxml_stream import (CONTENT_TYPES_PART, DOCUMENT_PART, DOCUMENT_RELS_PART, NUMBERING_PART, STYLES_PART,
+                          iter_body_children, qualified_name, strip_declared)
+
+# Book assembly from the chapter .docx files.
+#
+# The chapters are merged at the OOXML level instead of running pandoc over the whole
+# manuscript, so rebuilding the book after editing one chapter costs one chapter
+# conversion plus this merge. The body of every chapter's document.xml is streamed
+# into the book's document.xml (see ooxml_stream.iter_body_children) and each chapter
+# ends with a section break, so the book never sits in memory as python-docx objects.
+# The small parts are reconciled: styles missing from the first chapter are added,
+# list (numbering) definitions and footnotes are renumbered, relationship ids, bookmark
+# ids/names and drawing ids are made unique, and images with the same content are
+# stored once.
+
+W = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+WP = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+PACKAGE_RELS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CONTENT_TYPES = "http://schemas.openxmlformats.org/package/2006/content-types"
+
+FOOTNOTES_PART = "word/footnotes.xml"
+FOOTNOTES_RELS_PART = "word/_rels/footnotes.xml.rels"
+
+# Relationships of document.xml that belong to the document as a whole; they are taken
+# from the first chapter. Everything else (images, hyperlinks, headers, footers) is
+# referenced from the body and copied per chapter.
+DOCUMENT_LEVEL_RELATIONSHIPS = {
+    "styles", "numbering", "settings", "webSettings", "fontTable", "theme", "footnotes", "endnotes",
+    "comments", "customXml", "glossaryDocument", "stylesWithEffects",
+}
+
+
+def _w(name):
+    return f"{{{W}}}{name}"
+
+
+def book_output_path(book_title, output_dir):
+    return os.path.join(output_dir, f"{sanitize_title(book_title) or 'Book'}.docx")
+
+
+def _relationship_kind(rel):
+    return rel.get('Type', '').rsplit('/', 1)[-1]
+
+
+def _parse(zin, name):
+    from lxml import etree
+
+    if name not in zin.namelist():
+        return None
+    return etree.fromstring(zin.read(name))
+
+
+def _serialize(element):
+    from lxml import etree
+
+    return etree.tostring(element, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+
+class _Chapter:
+    """
+    One chapter package: its relationships and content types, plus the id maps used
+    to rewrite its body into the book.
+    """
+
+    def __init__(self, number, path, zin):
+        self.number = number
+        self.path = path
+        self.zin = zin
+        self.names = set(zin.namelist())
+        rels = _parse(zin, DOCUMENT_RELS_PART)
+        self.rels = {rel.get('Id'): rel for rel in rels} if rels is not None else {}
+        footnote_rels = _parse(zin, FOOTNOTES_RELS_PART)
+        self.footnote_rels = {rel.get('Id'): rel for rel in footnote_rels} if footnote_rels is not None else {}
+        self.defaults = {}
+        self.overrides = {}
+        types = _parse(zin, CONTENT_TYPES_PART)
+        for entry in types if types is not None else []:
+            if entry.tag == f"{{{CONTENT_TYPES}}}Default":
+                self.defaults[entry.get('Extension').lower()] = entry.get('ContentType')
+            elif entry.tag == f"{{{CONTENT_TYPES}}}Override":
+                self.overrides[entry.get('PartName').lstrip('/')] = entry.get('ContentType')
+        # old id -> new id in the book
+        self.rel_map = {"document": {}, "footnotes": {}}
+        self.num_map = {}
+        self.footnote_map = {}
+        self.bookmark_map = {}
+        self.bookmark_offset = 0
+
+    def part_name(self, rel, source_part=DOCUMENT_PART):
+        target = rel.get('Target')
+        if target.startswith('/'):
+            return target.lstrip('/')
+        return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+    def content_type(self, part):
+        if part in self.overrides:
+            return None, self.overrides[part]
+        extension = posixpath.splitext(part)[1].lstrip('.').lower()
+        return extension, self.defaults.get(extension)
+
+
+class BookMerger:
+    """
+    Streams chapter documents into one book package (an open zipfile for writing).
+    """
+
+    def __init__(self, zout):
+        from lxml import etree
+
+        self.zout = zout
+        self.rels = etree.Element(f"{{{PACKAGE_RELS}}}Relationships", nsmap={None: PACKAGE_RELS})
+        self.footnote_rels = etree.Element(f"{{{PACKAGE_RELS}}}Relationships", nsmap={None: PACKAGE_RELS})
+        self.rel_ids = set()
+        self.footnote_rel_ids = set()
+        self.defaults = {}
+        self.overrides = {}
+        self.parts = set()
+        self.by_digest = {}
+        # (chapter path, part in the chapter, part in the book), copied after document.xml
+        self.pending = []
+        self.styles = None
+        self.numbering = None
+        self.footnotes = None
+        self.bookmark_names = set()
+        self.max_bookmark_id = -1
+        self.next_drawing_id = 1
+        self.declared = None
+        self.body_prefix = None
+
+    # -- parts and relationships ----------------------------------------------------
+
+    def _unique_part(self, part, chapter):
+        if part not in self.parts:
+            return part
+        directory, name = posixpath.split(part)
+        candidate = posixpath.join(directory, f"c{chapter.number}_{name}")
+        n = 1
+        while candidate in self.parts:
+            n += 1
+            candidate = posixpath.join(directory, f"c{chapter.number}_{n}_{name}")
+        return candidate
+
+    def _add_content_type(self, chapter, source_part, part):
+        extension, content_type = chapter.content_type(source_part)
+        if content_type is None:
+            return
+        if extension is None:
+            self.overrides[part] = content_type
+        else:
+            self.defaults.setdefault(extension, content_type)
+
+    def place_part(self, chapter, source_part):
+        """
+        The book part for a chapter part; parts with identical content (the same image
+        used in several chapters, identical footers) are stored once.
+        """
+        digest = hashlib.sha256()
+        with chapter.zin.open(source_part) as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        key = (digest.hexdigest(), posixpath.splitext(source_part)[1].lower())
+        if key in self.by_digest:
+            return self.by_digest[key]
+        part = self._unique_part(source_part, chapter)
+        self.parts.add(part)
+        self.by_digest[key] = part
+        self.pending.append((chapter.path, source_part, part))
+        self._add_content_type(chapter, source_part, part)
+        rels_part = posixpath.join(posixpath.dirname(source_part), "_rels", posixpath.basename(source_part) + ".rels")
+        if rels_part in chapter.names:
+            book_rels = posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+            self.parts.add(book_rels)
+            self.pending.append((chapter.path, rels_part, book_rels))
+        return part
+
+    def _new_relationship(self, rels, ids, chapter, rel, source_part):
+        from lxml import etree
+
+        new_id = f"c{chapter.number}{rel.get('Id')}"
+        while new_id in ids:
+            new_id += "_"
+        ids.add(new_id)
+        attributes = {"Id": new_id, "Type": rel.get('Type')}
+        if rel.get('TargetMode') == 'External':
+            attributes["Target"] = rel.get('Target')
+            attributes["TargetMode"] = 'External'
+        else:
+            part = self.place_part(chapter, chapter.part_name(rel, source_part))
+            attributes["Target"] = posixpath.relpath(part, posixpath.dirname(source_part))
+        etree.SubElement(rels, f"{{{PACKAGE_RELS}}}Relationship", attrib=attributes)
+        return new_id
+
+    def relationship(self, chapter, old_id, source):
+        """
+        The book relationship id for a chapter's relationship id (copying the target
+        part on first use). source is "document" or "footnotes".
+        """
+        mapping = chapter.rel_map[source]
+        if old_id in mapping:
+            return mapping[old_id]
+        if source == "document":
+            rel = chapter.rels.get(old_id)
+            rels, ids, source_part = self.rels, self.rel_ids, DOCUMENT_PART
+        else:
+            rel = chapter.footnote_rels.get(old_id)
+            rels, ids, source_part = self.footnote_rels, self.footnote_rel_ids, FOOTNOTES_PART
+        if rel is None:
+            return old_id
+        if _relationship_kind(rel) in DOCUMENT_LEVEL_RELATIONSHIPS:
+            # Points at a part the book takes from the first chapter
+            for book_rel in self.rels:
+                if book_rel.get('Type') == rel.get('Type'):
+                    mapping[old_id] = book_rel.get('Id')
+                    return mapping[old_id]
+        mapping[old_id] = self._new_relationship(rels, ids, chapter, rel, source_part)
+        return mapping[old_id]
+
+    # -- the first chapter provides the document-level parts -------------------------
+
+    def start_book(self, chapter):
+        from lxml import etree
+
+        body_targets = set()
+        for rel in chapter.rels.values():
+            if _relationship_kind(rel) in DOCUMENT_LEVEL_RELATIONSHIPS:
+                etree.SubElement(self.rels, f"{{{PACKAGE_RELS}}}Relationship", attrib=dict(rel.attrib))
+                self.rel_ids.add(rel.get('Id'))
+            elif rel.get('TargetMode') != 'External':
+                body_targets.add(chapter.part_name(rel))
+        for rel in chapter.footnote_rels.values():
+            etree.SubElement(self.footnote_rels, f"{{{PACKAGE_RELS}}}Relationship", attrib=dict(rel.attrib))
+            self.footnote_rel_ids.add(rel.get('Id'))
+            chapter.rel_map["footnotes"][rel.get('Id')] = rel.get('Id')
+
+        self.styles = _parse(chapter.zin, STYLES_PART)
+        self.numbering = _parse(chapter.zin, NUMBERING_PART)
+        self.footnotes = _parse(chapter.zin, FOOTNOTES_PART)
+        merged = {DOCUMENT_PART, DOCUMENT_RELS_PART, CONTENT_TYPES_PART, STYLES_PART, NUMBERING_PART,
+                  FOOTNOTES_PART, FOOTNOTES_RELS_PART}
+        self.defaults.update(chapter.defaults)
+        for name in sorted(chapter.names - merged - body_targets):
+            if name.endswith('/'):
+                continue
+            self.parts.add(name)
+            self.pending.append((chapter.path, name, name))
+            if name in chapter.overrides:
+                self.overrides[name] = chapter.overrides[name]
+        for name in (DOCUMENT_PART, STYLES_PART, NUMBERING_PART, FOOTNOTES_PART):
+            if name in chapter.overrides:
+                self.overrides[name] = chapter.overrides[name]
+        self.parts.update(merged)
+
+        # The first chapter keeps its list and footnote ids
+        if self.numbering is not None:
+            chapter.num_map = {n.get(_w('numId')): n.get(_w('numId')) for n in self.numbering.iter(_w('num'))}
+        if self.footnotes is not None:
+            chapter.footnote_map = {f.get(_w('id')): f.get(_w('id')) for f in self.footnotes.iter(_w('footnote'))}
+
+    # -- styles, numbering and footnotes of the following chapters --------------------
+
+    def merge_numbering(self, chapter):
+        numbering = _parse(chapter.zin, NUMBERING_PART)
+        if numbering is None:
+            return
+        if self.numbering is None:
+            print(f"  Warning: Chapter {chapter.number} has lists but the first chapter has no numbering part; "
+                  "its lists lose their numbering.")
+            return
+        abstract_ids = [int(a.get(_w('abstractNumId'))) for a in self.numbering.iter(_w('abstractNum'))]
+        num_ids = [int(n.get(_w('numId'))) for n in self.numbering.iter(_w('num'))]
+        next_abstract = max(abstract_ids, default=-1) + 1
+        next_num = max(num_ids, default=0) + 1
+        first_num = next(self.numbering.iter(_w('num')), None)
+
+        abstract_map = {}
+        for abstract in list(numbering.iter(_w('abstractNum'))):
+            abstract_map[abstract.get(_w('abstractNumId'))] = str(next_abstract)
+            abstract.set(_w('abstractNumId'), str(next_abstract))
+            # Lists with the same nsid would be continued across chapters
+            nsid = abstract.find(_w('nsid'))
+            if nsid is not None:
+                nsid.set(_w('val'), f"{next_abstract:08X}")
+            if first_num is not None:
+                first_num.addprevious(abstract)
+            else:
+                self.numbering.append(abstract)
+            next_abstract += 1
+        for num in list(numbering.iter(_w('num'))):
+            chapter.num_map[num.get(_w('numId'))] = str(next_num)
+            num.set(_w('numId'), str(next_num))
+            abstract_ref = num.find(_w('abstractNumId'))
+            if abstract_ref is not None:
+                abstract_ref.set(_w('val'), abstract_map.get(abstract_ref.get(_w('val')), abstract_ref.get(_w('val'))))
+            self.numbering.append(num)
+            next_num += 1
+
+    def merge_styles(self, chapter):
+        styles = _parse(chapter.zin, STYLES_PART)
+        if styles is None or self.styles is None:
+            return
+        known = {style.get(_w('styleId')) for style in self.styles.iter(_w('style'))}
+        for style in list(styles.iter(_w('style'))):
+            if style.get(_w('styleId')) not in known:
+                self.rewrite(chapter, style)
+                self.styles.append(style)
+
+    def merge_footnotes(self, chapter):
+        footnotes = _parse(chapter.zin, FOOTNOTES_PART)
+        if footnotes is None:
+            return
+        if self.footnotes is None:
+            print(f"  Warning: Chapter {chapter.number} has footnotes but the first chapter has no footnotes part; "
+                  "they are dropped.")
+            return
+        next_id = max((int(f.get(_w('id'))) for f in self.footnotes.iter(_w('footnote'))), default=0) + 1
+        for footnote in list(footnotes.iter(_w('footnote'))):
+            if footnote.get(_w('type')) not in (None, 'normal'):
+                # Separators come from the first chapter
+                continue
+            chapter.footnote_map[footnote.get(_w('id'))] = str(next_id)
+            footnote.set(_w('id'), str(next_id))
+            self.rewrite(chapter, footnote, source="footnotes")
+            self.footnotes.append(footnote)
+            next_id += 1
+
+    # -- body ------------------------------------------------------------------------
+
+    def rewrite(self, chapter, element, source="document"):
+        """
+        Rewrites the ids in a chapter subtree to the book's ids.
+        """
+        for node in element.iter():
+            tag = node.tag
+            if not isinstance(tag, str):
+                continue
+            for name, value in node.attrib.items():
+                if name.startswith(f"{{{R}}}"):
+                    node.set(name, self.relationship(chapter, value, source))
+            if tag == _w('numId'):
+                value = node.get(_w('val'))
+                node.set(_w('val'), chapter.num_map.get(value, value))
+            elif tag == _w('bookmarkStart') or tag == _w('bookmarkEnd'):
+                bookmark_id = int(node.get(_w('id'), 0)) + chapter.bookmark_offset
+                node.set(_w('id'), str(bookmark_id))
+                self.max_bookmark_id = max(self.max_bookmark_id, bookmark_id)
+                if node.get(_w('name')) is not None:
+                    node.set(_w('name'), self.bookmark_name(chapter, node.get(_w('name'))))
+            elif tag == _w('hyperlink') and node.get(_w('anchor')) is not None:
+                node.set(_w('anchor'), self.bookmark_name(chapter, node.get(_w('anchor'))))
+            elif tag == _w('footnoteReference'):
+                value = node.get(_w('id'))
+                node.set(_w('id'), chapter.footnote_map.get(value, value))
+            elif tag == f"{{{WP}}}docPr":
+                node.set('id', str(self.next_drawing_id))
+                self.next_drawing_id += 1
+
+    def bookmark_name(self, chapter, name):
+        """
+        Bookmark (and link anchor) names taken by an earlier chapter get a chapter
+        suffix, the same way pandoc de-duplicates identifiers.
+        """
+        if name in chapter.bookmark_map:
+            return chapter.bookmark_map[name]
+        new_name = name
+        if name in self.bookmark_names and not name.startswith('_'):
+            new_name = f"{name}-c{chapter.number}"
+        chapter.bookmark_map[name] = new_name
+        return new_name
+
+    def write_body(self, chapter, out, last):
+        """
+        Streams the chapter body into the book's document.xml. The chapter's final
+        section properties become a section break unless it is the last chapter.
+        """
+        from lxml import etree
+
+        sectPr_tag = _w('sectPr')
+        with chapter.zin.open(DOCUMENT_PART) as stream:
+            for root, body, child in iter_body_children(stream):
+                if self.declared is None:
+                    self.declared = dict(root.nsmap)
+                    self.body_prefix = body.prefix
+                    shell = etree.Element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+                    out.write(b"<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n")
+                    out.write(etree.tostring(shell)[:-2] + b'>')
+                    for sibling in root:
+                        if sibling is body:
+                            break
+                        out.write(strip_declared(etree.tostring(sibling), self.declared))
+                    out.write(f"<{qualified_name(body)}>".encode())
+
+                self.rewrite(chapter, child)
+                xml = strip_declared(etree.tostring(child), self.declared)
+                if child.tag == sectPr_tag and not last:
+                    prefix = f"{self.body_prefix}:" if self.body_prefix else ""
+                    xml = f"<{prefix}p><{prefix}pPr>".encode() + xml + f"</{prefix}pPr></{prefix}p>".encode()
+                out.write(xml)
+        self.bookmark_names.update(chapter.bookmark_map.values())
+
+    def add_chapter(self, number, path, out, last):
+        with zipfile.ZipFile(path) as zin:
+            chapter = _Chapter(number, path, zin)
+            if self.declared is None:
+                self.start_book(chapter)
+            else:
+                self.merge_numbering(chapter)
+                self.merge_styles(chapter)
+                self.merge_footnotes(chapter)
+            chapter.bookmark_offset = self.max_bookmark_id + 1
+            self.write_body(chapter, out, last)
+
+    def finish(self, out):
+        if self.declared is not None:
+            root_prefix = f"{self.body_prefix}:" if self.body_prefix else ""
+            out.write(f"</{root_prefix}body></{root_prefix}document>".encode())
+
+    def write_parts(self):
+        """
+        Writes the reconciled parts and copies the chapter parts collected while
+        streaming the bodies.
+        """
+        from lxml import etree
+
+        zout = self.zout
+        zout.writestr(DOCUMENT_RELS_PART, _serialize(self.rels))
+        if self.styles is not None:
+            zout.writestr(STYLES_PART, _serialize(self.styles))
+        if self.numbering is not None:
+            zout.writestr(NUMBERING_PART, _serialize(self.numbering))
+        if self.footnotes is not None:
+            zout.writestr(FOOTNOTES_PART, _serialize(self.footnotes))
+            if len(self.footnote_rels):
+                zout.writestr(FOOTNOTES_RELS_PART, _serialize(self.footnote_rels))
+
+        types = etree.Element(f"{{{CONTENT_TYPES}}}Types", nsmap={None: CONTENT_TYPES})
+        for extension, content_type in sorted(self.defaults.items()):
+            etree.SubElement(types, f"{{{CONTENT_TYPES}}}Default", Extension=extension, ContentType=content_type)
+        for part, content_type in sorted(self.overrides.items()):
+            etree.SubElement(types, f"{{{CONTENT_TYPES}}}Override", PartName=f"/{part}", ContentType=content_type)
+        zout.writestr(CONTENT_TYPES_PART, _serialize(types))
+
+        by_chapter = {}
+        for chapter_path, source, part in self.pending:
+            by_chapter.setdefault(chapter_path, []).append((source, part))
+        for chapter_path, copies in by_chapter.items():
+            with zipfile.ZipFile(chapter_path) as zin:
+                for source, part in copies:
+                    with zin.open(source) as src, zout.open(part, 'w') as dst:
+                        for block in iter(lambda: src.read(1 << 20), b''):
+                            dst.write(block)
+
+
+def merge_docx(chapter_paths, output_path):
+    """
+    Merges the chapter .docx files (in order) into one book .docx at output_path.
+    """
+    if importlib.util.find_spec("docx") is None or importlib.util.find_spec("lxml") is None:
+        print("  Warning: python-docx not installed. Skipping book assembly.")
+        return False
+
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zout:
+            merger = BookMerger(zout)
+            with zout.open(DOCUMENT_PART, 'w') as out:
+                for i, path in enumerate(chapter_paths):
+                    merger.add_chapter(i + 1, path, out, last=(i == len(chapter_paths) - 1))
+                merger.finish(out)
+            merger.write_parts()
+        os.replace(temp_path, output_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
+
+
+def merge_book(metadata_path, output_dir):
+    """
+    Merges the .docx of every chapter in metadata.json (in metadata order) into
+    output/<Book Title>.docx. Chapters that have not been built are left out with a
+    warning. Returns the book path, or None if nothing was merged.
+    """
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        book_data = json.load(f)
+
+    chapter_paths = []
+    for chapter in book_data.get("chapters", []):
+        path = os.path.join(output_dir, f"C{chapter['number']:02d}_{sanitize_title(chapter['title'])}.docx")
+        if os.path.exists(path):
+            chapter_paths.append(path)
+        else:
+            print(f"  Warning: Chapter {chapter['number']} has not been built ({path}); it is left out of the book.")
+    if not chapter_paths:
+        print("No chapter documents to merge.")
+        return None
+
+    book_path = book_output_path(book_data.get("book_title", "Book"), output_dir)
+    print(f"Merging {len(chapter_paths)} chapter(s) into {book_path}...")
+    try:
+        if not merge_docx(chapter_paths, book_path):
+            return None
+    except Exception as e:
+        print(f"  Error merging the book: {e}")
+        return None
+    print(f"  Successfully created {book_path}")
+    return book_path
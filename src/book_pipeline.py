@@ -0,0 +1,659 @@
+import copy
+import json
+import os
+import sys
+
+from asset_index import AssetIndex, load_asset_index
+from bibliography import BibliographyIndex, ChapterReferences
+from book_jobs import (DEBUG_TEX_MODES, add_chapter_arguments, chapter_numbers_from_args, run_chapter_jobs,
+                       sanitize_title, select_chapters, write_debug_tex)
+from book_merge import merge_book
+from build_cache import (FileHashCache, chapter_fingerprint, chapter_key, is_up_to_date,
+                         load_manifest, record_chapter, save_manifest, source_version)
+from chapter_sources import ImageResolver, find_chapter_files, preprocess_sections
+from image_optimizer import add_image_arguments, image_settings_from_args, optimize_chapter_images, settings_version
+from latex_preprocess import Preprocessor, literal_rule, regex_rule
+from pandoc_ast import ast_to_file_async, latex_to_ast, select_divs
+from pandoc_runner import DEFAULT_TIMEOUT, add_pandoc_arguments, configure, convert_text, gather, make_limit
+from preflight import add_check_arguments, run_check
+from publisher_filters import FIGURE_DETAIL_MARKER
+from reference_doc import build_reference_doc
+from rule_registry import (RuleStats, bib_block_pattern, bib_item_pattern, citation_pattern, figure_block_pattern,
+                           figure_detail_pattern, graphics_pattern, references_header_pattern, references_header_span,
+                           rule_stats)
+from section_cache import DEFAULT_CACHE_SIZE_MB, assemble_chapter_ast, can_use_section_cache, evict_lru, section_cache_dir
+from stage_timer import (ASSEMBLE_LATEX, ASSET_INDEX, BIBLIOGRAPHY, MERGE_BOOK, METADATA_LOAD, OPTIMIZE_IMAGES, PANDOC,
+                         POST_PROCESS, REFERENCE_DOC, STYLE_FILTERS, TITLE_PAGE, WRITE_TARGET, StageTimes, report_profile,
+                         stage_times, write_profile)
+from watch import add_watch_arguments, watch_book
+
+# The conversion pipeline behind all three converters.
+#
+# An edition of the book is a StyleProfile registered in PROFILES: convert_to_docx.py
+# registers "regular" and convert_to_pub_docx.py "publisher". A converter asks for a
+# list of targets, (profile, format) pairs; convert_to_docx.py and convert_to_pub_docx.py
+# ask for their own profile's .docx, convert_editions.py for any number of them.
+#
+# Each chapter is preprocessed once for all its targets. Where the editions differ (the
+# title page, a figure block without a usable image, [FIGURE DETAIL] lines and the
+# references), the LaTeX is written once per edition inside an environment named after
+# it ("regularonly", "publisheronly"). Pandoc reads the chapter into its AST once and
+# turns those environments into Divs; each target then keeps its own edition's Divs,
+# drops the others, runs its profile's AST filters and is written by pandoc's writer for
+# its format. A chapter with a single target and nothing to do on the AST goes from
+# LaTeX to its format in one pandoc call.
+#
+# engine="latex" runs a profile's latex_rules on the LaTeX instead of its AST filters
+# (the publisher rules of --engine latex); those cannot differ per edition, so that
+# engine builds one profile at a time.
+
+METADATA_FILE = "input/metadata.json"
+MANUSCRIPT_FILE = "input/Master Production Manuscript.txt"
+LATEX_DIR = "input/latex_files"
+OUTPUT_DIR = "output"
+
+# Target formats: pandoc writer, file extension and writer options
+FORMATS = {
+    "docx": ("docx", ".docx", []),
+    "odt": ("odt", ".odt", []),
+    # One self-contained page per chapter, images included
+    "html": ("html", ".html", ["--standalone", "--embed-resources"]),
+}
+ENGINES = ("latex", "ast")
+
+
+class StyleProfile:
+    """
+    One edition of the book.
+
+    title_page(chapter_num, chapter_title) -> LaTeX of the title page and \\chapter.
+    figure_without_image(block, prompt_comment, ref_path) -> LaTeX for a figure block
+        whose image is missing (ref_path is None if the block has no \\includegraphics).
+    consolidate_references: the thebibliography blocks (and "References" headings) are
+        removed and the chapter's references listed at its end, instead of kept in place.
+    marked_figure_details(text) -> LaTeX for a run of [FIGURE DETAIL] lines written in a
+        section; None keeps the lines as they are.
+    latex_rules() -> latex_preprocess Rules run with engine="latex", in the prose sweep
+        before the shared quote, dash and bold rules.
+    filters(doc, to_format): AST rules, applied in place before writing with engine="ast".
+    writer_args: extra pandoc writer options.
+    post_process(docx_path, options): styles a written .docx.
+    style_file: style file (see reference_doc) compiled into the reference document of
+        the profile's .docx, or None for pandoc's default styles.
+    source_path/style_version identify the code the profile comes from in the build
+    manifest, so editing it rebuilds the profile's targets.
+    """
+
+    def __init__(self, name, title_page, figure_without_image, consolidate_references=False,
+                 marked_figure_details=None, latex_rules=None, filters=None, writer_args=(), post_process=None,
+                 source_path=__file__, style_version=1, style_file=None):
+        self.name = name
+        self.title_page = title_page
+        self.figure_without_image = figure_without_image
+        self.consolidate_references = consolidate_references
+        self.marked_figure_details = marked_figure_details
+        self.latex_rules = latex_rules
+        self.filters = filters
+        self.writer_args = list(writer_args)
+        self.post_process = post_process
+        self.source_path = source_path
+        self.style_version = style_version
+        self.style_file = style_file
+
+    @property
+    def environment(self):
+        return f"{self.name}only"
+
+    def version(self):
+        return source_version(self.name, self.style_version, self.source_path)
+
+
+PROFILES = {}
+
+
+def register_profile(profile):
+    PROFILES[profile.name] = profile
+    return profile
+
+
+def target_name(target):
+    return f"{target[0]}:{target[1]}"
+
+
+def target_output_path(output_dir, target, chapter_num, chapter_title, target_dirs=True):
+    """
+    output/<profile>/C01_Title.<ext>, or output/C01_Title.<ext> without target_dirs.
+    """
+    profile_name, fmt = target
+    if target_dirs:
+        output_dir = os.path.join(output_dir, profile_name)
+    return os.path.join(output_dir, f"C{chapter_num:02d}_{sanitize_title(chapter_title)}{FORMATS[fmt][1]}")
+
+
+def edition_variants(profiles, render):
+    """
+    LaTeX that may differ between editions: render(profile) for every profile, each
+    wrapped in the profile's environment, or the text itself when all of them agree.
+    An empty variant is left out, so that edition simply has nothing there.
+    """
+    variants = [(profile, render(profile)) for profile in profiles]
+    if len({text for _, text in variants}) == 1:
+        return variants[0][1]
+    # {} so that a variant starting with "[" is not read as the environment's option
+    return "".join(f"\n\\begin{{{profile.environment}}}{{}}\n{text}\n\\end{{{profile.environment}}}\n"
+                   for profile, text in variants if text)
+
+
+def select_edition(doc, profile, profiles):
+    """
+    A copy of the chapter AST with only the given profile's edition Divs (unwrapped).
+    """
+    edition = copy.deepcopy(doc)
+    others = {p.environment for p in profiles if p is not profile}
+    select_divs(edition["blocks"], profile.environment, others)
+    return edition
+
+
+def collect_bib_items(block_content, references):
+    """
+    Adds the \\bibitem entries of a thebibliography block to the chapter's references.
+    """
+    items = rule_stats.timed("bibitem", bib_item_pattern, 'finditer', block_content)
+    for item, following in zip(items, items[1:] + [None]):
+        key = item.group(2)
+        # The entry runs to the next \\bibitem
+        text = block_content[item.end():following.start() if following else len(block_content)]
+        # Clean up text (remove newlines, extra spaces)
+        clean_text = " ".join(text.split()).strip()
+        references.add(key, clean_text)
+
+
+def convert_book(metadata_path, output_dir, chapter_numbers=None, jobs=1, force=False, targets=(),
+                 converter_name="editions", target_dirs=True, engine="ast",
+                 section_cache=False, section_cache_size=DEFAULT_CACHE_SIZE_MB, debug_tex="plain",
+                 postprocess="docx", show_rule_stats=False, image_settings=None, profile=False, merge=False,
+                 pandoc_jobs=0, pandoc_timeout=DEFAULT_TIMEOUT, style_files=None):
+    """
+    Converts the requested chapters (all chapters when chapter_numbers is None) to every
+    target, a list of (profile, format) pairs.
+    Chapters are independent, so with jobs > 1 they are built in parallel worker processes.
+    Each chapter is preprocessed and read by pandoc once for all targets; only the
+    targets whose inputs changed since the last build are written (see build_cache)
+    unless force is set. converter_name keys the targets in the build manifest and names
+    the profile report.
+    target_dirs writes each target to output/<profile>/; without it the targets go to
+    output/ itself (one target per format).
+    engine="ast" applies the profiles' filters to pandoc's AST; engine="latex" runs
+    their latex_rules on the LaTeX instead (a single profile only).
+    With section_cache, sections are converted and cached one by one and only edited
+    sections go through pandoc's LaTeX reader again.
+    debug_tex ("off", "plain" or "gzip") controls the copy of each chapter's LaTeX saved
+    next to its output (output/C01_Title.<converter_name>.tex with target_dirs); pandoc
+    itself reads the LaTeX from stdin.
+    postprocess="stream" applies the publisher styles with the streaming OOXML rewriter
+    (see ooxml_stream) instead of loading the document into python-docx.
+    image_settings (see image_optimizer) downsamples and recompresses the embedded
+    images into a cache first.
+    show_rule_stats prints the cleanup rule counters (see rule_registry) summed over
+    the converted chapters.
+    profile records wall/CPU time, sizes and peak memory of every stage of every chapter
+    and writes them to output/profile.json and output/profile.trace.json (see stage_timer).
+    merge joins the chapters of every .docx target into <Book Title>.docx next to them
+    (see book_merge) once all requested chapters converted.
+    The references of the profiles that consolidate them are kept in the book's
+    bibliography index (output/.bibliography.json, see bibliography).
+    pandoc_jobs caps the pandoc processes running at once over all chapters and
+    pandoc_timeout (seconds, 0 for none) kills a pandoc call that takes longer (see
+    pandoc_runner).
+    style_files overrides a profile's style file ({profile name: path or None}); the
+    .docx of a profile with a style file are written with its reference document.
+    Returns (output_paths, failed_chapter_numbers).
+    """
+    profile_names = list(dict.fromkeys(name for name, _ in targets))
+    if engine == "latex" and len(profile_names) > 1:
+        print("Error: The LaTeX engine builds one style profile at a time; use the AST engine for several.")
+        return [], []
+
+    if not os.path.exists(metadata_path):
+        print(f"Error: Metadata file not found at {metadata_path}")
+        return [], []
+
+    # Book-level stages are timed here; the chapter stages come back with each result
+    book_times = StageTimes()
+    book_times.reset(profile)
+    with book_times.stage(METADATA_LOAD, bytes_in=os.path.getsize(metadata_path)):
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            book_data = json.load(f)
+
+    chapters = book_data.get("chapters", [])
+
+    if not chapters:
+        print("No chapters found in metadata.")
+        return [], []
+
+    chapters = select_chapters(chapters, chapter_numbers)
+    if not chapters:
+        return [], []
+
+    if target_dirs:
+        for profile_name in profile_names:
+            os.makedirs(os.path.join(output_dir, profile_name), exist_ok=True)
+
+    # Compiled once (or taken from their cache) before any chapter is converted
+    style_files = style_files or {}
+    reference_docs = {}
+    for profile_name in dict.fromkeys(name for name, fmt in targets if fmt == "docx"):
+        style_file = style_files.get(profile_name, PROFILES[profile_name].style_file)
+        if not style_file:
+            continue
+        try:
+            with book_times.stage(REFERENCE_DOC, profile_name):
+                reference_docs[profile_name] = build_reference_doc(style_file, output_dir)
+        except (OSError, ValueError) as e:
+            print(f"Error: Cannot use style file {style_file}: {e}")
+            return [], []
+
+    manifest = load_manifest(output_dir)
+    with book_times.stage(ASSET_INDEX):
+        assets = load_asset_index(LATEX_DIR, output_dir)
+    # Book-wide references: workers get a read-only copy, their findings are merged below
+    bibliography = None
+    if any(PROFILES[name].consolidate_references for name in profile_names):
+        bibliography = BibliographyIndex.load(output_dir)
+    options = {
+        "assets": assets,
+        "bibliography": bibliography,
+        "targets": list(targets),
+        "converter_name": converter_name,
+        "target_dirs": target_dirs,
+        "engine": engine,
+        "force": force,
+        "manifest": manifest["chapters"],
+        "file_hashes": manifest["files"],
+        "section_cache": section_cache,
+        "debug_tex": debug_tex,
+        "images": image_settings,
+        "postprocess": postprocess,
+        "profile": profile,
+        "reference_docs": reference_docs,
+    }
+
+    book_rule_stats = RuleStats()
+
+    def on_result(chapter, result):
+        if result:
+            book_rule_stats.merge(result.get('rule_stats'))
+            book_times.events.extend(result.get('profile', []))
+            for output in result['outputs']:
+                record_chapter(manifest, chapter_key(output['key'], chapter['number']),
+                               dict(output, file_hashes=result['file_hashes']))
+            save_manifest(output_dir, manifest)
+
+    results, failed = run_chapter_jobs(build_chapter, chapters, output_dir, jobs, options, on_result,
+                                       configure, (make_limit(pandoc_jobs), pandoc_timeout))
+    results = [r for r in results if r]
+
+    if bibliography is not None:
+        # Each converted chapter's references replace what the index held for it
+        bibliography.retain(c['number'] for c in book_data.get("chapters", []))
+        for r in results:
+            if r.get('references'):
+                bibliography.merge(r['number'], r['references'])
+        bibliography.save(output_dir)
+
+    if section_cache:
+        evict_lru(section_cache_dir(output_dir), section_cache_size)
+
+    if merge and not failed:
+        with book_times.stage(MERGE_BOOK):
+            for profile_name in dict.fromkeys(name for name, fmt in targets if fmt == "docx"):
+                merge_book(metadata_path, os.path.join(output_dir, profile_name) if target_dirs else output_dir)
+
+    if show_rule_stats:
+        book_rule_stats.report()
+
+    if profile:
+        report_profile(book_times.events)
+        profile_path, trace_path = write_profile(output_dir, converter_name, book_times.events,
+                                                 book_rule_stats.snapshot())
+        print(f"Profile written to {profile_path} (Chrome trace: {trace_path})")
+
+    skipped = sum(1 for r in results if r['skipped'])
+    if skipped:
+        print(f"{skipped} chapter(s) unchanged since the last build were skipped (use --force to rebuild).")
+    return [output['output_path'] for r in results for output in r['outputs']], failed
+
+
+def convert_chapter(chapter, output_dir, options, base_latex_dir=LATEX_DIR):
+    """
+    Preprocesses a chapter once for all its targets (options['targets']) and writes
+    every target whose inputs changed.
+    Returns a result dict (outputs, written, skipped, file_hashes, rule_stats, references),
+    or None if the chapter has no section files.
+    """
+    rule_stats.reset()
+    chapter_num = chapter['number']
+    stage_times.reset(options.get('profile', False), chapter_num)
+    chapter_title = chapter['title']
+    print(f"Processing Chapter {chapter_num}: {chapter_title}")
+
+    # Expected chapter directory
+    chapter_dir = os.path.join(base_latex_dir, f"Chapter_{chapter_num}")
+    assets = options.get('assets') or AssetIndex()
+    chapter_files, indexed_hashes = find_chapter_files(chapter, chapter_dir, assets)
+
+    if not chapter_files:
+        print(f"  No valid files found for Chapter {chapter_num}")
+        return None
+
+    targets = options['targets']
+    converter_name = options.get('converter_name', "editions")
+    engine = options.get('engine', "ast")
+    profiles = [PROFILES[name] for name in dict.fromkeys(name for name, _ in targets)]
+
+    # Store references for consolidation (de-duplicated against the book index, see bibliography)
+    references = ChapterReferences(options.get('bibliography'))
+
+    # Images are matched fuzzily (e.g. asking for .png but having .jpg); the images
+    # actually used by this chapter go into the build fingerprint
+    images = ImageResolver(assets, chapter_dir)
+
+    def process_figure_block(match):
+        full_block = match.group(1)
+        prompt_comment = match.group(3) or ""
+        g_match = graphics_pattern.search(full_block)
+        ref_path = g_match.group(2) if g_match else None
+        target_file = images.find(ref_path) if g_match else None
+        if target_file:
+            # A found image is shown the same way in every edition
+            return images.retag(full_block, g_match, target_file) + prompt_comment
+        return edition_variants(profiles, lambda p: p.figure_without_image(full_block, prompt_comment, ref_path))
+
+    def process_figure_detail(match):
+        return edition_variants(profiles, lambda p: p.marked_figure_details(match.group(0))
+                                if p.marked_figure_details else match.group(0))
+
+    def keep_unless_consolidated(match):
+        return edition_variants(profiles, lambda p: "" if p.consolidate_references else match.group(0))
+
+    def process_bib_block(match):
+        collect_bib_items(match.group(2), references)
+        return keep_unless_consolidated(match)
+
+    # The cleanup rules run in three sweeps per file, in this order (see latex_preprocess):
+    # citations, the structural rewrites, then the prose rules, each over the text the
+    # previous sweep joined up. The rules no profile needs are left out
+    citation_rules = [regex_rule("citation", citation_pattern, '', ["\\cite", "\\ref", "[cite"], atomic=True)]
+    structure_rules = [
+        # Apply figure block processing first
+        regex_rule("figure_block", figure_block_pattern, process_figure_block, ["\\begin"]),
+    ]
+    if any(p.marked_figure_details for p in profiles):
+        structure_rules.append(regex_rule("figure_detail", figure_detail_pattern, process_figure_detail, [FIGURE_DETAIL_MARKER]))
+    structure_rules.append(regex_rule("graphics", graphics_pattern, images.resolve_inline, ["\\includegraphics"]))
+    if any(p.consolidate_references for p in profiles):
+        structure_rules += [
+            # The header also takes the whitespace that follows it once figure blocks
+            # have been rewritten, so the span extends over those
+            regex_rule("references_header", references_header_pattern, keep_unless_consolidated, ["\\s"],
+                       span_regex=references_header_span),
+            regex_rule("bibliography", bib_block_pattern, process_bib_block, ["\\begin{thebibliography}"]),
+        ]
+    prose_rules = []
+    if engine == "latex":
+        for profile in profiles:
+            if profile.latex_rules:
+                prose_rules += profile.latex_rules()
+    prose_rules += [
+        # Sanitize LaTeX quotes `` and '' to simple "
+        literal_rule("open_quotes", "``", '"'),
+        literal_rule("close_quotes", "''", '"'),
+        # Replace em dashes — with hyphens -
+        literal_rule("em_dash", "—", "-"),
+        # Remove LLM-style bold markers **
+        literal_rule("bold_markers", "**", ""),
+    ]
+    cleaned_sections = preprocess_sections(chapter_files, Preprocessor([citation_rules, structure_rules, prose_rules]))
+
+    # Incremental build, per target: the shared inputs plus the target's profile, format
+    # and engine, and the reference document it is written with
+    hashes = FileHashCache(options.get('file_hashes'))
+    hashes.seed(indexed_hashes)
+    image_files = sorted(images.resolved)
+    reference_docs = {name: path for name, path in options.get('reference_docs', {}).items() if path}
+    outputs = []
+    stale = []
+    for target in targets:
+        profile = PROFILES[target[0]]
+        target_version = f"{converter_name}:{profile.version()}:{target[1]}:{engine}"
+        # The reference document is named after its style file's hash
+        reference_doc = reference_docs.get(target[0]) if target[1] == "docx" else None
+        if reference_doc:
+            target_version += f":ref:{os.path.basename(reference_doc)}"
+        target_version += settings_version(options.get('images'))
+        output = {
+            "target": target_name(target),
+            "key": f"{converter_name}:{target_name(target)}",
+            "output_path": target_output_path(output_dir, target, chapter_num, chapter_title,
+                                              options.get('target_dirs', True)),
+            "fingerprint": chapter_fingerprint(chapter, chapter_files, image_files, target_version, hashes),
+        }
+        outputs.append(output)
+        previous = options.get('manifest', {}).get(chapter_key(output['key'], chapter_num))
+        if options.get('force') or not is_up_to_date(previous, output['fingerprint'], output['output_path']):
+            stale.append((target, output))
+
+    result = {
+        "number": chapter_num,
+        "outputs": outputs,
+        "written": [],
+        "skipped": not stale,
+        "file_hashes": hashes.updated,
+        "rule_stats": rule_stats.snapshot(),
+        "references": references.snapshot(),
+    }
+    if not stale:
+        if len(outputs) == 1:
+            print(f"  Inputs unchanged, skipping pandoc: {outputs[0]['output_path']}")
+        else:
+            print(f"  Inputs unchanged, skipping pandoc: {len(outputs)} target(s)")
+        return result
+
+    if options.get('images'):
+        with stage_times.stage(OPTIMIZE_IMAGES):
+            cleaned_sections = optimize_chapter_images(cleaned_sections, image_files, output_dir, options['images'], hashes)
+
+    with stage_times.stage(TITLE_PAGE):
+        title_content = edition_variants(profiles, lambda p: p.title_page(chapter_num, chapter_title))
+
+    # Prepend title page to cleaned sections
+    pieces = [title_content] + cleaned_sections
+
+    # Consolidated Bibliography, for the editions that list the references at the end
+    with stage_times.stage(BIBLIOGRAPHY):
+        if references and any(p.consolidate_references for p in profiles):
+            print(f"  Consolidating {len(references)} unique references...")
+            if references.duplicates:
+                print(f"  Merged {references.duplicates} duplicate reference(s).")
+            # Author-year order, rendered in one piece
+            rendered = references.render()
+            pieces.append(edition_variants(profiles, lambda p: rendered if p.consolidate_references else ""))
+
+    # Resource path using absolute paths
+    abs_chapter_dir = os.path.abspath(chapter_dir)
+    resource_path = os.pathsep.join([abs_chapter_dir, os.path.join(abs_chapter_dir, 'images')])
+    # '--toc' is not used (added manually via \tableofcontents); --top-level-division=chapter
+    # keeps \chapter structural
+    extra_args = [
+        f'--resource-path={resource_path}',
+        '--top-level-division=chapter'
+    ]
+
+    def writer_args(target):
+        profile_name, fmt = target
+        args = extra_args + PROFILES[profile_name].writer_args + FORMATS[fmt][2]
+        if fmt == "html":
+            args.append(f"--metadata=pagetitle:{chapter_title}")
+        if fmt == "docx" and profile_name in reference_docs:
+            args.append(f"--reference-doc={reference_docs[profile_name]}")
+        return args
+
+    if len(stale) == 1:
+        print(f"  Combining {len(pieces)} parts into {stale[0][1]['output_path']}...")
+    else:
+        print(f"  Combining {len(pieces)} parts for {len(stale)} target(s)...")
+    with stage_times.stage(ASSEMBLE_LATEX) as sizes:
+        combined_latex = "".join(piece + "\n" for piece in pieces)
+        # DEBUG: the LaTeX next to the output (C01_Title.tex), or one copy of the LaTeX the
+        # targets share in output/ named after the converter (C01_Title.editions.tex)
+        if options.get('target_dirs', True):
+            debug_path = os.path.join(output_dir, f"C{chapter_num:02d}_{sanitize_title(chapter_title)}"
+                                                  f".{converter_name}.tex")
+        else:
+            debug_path = outputs[0]['output_path']
+        debug_tex_path = write_debug_tex(debug_path, combined_latex, options.get('debug_tex', 'plain'))
+        sizes["bytes_out"] = len(combined_latex)
+    if debug_tex_path:
+        print(f"  [DEBUG] Saved combined LaTeX to {debug_tex_path}")
+
+    def runs_filters(target):
+        return engine == "ast" and PROFILES[target[0]].filters is not None
+
+    # Prefix of this chapter's pandoc warnings
+    pandoc_label = f"C{chapter_num:02d}"
+    use_section_cache = options.get('section_cache') and can_use_section_cache(pieces)
+    try:
+        if len(profiles) == 1 and len(stale) == 1 and not use_section_cache and not runs_filters(stale[0][0]):
+            # One target and nothing to do on the AST: straight from LaTeX (fed through
+            # stdin, no intermediate .tex file is read back)
+            target, output = stale[0]
+            with stage_times.stage(PANDOC, bytes_in=len(combined_latex)) as sizes:
+                convert_text(combined_latex, FORMATS[target[1]][0], 'latex', outputfile=output['output_path'],
+                             extra_args=writer_args(target), label=pandoc_label)
+                sizes["bytes_out"] = os.path.getsize(output['output_path'])
+        else:
+            with stage_times.stage(PANDOC, bytes_in=len(combined_latex)):
+                if use_section_cache:
+                    # Title page first, then each section (and bibliography) from the section cache
+                    doc = assemble_chapter_ast(pieces[0], pieces[1:], section_cache_dir(output_dir), pandoc_label)
+                else:
+                    doc = latex_to_ast(combined_latex, label=pandoc_label)
+
+            writes = []
+            for target, output in stale:
+                profile = PROFILES[target[0]]
+                # Every target filters its own copy
+                edition = select_edition(doc, profile, profiles) if len(stale) > 1 or len(profiles) > 1 else doc
+                if runs_filters(target):
+                    with stage_times.stage(STYLE_FILTERS, output['target']):
+                        profile.filters(edition, FORMATS[target[1]][0])
+                writes.append(ast_to_file_async(edition, FORMATS[target[1]][0], output['output_path'],
+                                                writer_args(target), f"{pandoc_label} {output['target']}"))
+
+            # The pandoc writers of all targets run at the same time (see pandoc_runner)
+            with stage_times.stage(WRITE_TARGET, ",".join(output['target'] for _, output in stale)) as sizes:
+                gather(writes)
+                sizes["bytes_out"] = sum(os.path.getsize(output['output_path']) for _, output in stale)
+        for _, output in stale:
+            print(f"  Successfully created {output['output_path']}")
+            result["written"].append(output['target'])
+    except RuntimeError as e:
+        print(f"  Pandoc Error: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"  Error: {e}")
+        sys.exit(1)
+
+    return result
+
+
+def build_chapter(chapter, output_dir, options):
+    """
+    Worker entry point: converts one chapter to its targets and applies each profile's
+    .docx post-processing. The result also carries the chapter's time per stage (see
+    stage_timer).
+    """
+    result = convert_chapter(chapter, output_dir, options)
+    if result:
+        for output in result['outputs']:
+            if output['target'] not in result['written'] or not output['target'].endswith(":docx"):
+                continue
+            profile = PROFILES[output['target'].split(':')[0]]
+            if profile.post_process:
+                with stage_times.stage(POST_PROCESS, output['target']):
+                    profile.post_process(output['output_path'], options)
+        result['stage_times'] = stage_times.snapshot()
+        if stage_times.profiling:
+            result['profile'] = stage_times.events
+    return result
+
+
+def add_pipeline_arguments(parser):
+    """
+    Adds the options every converter has (chapter selection, incremental builds, debug
+    LaTeX, images, watch, pandoc, check, rule stats, profile and merge).
+    """
+    add_chapter_arguments(parser)
+    parser.add_argument("--force", action="store_true", help="Rebuild chapters even if their inputs are unchanged")
+    parser.add_argument("--section-cache", action="store_true",
+                        help="Convert and cache each section separately so only edited sections are re-parsed")
+    parser.add_argument("--section-cache-size", type=int, default=DEFAULT_CACHE_SIZE_MB,
+                        help=f"Size cap of the section cache in MB (default: {DEFAULT_CACHE_SIZE_MB})")
+    parser.add_argument("--debug-tex", choices=DEBUG_TEX_MODES, default="plain",
+                        help="Save each chapter's combined LaTeX next to the .docx: off, plain (.tex) or gzip (.tex.gz)")
+    add_image_arguments(parser)
+    add_watch_arguments(parser)
+    add_pandoc_arguments(parser)
+    add_check_arguments(parser)
+    parser.add_argument("--rule-stats", action="store_true",
+                        help="Print match counts, bytes scanned and time per cleanup rule")
+    parser.add_argument("--profile", action="store_true",
+                        help="Record time, sizes and peak memory per stage to output/profile.json and a Chrome trace")
+    parser.add_argument("--merge-book", action="store_true",
+                        help="Merge every chapter's .docx into <Book Title>.docx after converting")
+
+
+def book_options_from_args(args):
+    """
+    The convert_book options set by add_pipeline_arguments.
+    """
+    return {
+        "jobs": args.jobs,
+        "force": args.force,
+        "section_cache": args.section_cache,
+        "section_cache_size": args.section_cache_size,
+        "debug_tex": args.debug_tex,
+        "show_rule_stats": args.rule_stats,
+        "image_settings": image_settings_from_args(args),
+        "profile": args.profile,
+        "merge": args.merge_book,
+        "pandoc_jobs": args.pandoc_jobs,
+        "pandoc_timeout": args.pandoc_timeout,
+    }
+
+
+def run_pipeline(args, build, summary):
+    """
+    A converter's command line once its arguments are parsed: --check, --watch or one
+    build of the chosen chapters, exiting with 1 if a chapter failed.
+    build(chapter_numbers) -> (output_paths, failed_chapter_numbers); summary is printed
+    with the number of output paths, e.g. "Converted {} chapter(s).".
+    """
+    if not os.path.exists(OUTPUT_DIR):
+        os.makedirs(OUTPUT_DIR)
+
+    if args.check:
+        run_check(args, METADATA_FILE, OUTPUT_DIR)
+
+    chapter_numbers = chapter_numbers_from_args(args)
+
+    if args.watch:
+        watch_book(build, chapter_numbers, LATEX_DIR, METADATA_FILE, MANUSCRIPT_FILE, args.watch_interval)
+        return
+
+    output_paths, failed = build(chapter_numbers)
+
+    if failed:
+        print(f"Conversion failed for chapters: {', '.join(str(n) for n in failed)}")
+        sys.exit(1)
+    print(summary.format(len(output_paths)))
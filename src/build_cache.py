@@ -0,0 +1,164 @@
+import functools
+import glob
+import hashlib
+import json
+import os
+
+from section_index import without_file_index
+
+MANIFEST_FILENAME = ".build_manifest.json"
+MANIFEST_VERSION = 1
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+# The Lua filters the converters hand to pandoc
+FILTER_DIR = os.path.join(os.path.dirname(SRC_DIR), "styles")
+
+
+def load_manifest(output_dir):
+    """
+    Loads the incremental build manifest from the output directory.
+    Returns an empty manifest if it does not exist or cannot be read.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    empty = {"version": MANIFEST_VERSION, "chapters": {}, "files": {}}
+    if not os.path.exists(manifest_path):
+        return empty
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"  Warning: Ignoring unreadable build manifest {manifest_path}: {e}")
+        return empty
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty
+    manifest.setdefault("chapters", {})
+    manifest.setdefault("files", {})
+    return manifest
+
+
+def save_manifest(output_dir, manifest):
+    """
+    Writes the manifest atomically so an interrupted build never leaves a truncated file.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_FILENAME)
+    temp_path = manifest_path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, manifest_path)
+
+
+def source_version(name, style_version, source_path):
+    """
+    Identifies a converter build: its name, style version and a hash of its source,
+    so edits to the conversion or styling code invalidate previously built chapters.
+    """
+    with open(source_path, 'rb') as f:
+        source_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+    return f"{name}:{style_version}:{source_hash}"
+
+
+@functools.lru_cache(maxsize=1)
+def pipeline_version():
+    """
+    A hash of every module of the conversion pipeline (src/*.py) and of the Lua filters
+    (styles/*.lua). A chapter's conversion runs through many modules besides its
+    converter (preprocessing rules, scanner, paragraph rules, AST filters, ...), so an
+    edit to any of them invalidates previously built chapters.
+    """
+    h = hashlib.sha256()
+    paths = sorted(glob.glob(os.path.join(SRC_DIR, "*.py"))) + sorted(glob.glob(os.path.join(FILTER_DIR, "*.lua")))
+    for path in paths:
+        with open(path, 'rb') as f:
+            h.update(f"{os.path.basename(path)}:{hashlib.sha256(f.read()).hexdigest()}\n".encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+class FileHashCache:
+    """
+    Content hashes of input files, reused while a file's size and mtime are unchanged.
+    Large images are therefore only re-read after they have actually been touched.
+    """
+
+    def __init__(self, known=None):
+        self.known = known or {}
+        self.updated = {}
+
+    def seed(self, entries):
+        """
+        Adds hashes recorded elsewhere (the file index of metadata.json); the newer
+        record of a file wins, and digest() still checks its size and mtime.
+        """
+        known = dict(self.known)
+        for abs_path, entry in entries.items():
+            current = known.get(abs_path)
+            if current is None or current["mtime_ns"] < entry["mtime_ns"]:
+                known[abs_path] = entry
+        self.known = known
+
+    def digest(self, path):
+        abs_path = os.path.abspath(path)
+        st = os.stat(abs_path)
+        entry = self.updated.get(abs_path) or self.known.get(abs_path)
+        if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+            self.updated[abs_path] = entry
+            return entry["sha256"]
+
+        h = hashlib.sha256()
+        with open(abs_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": h.hexdigest()}
+        self.updated[abs_path] = entry
+        return entry["sha256"]
+
+
+def chapter_fingerprint(chapter, section_files, image_files, converter_version, hashes):
+    """
+    Hashes every input of a chapter build: the section .tex files (in order), the
+    resolved image files, the chapter's metadata entry (without its file index), the
+    converter version and the pipeline's source (pipeline_version).
+    """
+    h = hashlib.sha256()
+    h.update(converter_version.encode('utf-8'))
+    h.update(f"pipeline:{pipeline_version()}\n".encode('utf-8'))
+    h.update(json.dumps(without_file_index(chapter), sort_keys=True).encode('utf-8'))
+    for path in section_files:
+        h.update(f"section:{os.path.basename(path)}:{hashes.digest(path)}\n".encode('utf-8'))
+    for path in sorted(image_files):
+        h.update(f"image:{os.path.basename(path)}:{hashes.digest(path)}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+def chapter_key(converter_name, chapter_num):
+    return f"{converter_name}/{chapter_num}"
+
+
+def is_up_to_date(entry, fingerprint, output_path):
+    """
+    A chapter can be skipped if its inputs hash the same as last time and the output
+    it produced is still there, untouched (e.g. not overwritten by the other converter).
+    """
+    if not entry or entry.get("fingerprint") != fingerprint:
+        return False
+    if entry.get("output") != output_path or not os.path.exists(output_path):
+        return False
+    st = os.stat(output_path)
+    return entry.get("output_size") == st.st_size and entry.get("output_mtime_ns") == st.st_mtime_ns
+
+
+def record_chapter(manifest, key, result):
+    """
+    Stores a finished chapter build (and the file hashes it computed) in the manifest.
+    """
+    manifest["files"].update(result.get("file_hashes", {}))
+    output_path = result["output_path"]
+    if not os.path.exists(output_path):
+        manifest["chapters"].pop(key, None)
+        return
+    st = os.stat(output_path)
+    manifest["chapters"][key] = {
+        "fingerprint": result["fingerprint"],
+        "output": output_path,
+        "output_size": st.st_size,
+        "output_mtime_ns": st.st_mtime_ns,
+    }
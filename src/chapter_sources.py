@@ -0,0 +1,107 @@
+import os
+import sys
+
+from asset_index import latex_path
+from section_index import find_section_files, indexed_section_files
+from stage_timer import PREPROCESS, PREPROCESS_FILE, SECTION_LOOKUP, stage_times
+
+# The inputs of a chapter, as book_pipeline reads them for every converter: its section
+# files, the images its \includegraphics resolve to and the preprocessing of every
+# section file with a chapter's cleanup rules.
+
+
+def find_chapter_files(chapter, chapter_dir, assets):
+    """
+    The section files of a chapter, in section order, and the hashes recorded for them
+    in metadata.json ({} when they were looked up in the directory).
+    Exits if the chapter directory is missing or a section has no single file.
+    """
+    if not os.path.exists(chapter_dir):
+        print(f"Error: Chapter directory not found: {chapter_dir}")
+        sys.exit(1)
+
+    # The section files recorded in metadata.json by generate_metadata are used while the
+    # chapter directory is unchanged; otherwise each filename is parsed once into the
+    # section number it names (see section_index) and every missing or ambiguous section
+    # is reported before giving up
+    with stage_times.stage(SECTION_LOOKUP):
+        indexed = indexed_section_files(chapter, chapter_dir)
+        if indexed:
+            chapter_files, indexed_hashes = indexed
+            problems = []
+        else:
+            indexed_hashes = {}
+            # Directory listings come from the asset index built once per run (see asset_index)
+            chapter_files, problems = find_section_files(chapter.get('sections', []), chapter_dir,
+                                                         assets.files_in(chapter_dir))
+    if problems:
+        for problem in problems:
+            print(f"ERROR: {problem}")
+        sys.exit(1) # Strict error as requested
+
+    for found_file in chapter_files:
+        print(f"  Found: {os.path.basename(found_file)}")
+    return chapter_files, indexed_hashes
+
+
+def includegraphics(options, path):
+    return f'\\includegraphics[{options}]{{{path}}}' if options else f'\\includegraphics{{{path}}}'
+
+
+class ImageResolver:
+    """
+    Resolves the \\includegraphics of one chapter through the asset index and keeps the
+    images it found (absolute paths) for the build fingerprint.
+    """
+
+    def __init__(self, assets, chapter_dir):
+        self.images = assets.chapter_images(chapter_dir)
+        self.resolved = set()
+
+    def find(self, ref_path):
+        # Exact name, "figure_d_d" prefix, closest name, then other chapters;
+        # the absolute path goes into the LaTeX so pandoc does not search for it
+        target = self.images.find(ref_path)
+        if target:
+            self.resolved.add(target)
+            return latex_path(target)
+        return None
+
+    def retag(self, block, g_match, target):
+        """
+        The block with the \\includegraphics of g_match pointing at target.
+        """
+        s, e = g_match.span()
+        return block[:s] + includegraphics(g_match.group(1), target) + block[e:]
+
+    def resolve_inline(self, match):
+        # Rule replacement for an \includegraphics outside a figure block
+        target = self.find(match.group(2))
+        if target:
+            return includegraphics(match.group(1), target)
+        return match.group(0)
+
+
+def preprocess_sections(chapter_files, preprocessor):
+    """
+    Reads every section file and runs the chapter's cleanup rules over it.
+    A file that cannot be read or cleaned is reported and left out.
+    """
+    cleaned_sections = []
+    with stage_times.stage(PREPROCESS):
+        for file_path in chapter_files:
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+
+                with stage_times.stage(PREPROCESS_FILE, os.path.basename(file_path), len(content)) as sizes:
+                    cleaned_content = preprocessor.run(content)
+                    sizes["bytes_out"] = len(cleaned_content)
+                cleaned_sections.append(cleaned_content)
+
+                print(f"    Processed {os.path.basename(file_path)}: {len(cleaned_content)} chars")
+
+            except Exception as e:
+                print(f"  Error processing file {file_path}: {e}")
+                continue
+    return cleaned_sections
@@ -0,0 +1,74 @@
+import sys
+import argparse
+
+# The converters register the "regular" and "publisher" style profiles when imported
+import convert_to_docx as regular
+import convert_to_pub_docx as publisher
+from book_pipeline import (FORMATS, METADATA_FILE, OUTPUT_DIR, PROFILES, add_pipeline_arguments, book_options_from_args,
+                           convert_book, run_pipeline)
+
+# Every edition of the book from one conversion.
+#
+# The regular and publisher editions are the style profiles the two converters register
+# with book_pipeline. Asked for several targets, the pipeline preprocesses each chapter
+# and reads it into pandoc's AST once, then writes every target from that AST with its
+# profile's rules: the publisher rules run on the AST (publisher_filters, like
+# --engine ast). Each target goes to output/<profile>/, in DOCX, ODT or HTML (for web
+# review).
+
+# Identifies this converter in the build manifest
+CONVERTER_NAME = "editions"
+DEFAULT_TARGETS = f"{regular.CONVERTER_NAME},{publisher.CONVERTER_NAME}"
+
+
+def parse_targets(spec):
+    """
+    Parses "regular,publisher,publisher:html" into [(profile, format), ...]; a profile
+    without a format means its .docx.
+    """
+    targets = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, fmt = part.partition(':')
+        fmt = fmt or "docx"
+        if name not in PROFILES:
+            raise ValueError(f"unknown style profile '{name}' (available: {', '.join(PROFILES)})")
+        if fmt not in FORMATS:
+            raise ValueError(f"unknown format '{fmt}' (available: {', '.join(FORMATS)})")
+        if (name, fmt) not in targets:
+            targets.append((name, fmt))
+    if not targets:
+        raise ValueError("no targets given")
+    return targets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert LaTeX chapters to every edition of the book in one pass.")
+    add_pipeline_arguments(parser)
+    parser.add_argument("--targets", default=DEFAULT_TARGETS,
+                        help="Editions to write, comma-separated as profile or profile:format, e.g. "
+                             f"regular,publisher,publisher:html (profiles: {', '.join(PROFILES)}; "
+                             f"formats: {', '.join(FORMATS)}; default: {DEFAULT_TARGETS})")
+    parser.add_argument("--postprocess", choices=["docx", "stream"], default="docx",
+                        help="'stream' styles the publisher .docx with a streaming XML pass instead of python-docx")
+    args = parser.parse_args()
+
+    try:
+        targets = parse_targets(args.targets)
+    except ValueError as e:
+        print(f"Error: Could not parse --targets '{args.targets}': {e}")
+        sys.exit(1)
+
+    def build(numbers):
+        # The shared LaTeX is saved once per chapter as output/C01_Title.editions.tex
+        return convert_book(METADATA_FILE, OUTPUT_DIR, numbers, targets=targets, converter_name=CONVERTER_NAME,
+                            target_dirs=True, engine="ast", postprocess=args.postprocess,
+                            **book_options_from_args(args))
+
+    run_pipeline(args, build, "Wrote {} file(s).")
+
+
+if __name__ == "__main__":
+    main()
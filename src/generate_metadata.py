@@ -1,7 +1,18 @@
+import hashlib
 import os
 import json
 import re
 
+from build_cache import FileHashCache
+from section_index import FILE_INDEX_KEY, index_chapter_files
+
+def manuscript_lines(file_path):
+    """
+    The lines of the manuscript, read one at a time.
+    """
+    with open(file_path, 'r', encoding='utf-8') as f:
+        yield from f
+
 def parse_metadata(file_path):
     """
     Parses the metadata text file (Markdown format) and returns a structured dictionary.
@@ -22,10 +33,8 @@ def parse_metadata(file_path):
         print(f"Error: Metadata file not found at {file_path}")
         return None
 
-    with open(file_path, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        
-    for line in lines:
+    # The manuscript is streamed line by line rather than read into a list first
+    for line in manuscript_lines(file_path):
         line = line.strip()
         if not line:
             continue
@@ -81,21 +90,89 @@ def parse_metadata(file_path):
                 
     return book_data
 
-def main():
-    input_file = "input/Master Production Manuscript.txt"
-    output_file = "input/metadata.json"
-    
-    print(f"Reading metadata from {input_file}...")
-    book_structure = parse_metadata(input_file)
+def manuscript_digest(file_path):
+    """
+    SHA-256 of the manuscript, read in blocks.
+    """
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def index_book_files(book_structure, previous=None, latex_dir="input/latex_files"):
+    """
+    Resolves every section to its .tex file and records the chapters' file indexes
+    (see section_index). previous is the last metadata: its paths are reused for
+    unchanged chapter directories and its hashes for unchanged files.
+    """
+    previous_chapters = {c.get('number'): c for c in (previous or {}).get("chapters", [])}
+    known = {}
+    for chapter in previous_chapters.values():
+        for entry in chapter.get(FILE_INDEX_KEY, {}).get("sections", {}).values():
+            known[os.path.abspath(entry["path"])] = {key: entry[key] for key in ("size", "mtime_ns", "sha256")}
+    hashes = FileHashCache(known)
+
+    for chapter in book_structure["chapters"]:
+        chapter_dir = os.path.join(latex_dir, f"Chapter_{chapter['number']}")
+        last = previous_chapters.get(chapter['number'], {}).get(FILE_INDEX_KEY)
+        for problem in index_chapter_files(chapter, chapter_dir, hashes, last):
+            print(f"Warning: {problem}")
+
+def _load_previous(output_file):
+    """
+    The metadata last written to output_file and its exact text, or (None, None).
+    """
+    try:
+        with open(output_file, 'r', encoding='utf-8') as f:
+            text = f.read()
+        return json.loads(text), text
+    except (OSError, ValueError):
+        return None, None
+
+def generate_metadata(input_file, output_file, latex_dir="input/latex_files"):
+    """
+    Parses the manuscript and writes the metadata JSON with the file index. Returns the
+    book structure, or None if the manuscript could not be read.
+    If the manuscript is unchanged since output_file was written, only the file index
+    is refreshed, and output_file is left untouched when nothing changed.
+    """
+    if not os.path.exists(input_file):
+        print(f"Error: Metadata file not found at {input_file}")
+        return None
+
+    previous, previous_text = _load_previous(output_file)
+    digest = manuscript_digest(input_file)
+    if previous and previous.get("manuscript_sha256") == digest:
+        print(f"{input_file} unchanged, refreshing the file index of {output_file}...")
+        book_structure = json.loads(previous_text)
+    else:
+        print(f"Reading metadata from {input_file}...")
+        book_structure = parse_metadata(input_file)
     
     if book_structure:
+        book_structure["manuscript_sha256"] = digest
+        index_book_files(book_structure, previous, latex_dir)
+        text = json.dumps(book_structure, indent=4)
+        if text == previous_text:
+            print(f"{output_file} is up to date")
+            return book_structure
+
         # Ensure output directory exists
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         
         with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(book_structure, f, indent=4)
+            f.write(text)
         print(f"Successfully generated {output_file}")
-        
+    return book_structure
+
+def main():
+    input_file = "input/Master Production Manuscript.txt"
+    output_file = "input/metadata.json"
+    
+    book_structure = generate_metadata(input_file, output_file)
+    
+    if book_structure:
         # summary
         print(f"Book: {book_structure['book_title']}")
         print(f"Chapters: {len(book_structure['chapters'])}")
@@ -0,0 +1,177 @@
+import hashlib
+import importlib.util
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+from asset_index import latex_path
+
+# Optional image optimization before embedding.
+#
+# Camera-sized PNG/JPEG files are downsampled to the pixels they need at the target DPI
+# and print width, recompressed, and written to output/.image_cache/ under a hash of the
+# source content and the settings. The chapter LaTeX then points at the cached copies.
+# Requires Pillow; without it (or for other formats) the originals are embedded.
+
+IMAGE_CACHE_DIRNAME = ".image_cache"
+OPTIMIZER_VERSION = 2
+
+DEFAULT_DPI = 300
+# Text width in inches (A4 with the publisher margins is 6.69")
+DEFAULT_PRINT_WIDTH = 6.5
+DEFAULT_JPEG_QUALITY = 85
+
+OPTIMIZABLE_EXTENSIONS = {'.png', '.jpg', '.jpeg'}
+
+
+def image_cache_dir(output_dir):
+    return os.path.join(output_dir, IMAGE_CACHE_DIRNAME)
+
+
+def add_image_arguments(parser):
+    """
+    Adds the image optimization options shared by the converters.
+    """
+    parser.add_argument("--optimize-images", action="store_true",
+                        help="Downsample and recompress PNG/JPEG images (cached) before embedding them")
+    parser.add_argument("--image-dpi", type=int, default=DEFAULT_DPI,
+                        help=f"Target resolution for --optimize-images (default: {DEFAULT_DPI})")
+    parser.add_argument("--image-width", type=float, default=DEFAULT_PRINT_WIDTH,
+                        help=f"Maximum printed image width in inches (default: {DEFAULT_PRINT_WIDTH})")
+    parser.add_argument("--jpeg-quality", type=int, default=DEFAULT_JPEG_QUALITY,
+                        help=f"JPEG quality for --optimize-images (default: {DEFAULT_JPEG_QUALITY})")
+
+
+def image_settings_from_args(args):
+    """
+    The optimizer settings for the chosen options, or None when optimization is off.
+    """
+    if not args.optimize_images:
+        return None
+    return {"dpi": args.image_dpi, "width": args.image_width, "quality": args.jpeg_quality}
+
+
+def settings_version(settings):
+    """
+    Identifies the settings in build fingerprints ("" when optimization is off).
+    """
+    if not settings:
+        return ""
+    return f"images:{OPTIMIZER_VERSION}:{settings['dpi']}:{settings['width']}:{settings['quality']}"
+
+
+def _file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ImageOptimizer:
+    """
+    Produces (and caches) optimized copies of image files.
+    """
+
+    def __init__(self, cache_dir, settings, hashes=None, max_workers=None):
+        self.cache_dir = cache_dir
+        self.settings = settings
+        self.hashes = hashes
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pixels = int(settings["dpi"] * settings["width"])
+
+    def _digest(self, path):
+        # Reuse the build manifest's content hashes when available
+        if self.hashes is not None:
+            return self.hashes.digest(path)
+        return _file_digest(path)
+
+    def cache_path(self, path):
+        ext = os.path.splitext(path)[1].lower()
+        key = hashlib.sha256(f"{self._digest(path)}:{settings_version(self.settings)}".encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{key[:32]}{ext}")
+
+    def optimize(self, path):
+        """
+        Returns the path of the optimized copy, or the original path if the image
+        cannot or need not be optimized.
+        """
+        if os.path.splitext(path)[1].lower() not in OPTIMIZABLE_EXTENSIONS:
+            return path
+        target = self.cache_path(path)
+        if os.path.exists(target):
+            return target
+
+        from PIL import Image, ImageOps
+
+        temp_path = f"{target}.{os.getpid()}.{id(self)}.tmp"
+        try:
+            with Image.open(path) as image:
+                image.load()
+                # The colour profile is written back, so colours do not shift in print
+                icc_profile = image.info.get('icc_profile')
+                # EXIF orientation is not kept in the copy: rotate the pixels instead
+                # (and measure the width of the image as it is shown)
+                image = ImageOps.exif_transpose(image)
+                if image.width > self.max_pixels:
+                    height = max(1, round(image.height * self.max_pixels / image.width))
+                    image = image.resize((self.max_pixels, height), Image.LANCZOS)
+                dpi = (self.settings["dpi"], self.settings["dpi"])
+                if image.format == 'JPEG' or os.path.splitext(path)[1].lower() in ('.jpg', '.jpeg'):
+                    if image.mode not in ('RGB', 'L', 'CMYK'):
+                        image = image.convert('RGB')
+                    image.save(temp_path, format='JPEG', quality=self.settings["quality"], optimize=True,
+                               progressive=True, dpi=dpi, icc_profile=icc_profile)
+                else:
+                    image.save(temp_path, format='PNG', optimize=True, dpi=dpi, icc_profile=icc_profile)
+            # Keep the original bytes when recompressing did not make the file smaller
+            if os.path.getsize(temp_path) >= os.path.getsize(path):
+                shutil.copyfile(path, temp_path)
+            os.replace(temp_path, target)
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            # DecompressionBombError (an image over Pillow's pixel limit) is no OSError
+            print(f"  Warning: Could not optimize image {path}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return path
+        return target
+
+    def optimize_all(self, paths):
+        """
+        Optimizes the images in parallel (Pillow releases the GIL while decoding,
+        resizing and encoding). Returns {original path: path to embed}.
+        """
+        paths = sorted(set(paths))
+        if not paths:
+            return {}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        workers = min(self.max_workers, len(paths))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            targets = list(executor.map(self.optimize, paths))
+        return dict(zip(paths, targets))
+
+
+def optimize_chapter_images(pieces, image_paths, output_dir, settings, hashes=None):
+    """
+    Optimizes the images a chapter embeds and points its \\includegraphics paths at the
+    cached copies. Returns the rewritten pieces.
+    """
+    if importlib.util.find_spec("PIL") is None:
+        print("  Warning: Pillow not installed. Skipping image optimization.")
+        return pieces
+
+    optimizer = ImageOptimizer(image_cache_dir(output_dir), settings, hashes)
+    mapping = optimizer.optimize_all(image_paths)
+    replacements = {f"{{{latex_path(src)}}}": f"{{{latex_path(os.path.abspath(dst))}}}"
+                    for src, dst in mapping.items() if dst != src}
+    if not replacements:
+        return pieces
+
+    saved = sum(os.path.getsize(src) - os.path.getsize(mapping[src]) for src in mapping)
+    print(f"  Optimized {len(replacements)} images ({saved / (1024 * 1024):.1f} MB smaller)")
+    rewritten = []
+    for piece in pieces:
+        for old, new in replacements.items():
+            piece = piece.replace(old, new)
+        rewritten.append(piece)
+    return rewritten
@@ -0,0 +1,211 @@
+import itertools
+import re
+import time
+
+from latex_scanner import scan
+from rule_registry import rule_stats
+
+# Trigger-driven preprocessing of section files.
+#
+# The converters used to run each cleanup rule as its own re.sub / str.replace over the
+# whole file. Here the file is scanned once for the literal "triggers" the rules start
+# with (\cite, \begin{figure}, ``, ...), and at each hit the first rule that matches is
+# applied. Rules keep their original order ("rank"): the rules ranked before a rule are
+# applied to its span first and the rules ranked after it to its output, which gives
+# the same result as running the passes one by one.
+#
+# What a sweep cannot see is text that only comes together once something between it
+# has been removed ("e.\cite{x}g."). Rules are therefore grouped in phases, one sweep
+# each over the output of the previous one: citations, then the structural rewrites
+# (figure blocks, References headers, bibliographies), then the prose rules. Within a
+# sweep, a rule tried right after an earlier rule's replacement is matched as if it
+# followed the replacement's last character, so "\b" sees what the sequential passes
+# saw ("e.g.vs." -> "for examplevs.").
+#
+# The scan is a plain alternation of literals, so the regex engine can skip straight to
+# candidate positions; adding a rule adds triggers, not another pass over the file.
+# Code and math (the protected regions of latex_scanner) are not scanned at all: rules
+# only start in the prose between them, so they never rewrite a code sample.
+#
+# Every rule application is counted in rule_registry.rule_stats (matches, span bytes,
+# time spent matching and rewriting); the trigger scan itself is counted as TRIGGER_SCAN.
+
+TRIGGER_SCAN = "(trigger scan)"
+_WORD = re.compile(r'\w')
+
+
+def _case_variants(literal):
+    options = [(c.lower(), c.upper()) if c.lower() != c.upper() else (c,) for c in literal]
+    return ["".join(chars) for chars in itertools.product(*options)]
+
+
+class Rule:
+    """
+    A named rewrite rule.
+
+    regex:    compiled pattern for the span the rule owns. It may be wider than what
+              the rule rewrites (e.g. a whole \\section{...} for the colon rule) so that
+              text which only becomes a match after earlier rules still falls inside
+              one span.
+    apply:    function(span_text) -> replacement text.
+    triggers: literals every match starts with (matched case-insensitively if the
+              regex is).
+    atomic:   the span can contain no match of an earlier rule and the replacement no
+              match of a later one, so the nested passes can be skipped.
+    """
+
+    def __init__(self, name, regex, apply, triggers, atomic=False):
+        self.name = name
+        self.regex = regex
+        self.apply = apply
+        self.atomic = atomic
+        if regex.flags & re.IGNORECASE:
+            triggers = [variant for t in triggers for variant in _case_variants(t)]
+        self.triggers = tuple(dict.fromkeys(triggers))
+
+
+def literal_rule(name, literal, replacement):
+    return Rule(name, re.compile(re.escape(literal)), lambda span: replacement, [literal], atomic=True)
+
+
+def regex_rule(name, regex, repl, triggers, span_regex=None, atomic=False):
+    """
+    A rule that runs regex.sub(repl, ...) over its span. span_regex defaults to the
+    regex itself.
+    """
+    if span_regex is None:
+        span_regex = regex
+    return Rule(name, span_regex, lambda span: regex.sub(repl, span), triggers, atomic=atomic)
+
+
+def _match_after(rule, text, start, out):
+    """
+    Matches rule at start right after an earlier rule's replacement. The sequential
+    passes would have run it over the joined text, so a \\b has to see whether the
+    replacement ends in a word character, not whether the original span did.
+    """
+    before = next((piece[-1] for piece in reversed(out) if piece), "")
+    is_word = _WORD.match(before) is not None
+    if is_word == (start > 0 and _WORD.match(text, start - 1) is not None):
+        return rule.regex.match(text, start)
+    # Match the rest of the text behind a stand-in character of the right kind
+    return rule.regex.match(("a" if is_word else " ") + text[start:], 1)
+
+
+class Preprocessor:
+    """
+    Applies ordered phases of Rules: each phase is a single sweep over the output of
+    the previous one.
+    """
+
+    def __init__(self, phases, stats=None):
+        self.rules = []
+        self.phases = []
+        for rules in phases:
+            first = len(self.rules)
+            self.rules += rules
+            self.phases.append((first, len(self.rules)))
+        self.stats = stats if stats is not None else rule_stats
+        self._scanners = {}
+
+    def _scanner(self, first, last):
+        key = (first, last)
+        if key not in self._scanners:
+            triggers = {t for rule in self.rules[first:last] for t in rule.triggers}
+            self._scanners[key] = re.compile("|".join(re.escape(t) for t in sorted(triggers)))
+        return self._scanners[key]
+
+    def run(self, text):
+        """
+        Rewrites text with all phases.
+        """
+        for first, last in self.phases:
+            text = self._sweep(text, first, last)
+        return text
+
+    def _sweep(self, text, first, last):
+        """
+        Rewrites text with rules[first:last] in one sweep.
+        """
+        if first >= last or not text:
+            return text
+        scanner = self._scanner(first, last)
+        clock = time.perf_counter
+        run_start = clock()
+        protected = scan(text).protected
+        region = 0
+        # Per-rule [matches, bytes, seconds] for this call, recorded in stats at the end;
+        # the trigger scan gets whatever time the rules (and nested passes) did not use
+        counters = {}
+        busy = 0.0
+
+        out = []
+        copied = 0
+        # Rank of the rule whose replacement ends at copied (len(rules): none does)
+        edge = len(self.rules)
+        pos = 0
+        while True:
+            # Search the prose up to the next protected region, then continue after it
+            while region < len(protected) and protected[region][1] <= pos:
+                region += 1
+            if region < len(protected) and protected[region][0] <= pos:
+                pos = protected[region][1]
+                continue
+            limit = protected[region][0] if region < len(protected) else len(text)
+            hit = scanner.search(text, pos, limit)
+            if hit is None:
+                if region == len(protected):
+                    break
+                pos = protected[region][1]
+                continue
+            start = hit.start()
+            match_start = clock()
+            for i in range(first, last):
+                rule = self.rules[i]
+                if text.startswith(rule.triggers, start):
+                    if start == copied and edge < i:
+                        match = _match_after(rule, text, start, out)
+                    else:
+                        match = rule.regex.match(text, start)
+                    if match:
+                        break
+            else:
+                busy += clock() - match_start
+                pos = start + 1
+                continue
+
+            span = match.group(0)
+            if rule.atomic:
+                replacement = rule.apply(span)
+                own_time = clock() - match_start
+                busy += own_time
+            else:
+                # Only the rule's own match and rewrite count, not the nested passes
+                own_time = clock() - match_start
+                inner = self._sweep(span, first, i)
+                apply_start = clock()
+                applied = rule.apply(inner)
+                own_time += clock() - apply_start
+                replacement = self._sweep(applied, i + 1, last)
+                busy += clock() - match_start
+            counter = counters.get(rule.name)
+            if counter is None:
+                counter = counters[rule.name] = [0, 0, 0.0]
+            counter[0] += 1
+            counter[1] += len(span)
+            counter[2] += own_time
+            out.append(text[copied:start])
+            out.append(replacement)
+            copied = start + len(span)
+            edge = i
+            pos = max(copied, start + 1)
+
+        stats = self.stats
+        for name, (matches, scanned, seconds) in counters.items():
+            stats.record(name, matches, scanned, seconds)
+        prose = len(text) - sum(end - start for start, end in protected)
+        stats.record(TRIGGER_SCAN, scanned=prose, seconds=clock() - run_start - busy)
+        if not out:
+            return text
+        out.append(text[copied:])
+        return "".join(out)
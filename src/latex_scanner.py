@@ -0,0 +1,420 @@
+import bisect
+import functools
+import re
+
+# Brace-aware LaTeX scanning in linear time.
+#
+# A section is walked once with a tokenizer that only stops at braces, escapes,
+# comments, math delimiters, verbatim commands and \begin/\end. The walk records the
+# matching "}" of every "{" and the span of every environment, so finding a command's
+# argument or an environment's end is a lookup instead of a regex that backtracks
+# (".*?" over an unterminated \begin{figure}) or stops at the first "}" ("[^}]+" in
+# \label{a_{1}}). Braces and environments inside % comments do not count, the same as
+# for LaTeX itself.
+#
+# The same walk builds the region map: the spans of code (verbatim, lstlisting,
+# minted, \verb, \lstinline, ...) and math ($...$, \[...\], equation, align, ...).
+# The cleanup rules only run over the prose between them (see latex_preprocess), so
+# quote, bold and "e.g." rewrites never reach a code sample or f''(x). Code is opaque
+# to the scan as well: its braces, % signs and \begin{...} are not counted.
+#
+# The patterns below (commands with [optional] and {brace} arguments, environments,
+# runs of other patterns) answer match/search/finditer/sub like compiled regexes, so
+# rule_registry and latex_preprocess use them in place of re patterns. Their matches
+# have group()/span()/start()/end() with the arguments as groups.
+
+# Environments whose body LaTeX reads as raw text
+VERBATIM_ENVIRONMENTS = {"verbatim", "verbatim*", "Verbatim", "Verbatim*", "BVerbatim", "LVerbatim",
+                         "lstlisting", "minted", "comment"}
+MATH_ENVIRONMENTS = {"equation", "equation*", "align", "align*", "alignat", "alignat*", "gather", "gather*",
+                     "multline", "multline*", "flalign", "flalign*", "eqnarray", "eqnarray*", "displaymath",
+                     "math"}
+
+_TOKEN = re.compile(r"""
+    \\(?P<env>begin|end)[ \t]*\{(?P<name>[^{}\\%\n]*)\}
+  | \\(?P<inline>verb\*?|lstinline|mintinline)(?![a-zA-Z])
+  | \\(?P<math>[(\[])
+  | \\[^a-zA-Z]
+  | (?P<dollar>\$\$?)
+  | %[^\n]*
+  | [{}]
+""", re.VERBOSE | re.DOTALL)
+# Inside [optional] arguments: the closing "]", a brace group to skip, or a blank line
+# (optional arguments do not run over paragraphs)
+_BRACKET = re.compile(r'[\]{]|\n[ \t]*\n')
+# The end of inline $...$ math and of \(...\), \[...\] and $$...$$ (math cannot run
+# over a paragraph)
+_INLINE_MATH_END = re.compile(r'\\.|\$|\n[ \t]*\n', re.DOTALL)
+_MATH_END = {
+    '(': re.compile(r'\\\)|\n[ \t]*\n'),
+    '[': re.compile(r'\\\]|\n[ \t]*\n'),
+    '$$': re.compile(r'\$\$|\n[ \t]*\n'),
+}
+_WHITESPACE = re.compile(r'\s*')
+
+
+class LatexScan:
+    """
+    Brace pairs, environment spans and protected regions of one text.
+
+    closing:      offset of "{" -> offset of its matching "}"
+    environments: offset of "\\begin" -> (name, body start, offset of "\\end", end)
+    protected:    sorted, non-overlapping (start, end) spans of code and math
+    unclosed:     (name, offset of "\\begin") of environments that are never ended
+    unopened:     (name, offset of "\\end") of ends without a \\begin
+    Unbalanced braces and environments are otherwise simply not recorded.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.closing = {}
+        self.environments = {}
+        self.protected = []
+        self.unopened = []
+        braces = []
+        open_environments = {}
+        pos = 0
+        while True:
+            token = _TOKEN.search(text, pos)
+            if token is None:
+                break
+            pos = token.end()
+            kind = token.lastgroup
+            if kind == 'name':
+                name = token.group('name').strip()
+                if token.group('env') == 'begin':
+                    if name in VERBATIM_ENVIRONMENTS:
+                        pos = self._verbatim_environment(name, token)
+                    else:
+                        open_environments.setdefault(name, []).append((token.start(), token.end()))
+                elif open_environments.get(name):
+                    start, body_start = open_environments[name].pop()
+                    self.environments[start] = (name, body_start, token.start(), token.end())
+                    if name in MATH_ENVIRONMENTS:
+                        self.protected.append((start, token.end()))
+                else:
+                    self.unopened.append((name, token.start()))
+            elif kind == 'inline':
+                pos = self._inline_verbatim(token)
+            elif kind == 'math':
+                pos = self._delimited_math(token, token.group('math'))
+            elif kind == 'dollar':
+                pos = self._dollar_math(token)
+            elif text[token.start()] == '{':
+                braces.append(token.start())
+            elif text[token.start()] == '}' and braces:
+                self.closing[braces.pop()] = token.start()
+        self.unclosed = sorted(((name, start) for name, opened in open_environments.items()
+                                for start, _ in opened), key=lambda item: item[1])
+        # Math environments are recorded when they close, after what they contain
+        merged = []
+        for start, end in sorted(self.protected):
+            if merged and start < merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        self.protected = merged
+        self.starts = [start for start, _ in merged]
+
+    def _verbatim_environment(self, name, token):
+        end_tag = f"\\end{{{name}}}"
+        end_start = self.text.find(end_tag, token.end())
+        if end_start == -1:
+            # Like LaTeX, an unterminated verbatim block takes the rest of the file
+            end_start = end = len(self.text)
+        else:
+            end = end_start + len(end_tag)
+            self.environments[token.start()] = (name, token.end(), end_start, end)
+        self.protected.append((token.start(), end))
+        return end
+
+    def _inline_verbatim(self, token):
+        # \verb|x|, \lstinline[opts]{x} / \lstinline!x!, \mintinline{lang}{x}
+        # (all on one line)
+        text = self.text
+        pos = token.end()
+        line_end = text.find('\n', pos)
+        if line_end == -1:
+            line_end = len(text)
+        if text.startswith('[', pos):
+            close = text.find(']', pos, line_end)
+            if close == -1:
+                return pos
+            pos = close + 1
+        if token.group('inline') == 'mintinline':
+            close = text.find('}', pos, line_end) if text.startswith('{', pos) else -1
+            if close == -1:
+                return pos
+            pos = close + 1
+        if pos >= line_end or text[pos] in ' \t':
+            return pos
+        delimiter = '}' if text[pos] == '{' else text[pos]
+        close = text.find(delimiter, pos + 1, line_end)
+        if close == -1:
+            return pos
+        self.protected.append((token.start(), close + 1))
+        return close + 1
+
+    def _delimited_math(self, token, opening):
+        found = _MATH_END[opening].search(self.text, token.end())
+        if found is None or found.group(0)[0] == '\n':
+            return token.end()
+        self.protected.append((token.start(), found.end()))
+        return found.end()
+
+    def _dollar_math(self, token):
+        text = self.text
+        if token.group('dollar') == '$$':
+            return self._delimited_math(token, '$$')
+        pos = token.end()
+        while True:
+            found = _INLINE_MATH_END.search(text, pos)
+            if found is None or found.group(0)[0] == '\n':
+                # An unpaired $ is left as text
+                return token.end()
+            if found.group(0) == '$':
+                self.protected.append((token.start(), found.end()))
+                return found.end()
+            pos = found.end()
+
+    def protected_end(self, offset):
+        """
+        The end of the protected region containing offset, or None if offset is prose.
+        """
+        i = bisect.bisect_right(self.starts, offset) - 1
+        if i >= 0 and self.protected[i][1] > offset:
+            return self.protected[i][1]
+        return None
+
+    def argument(self, offset):
+        """
+        (start, end) of the brace group opening at offset, without the braces; None if
+        there is no "{" there or it is never closed.
+        """
+        close = self.closing.get(offset)
+        return None if close is None else (offset + 1, close)
+
+    def optional(self, offset):
+        """
+        (start, end) of the [optional] argument opening at offset, without the
+        brackets; None if it is not closed before a blank line.
+        """
+        pos = offset + 1
+        while True:
+            found = _BRACKET.search(self.text, pos)
+            if found is None or found.group(0) not in (']', '{'):
+                return None
+            if found.group(0) == ']':
+                return offset + 1, found.start()
+            close = self.closing.get(found.start())
+            if close is None:
+                return None
+            pos = close + 1
+
+
+@functools.lru_cache(maxsize=32)
+def scan(text):
+    """
+    The LatexScan of a text; the rules of a section all share one scan.
+    """
+    return LatexScan(text)
+
+
+class ScanMatch:
+    """
+    A match in the shape of re.Match: group(0) is the whole match, groups 1.. are the
+    pattern's arguments (None when an optional part is absent).
+    """
+
+    def __init__(self, string, start, end, groups=(), name=None):
+        self.string = string
+        self._spans = [(start, end)] + list(groups)
+        self.name = name
+
+    def group(self, index=0):
+        span = self._spans[index]
+        return None if span is None else self.string[span[0]:span[1]]
+
+    def groups(self):
+        return tuple(self.group(i) for i in range(1, len(self._spans)))
+
+    def span(self, index=0):
+        return self._spans[index] or (-1, -1)
+
+    def start(self, index=0):
+        return self.span(index)[0]
+
+    def end(self, index=0):
+        return self.span(index)[1]
+
+    def replace_group(self, index, replacement):
+        """
+        The matched text with group index replaced.
+        """
+        start, end = self._spans[0]
+        group_start, group_end = self._spans[index]
+        return self.string[start:group_start] + replacement + self.string[group_end:end]
+
+
+class ScanPattern:
+    """
+    Base class: subclasses implement match(text, pos); trigger is a regex for the
+    positions a match can start at.
+    """
+
+    flags = 0
+    trigger = None
+
+    def match(self, text, pos=0):
+        raise NotImplementedError
+
+    def search(self, text, pos=0):
+        for candidate in self.trigger.finditer(text, pos):
+            found = self.match(text, candidate.start())
+            if found:
+                return found
+        return None
+
+    def finditer(self, text, pos=0):
+        while True:
+            found = self.search(text, pos)
+            if found is None:
+                return
+            yield found
+            pos = max(found.end(), found.start() + 1)
+
+    def sub(self, repl, text):
+        out = []
+        copied = 0
+        for found in self.finditer(text):
+            out.append(text[copied:found.start()])
+            out.append(repl(found) if callable(repl) else repl)
+            copied = found.end()
+        if not out:
+            return text
+        out.append(text[copied:])
+        return "".join(out)
+
+
+def _trigger(pattern):
+    return pattern.trigger if isinstance(pattern, ScanPattern) else pattern
+
+
+class CommandPattern(ScanPattern):
+    """
+    \\name[optional]{argument}...: group 1 is the optional argument (if optional is
+    set), followed by one group per brace argument. match.name is the command name.
+    prefix is a regex the match starts with, right before the command (e.g. "Figure~"
+    before \\ref); its groups come first.
+    """
+
+    def __init__(self, names, optional=False, arguments=1, star=False, prefix=None):
+        self.names = tuple(names)
+        self.optional = optional
+        self.arguments = arguments
+        self.star = star
+        self.prefix_groups = prefix.groups if prefix is not None else 0
+        self.flags = prefix.flags & re.IGNORECASE if prefix is not None else 0
+        alternatives = "|".join(re.escape(n) for n in sorted(self.names, key=len, reverse=True))
+        command = r'\\(' + alternatives + r')(?![a-zA-Z])'
+        self.trigger = re.compile((prefix.pattern if prefix is not None else "") + command, self.flags)
+
+    def match(self, text, pos=0):
+        head = self.trigger.match(text, pos)
+        if head is None:
+            return None
+        i = head.end()
+        if self.star and text.startswith('*', i):
+            i += 1
+        groups = [head.span(g) if head.start(g) != -1 else None for g in range(1, self.prefix_groups + 1)]
+        if self.optional:
+            span = None
+            if text.startswith('[', i):
+                span = scan(text).optional(i)
+                if span is None:
+                    return None
+                i = span[1] + 1
+            groups.append(span)
+        for _ in range(self.arguments):
+            span = scan(text).argument(i) if text.startswith('{', i) else None
+            if span is None:
+                return None
+            groups.append(span)
+            i = span[1] + 1
+        return ScanMatch(text, pos, i, groups, head.group(self.prefix_groups + 1))
+
+
+class EnvironmentPattern(ScanPattern):
+    """
+    \\begin{name}{argument}... \\end{name} plus an optional trailing regex matched right
+    after it: group 1 is the environment, group 2 its body (after the arguments),
+    group 3 the trailing text (None if absent).
+    """
+
+    def __init__(self, name, arguments=0, trailing=None):
+        self.name = name
+        self.arguments = arguments
+        self.trailing = trailing
+        self.trigger = re.compile(r'\\begin[ \t]*\{[ \t]*' + re.escape(name) + r'[ \t]*\}')
+
+    def match(self, text, pos=0):
+        if not text.startswith('\\begin', pos):
+            return None
+        result = scan(text)
+        environment = result.environments.get(pos)
+        if environment is None or environment[0] != self.name:
+            return None
+        _, body_start, end_start, end = environment
+        for _ in range(self.arguments):
+            span = result.argument(body_start) if text.startswith('{', body_start) else None
+            if span is None or span[1] > end_start:
+                return None
+            body_start = span[1] + 1
+        trailing = self.trailing.match(text, end) if self.trailing is not None else None
+        groups = [(pos, end), (body_start, end_start), trailing.span() if trailing else None]
+        return ScanMatch(text, pos, trailing.end() if trailing else end, groups, self.name)
+
+
+class AnyPattern(ScanPattern):
+    """
+    The first of several patterns (ScanPatterns or compiled regexes) that matches.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.trigger = re.compile("|".join(f"(?:{_trigger(p).pattern})" for p in self.patterns))
+
+    def match(self, text, pos=0):
+        for pattern in self.patterns:
+            found = pattern.match(text, pos)
+            if found:
+                return found
+        return None
+
+
+class RunPattern(ScanPattern):
+    """
+    A head pattern followed by any run of whitespace and matches of the skip patterns
+    (e.g. a References header and the citations and figure blocks after it).
+    """
+
+    def __init__(self, head, skip):
+        self.head = head
+        self.skip = list(skip)
+        self.flags = head.flags
+        self.trigger = _trigger(head)
+
+    def match(self, text, pos=0):
+        head = self.head.match(text, pos)
+        if head is None:
+            return None
+        i = head.end()
+        while True:
+            i = _WHITESPACE.match(text, i).end()
+            for pattern in self.skip:
+                found = pattern.match(text, i)
+                if found and found.end() > i:
+                    i = found.end()
+                    break
+            else:
+                return ScanMatch(text, pos, i)
@@ -0,0 +1,188 @@
+import os
+import re
+import zipfile
+
+from paragraph_rules import PublisherParagraphRules, last_conclusion_index
+from stage_timer import POST_PROCESS, stage_times
+
+# Streaming publisher post-processor.
+#
+# post_process_docx opens the DOCX with python-docx, which builds the object tree of the
+# whole document before the paragraphs are walked several times. Here word/document.xml
+# is read from the zip with lxml's iterparse and every body paragraph is rewritten and
+# written out as soon as it is complete, so memory stays bounded by the largest
+# paragraph/table. numbering.xml is small and is edited as a whole part; the styles,
+# page layout and footer already come from the reference document (see reference_doc).
+# Elements are parsed with python-docx's element classes, so the paragraph rules
+# (paragraph_rules) are the same ones post_process_docx runs.
+
+DOCUMENT_PART = "word/document.xml"
+DOCUMENT_RELS_PART = "word/_rels/document.xml.rels"
+STYLES_PART = "word/styles.xml"
+NUMBERING_PART = "word/numbering.xml"
+CONTENT_TYPES_PART = "[Content_Types].xml"
+
+_xmlns_declaration = re.compile(rb'\sxmlns(?::([\w.-]+))?="([^"]*)"')
+
+
+def set_numbering_suffix(numbering_element):
+    """
+    Numbered headings are followed by a space instead of a tab.
+    """
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+
+    for lvl in numbering_element.xpath('.//w:lvl'):
+        suff = lvl.find(qn('w:suff'))
+        if suff is None:
+            suff = OxmlElement('w:suff')
+            lvl.append(suff)
+        suff.set(qn('w:val'), 'space')
+
+
+def iter_body_children(stream):
+    """
+    Parses document.xml incrementally and yields (root, body, child) for each complete
+    child of w:body. The child is dropped from the tree when the caller moves on.
+    """
+    from docx.oxml.ns import qn
+    from docx.oxml.parser import element_class_lookup
+    from lxml import etree
+
+    events = etree.iterparse(stream, events=('start', 'end'))
+    events.set_element_class_lookup(element_class_lookup)
+    body_tag = qn('w:body')
+    root = None
+    body = None
+    for event, element in events:
+        if event == 'start':
+            if root is None:
+                root = element
+            elif body is None and element.tag == body_tag:
+                body = element
+            continue
+        if body is not None and element.getparent() is body:
+            yield root, body, element
+            body.remove(element)
+
+
+def find_last_conclusion(zin, rules):
+    """
+    Light pre-scan of document.xml: position of the last "Conclusion" Heading 3 among
+    the body paragraphs, or -1.
+    """
+    from docx.oxml.ns import qn
+
+    p_tag = qn('w:p')
+    with zin.open(DOCUMENT_PART) as stream:
+        paragraphs = (child for _, _, child in iter_body_children(stream) if child.tag == p_tag)
+        return last_conclusion_index(paragraphs, rules)
+
+
+def strip_declared(xml, declared):
+    """
+    Removes namespace declarations already made on the document root from the first
+    tag of a serialized subtree.
+    """
+    end = xml.index(b'>')
+
+    def keep(match):
+        prefix = match.group(1).decode() if match.group(1) else None
+        return b'' if declared.get(prefix) == match.group(2).decode() else match.group(0)
+
+    return _xmlns_declaration.sub(keep, xml[:end]) + xml[end:]
+
+
+def qualified_name(element):
+    local = element.tag.split('}')[-1]
+    return f"{element.prefix}:{local}" if element.prefix else local
+
+
+def _write_document(zin, zout, rules):
+    """
+    Streams document.xml into the new package, applying the paragraph rules.
+    """
+    from docx.oxml.ns import qn
+    from lxml import etree
+
+    p_tag = qn('w:p')
+    with zin.open(DOCUMENT_PART) as stream, zout.open(DOCUMENT_PART, 'w') as out:
+        started = False
+        declared = {}
+        for root, body, child in iter_body_children(stream):
+            if not started:
+                declared = dict(root.nsmap)
+                shell = etree.Element(root.tag, attrib=dict(root.attrib), nsmap=root.nsmap)
+                out.write(b"<?xml version='1.0' encoding='UTF-8' standalone='yes'?>\n")
+                out.write(etree.tostring(shell)[:-2] + b'>')
+                for sibling in root:
+                    if sibling is body:
+                        break
+                    out.write(strip_declared(etree.tostring(sibling), declared))
+                out.write(f"<{qualified_name(body)}>".encode())
+                started = True
+
+            if child.tag == p_tag and not rules.apply(child):
+                continue
+            out.write(strip_declared(etree.tostring(child), declared))
+
+        if started:
+            out.write(f"</{qualified_name(body)}></{qualified_name(root)}>".encode())
+        else:
+            # No body children, so no paragraph to rewrite: keep the part as it is
+            out.write(zin.read(DOCUMENT_PART))
+
+
+def stream_post_process_docx(docx_path, paragraph_rules=True):
+    """
+    Applies the publisher post-processing (see post_process_docx) by rewriting the DOCX
+    parts straight from the zip, streaming document.xml. Without paragraph_rules the
+    document is copied as it is and only numbering.xml changes.
+    """
+    try:
+        from docx.opc.oxml import serialize_part_xml
+        from docx.oxml.parser import parse_xml
+        from docx.styles.styles import Styles
+    except ImportError:
+        print("  Warning: python-docx not installed. Skipping post-processing style application.")
+        return
+
+    print(f"  Applying Publisher Styles (streaming) to {docx_path}...")
+    temp_path = f"{docx_path}.{os.getpid()}.tmp"
+    parts = stage_times.parts(POST_PROCESS)
+    try:
+        with zipfile.ZipFile(docx_path) as zin:
+            rules = None
+            if paragraph_rules:
+                # Read only, for the style names of the paragraphs
+                rules = PublisherParagraphRules(Styles(parse_xml(zin.read(STYLES_PART))))
+                rules.conclusion_index = find_last_conclusion(zin, rules)
+                parts.done("conclusion_scan", bytes_in=os.path.getsize(docx_path))
+
+            with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zout:
+                if rules is not None:
+                    _write_document(zin, zout, rules)
+                    parts.done("document")
+
+                for info in zin.infolist():
+                    name = info.filename
+                    if name == DOCUMENT_PART and rules is not None:
+                        continue
+                    if name == NUMBERING_PART:
+                        numbering = parse_xml(zin.read(name))
+                        set_numbering_suffix(numbering)
+                        print("  Enforced Space suffix for numbering levels.")
+                        data = serialize_part_xml(numbering)
+                    else:
+                        data = zin.read(name)
+                    zout.writestr(info, data, compress_type=zipfile.ZIP_DEFLATED)
+
+        os.replace(temp_path, docx_path)
+        parts.done("parts", bytes_out=os.path.getsize(docx_path))
+        print("  Publisher Styles applied successfully.")
+    except Exception as e:
+        print(f"  Error applying streaming post-processing: {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
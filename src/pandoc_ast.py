@@ -0,0 +1,209 @@
+import asyncio
+import json
+import re
+
+import pandoc_runner
+
+# Pandoc AST helpers. Documents are the plain JSON structures produced by
+# `pandoc -t json`: {"pandoc-api-version": [...], "meta": {...}, "blocks": [...]},
+# where every element is {"t": Type, "c": contents}.
+
+
+def latex_to_ast(latex, extra_args=None, label=""):
+    """
+    Parses LaTeX with pandoc and returns the JSON AST as a dict.
+    """
+    return asyncio.run(latex_to_ast_async(latex, extra_args, label))
+
+
+async def latex_to_ast_async(latex, extra_args=None, label=""):
+    output = await pandoc_runner.convert_text_async(latex, 'json', 'latex', extra_args=extra_args, label=label)
+    return json.loads(output)
+
+
+async def ast_to_file_async(doc, to_format, output_path, extra_args=None, label=""):
+    await pandoc_runner.convert_text_async(json.dumps(doc), to_format, 'json', outputfile=output_path,
+                                           extra_args=extra_args, label=label)
+
+
+def make_document(blocks, api_version, meta=None):
+    return {"pandoc-api-version": api_version, "meta": meta or {}, "blocks": blocks}
+
+
+def iter_blocks(blocks):
+    """
+    Yields every block element, descending into Divs, BlockQuotes, lists and table cells.
+    """
+    for block in blocks:
+        yield block
+        for child_list in _child_block_lists(block):
+            yield from iter_blocks(child_list)
+
+
+def _child_block_lists(block):
+    t = block.get("t")
+    c = block.get("c")
+    if t == "Div":
+        return [c[1]]
+    if t == "BlockQuote":
+        return [c]
+    if t == "BulletList":
+        return c
+    if t == "OrderedList":
+        return c[1]
+    if t == "DefinitionList":
+        return [blocks for _, definitions in c for blocks in definitions]
+    if t == "Figure":
+        return [c[2]]
+    if t == "Table":
+        # Table attr caption colspecs head bodies foot; head and foot are [attr, rows],
+        # a body is [attr, row_head_columns, head_rows, rows]; a row is [attr, cells]
+        # and a cell [attr, alignment, row_span, col_span, blocks]
+        head, bodies, foot = c[3], c[4], c[5]
+        rows = head[1] + [row for body in bodies for row in body[2] + body[3]] + foot[1]
+        return [cell[4] for row in rows for cell in row[1]]
+    return []
+
+
+def map_block_lists(blocks, fn):
+    """
+    Calls fn(blocks) -> blocks on the given block list and on every nested block list
+    (innermost first), replacing each list in place.
+    """
+    for block in blocks:
+        for child_list in _child_block_lists(block):
+            map_block_lists(child_list, fn)
+    blocks[:] = fn(blocks)
+    return blocks
+
+
+def select_divs(blocks, keep, drop):
+    """
+    Replaces every Div whose only class is keep by its contents and removes every Div
+    whose only class is in drop (in place).
+    """
+    def select(block_list):
+        out = []
+        for block in block_list:
+            if block.get("t") == "Div" and len(block["c"][0][1]) == 1:
+                div_class = block["c"][0][1][0]
+                if div_class == keep:
+                    out.extend(block["c"][1])
+                    continue
+                if div_class in drop:
+                    continue
+            out.append(block)
+        return out
+
+    return map_block_lists(blocks, select)
+
+
+def shift_headers(blocks, delta):
+    """
+    Shifts the level of every Header by delta (in place).
+    """
+    if not delta:
+        return blocks
+    for block in iter_blocks(blocks):
+        if block.get("t") == "Header":
+            block["c"][0] = max(1, block["c"][0] + delta)
+    return blocks
+
+
+def dedupe_identifiers(blocks):
+    """
+    Makes Header identifiers unique the way pandoc does within one document
+    ("intro", "intro-1", ...). Needed when blocks were parsed separately.
+    """
+    seen = set()
+    for block in iter_blocks(blocks):
+        if block.get("t") != "Header":
+            continue
+        attr = block["c"][1]
+        ident = attr[0]
+        if not ident:
+            continue
+        if ident in seen:
+            n = 1
+            while f"{ident}-{n}" in seen:
+                n += 1
+            ident = f"{ident}-{n}"
+            attr[0] = ident
+        seen.add(ident)
+    return blocks
+
+
+_whitespace_split = re.compile(r'( |\n)')
+
+INLINE_TYPES = {
+    "Str", "Emph", "Underline", "Strong", "Strikeout", "Superscript", "Subscript",
+    "SmallCaps", "Quoted", "Cite", "Code", "Space", "SoftBreak", "LineBreak",
+    "Math", "RawInline", "Link", "Image", "Note", "Span",
+}
+
+
+def _is_inline_list(value):
+    return isinstance(value, list) and value and all(
+        isinstance(item, dict) and item.get("t") in INLINE_TYPES for item in value
+    )
+
+
+def map_inline_lists(node, fn):
+    """
+    Calls fn(inlines) -> inlines on every list of inlines in the tree (innermost first)
+    and stores the result in place. Code, Math and raw elements only hold strings, so
+    their contents are never passed to fn.
+    """
+    if isinstance(node, dict):
+        for key, value in node.items():
+            node[key] = map_inline_lists(value, fn)
+        return node
+    if isinstance(node, list):
+        for i, item in enumerate(node):
+            node[i] = map_inline_lists(item, fn)
+        if _is_inline_list(node):
+            return fn(node)
+        return node
+    return node
+
+
+def stringify(inlines):
+    """
+    Plain text of a list of inlines (like pandoc's stringify).
+    """
+    parts = []
+    for inline in inlines:
+        t = inline.get("t")
+        c = inline.get("c")
+        if t == "Str":
+            parts.append(c)
+        elif t in ("Space", "SoftBreak"):
+            parts.append(" ")
+        elif t == "LineBreak":
+            parts.append("\n")
+        elif t in ("Code", "Math"):
+            parts.append(c[1])
+        elif t == "Quoted":
+            quote = '"' if c[0]["t"] == "DoubleQuote" else "'"
+            parts.append(quote + stringify(c[1]) + quote)
+        elif t in ("Emph", "Underline", "Strong", "Strikeout", "Superscript", "Subscript", "SmallCaps"):
+            parts.append(stringify(c))
+        elif t in ("Span", "Link", "Image", "Cite"):
+            parts.append(stringify(c[1]))
+    return "".join(parts)
+
+
+def text_to_inlines(text):
+    """
+    Converts plain text back to Str / Space / SoftBreak inlines.
+    """
+    inlines = []
+    for token in _whitespace_split.split(text):
+        if token == "\n":
+            inlines.append({"t": "SoftBreak"})
+        elif token == " ":
+            if not inlines or inlines[-1]["t"] != "Space":
+                inlines.append({"t": "Space"})
+        elif token:
+            inlines.append({"t": "Str", "c": token})
+    return inlines
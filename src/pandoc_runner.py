@@ -0,0 +1,181 @@
+import asyncio
+import multiprocessing
+import sys
+
+# Pandoc subprocesses, run with asyncio instead of pypandoc's blocking call.
+#
+# pandoc is started directly (the binary pypandoc ships or finds) with the LaTeX or JSON
+# on stdin. Its stderr is read line by line while it runs, so warnings are printed as
+# they arrive, prefixed with the chapter they belong to. Every call has a timeout: a
+# hung or runaway pandoc is killed and reported as a PandocError instead of blocking
+# the build. Ctrl+C (or any cancellation) kills the pandoc process before the error
+# propagates, so no orphaned pandoc keeps running.
+#
+# --pandoc-jobs caps the number of pandoc processes running at once over the whole
+# book. The cap is a semaphore created by convert_book and handed to every worker
+# process when the pool starts (see configure); a worker waiting for a slot keeps
+# nothing else blocked, and the other workers go on preprocessing and post-processing
+# their chapters meanwhile. Within a process, several pandoc calls (the section cache's
+# misses, the targets of convert_editions) run concurrently with gather().
+
+DEFAULT_TIMEOUT = 600
+# Seconds between attempts to get a --pandoc-jobs slot
+SLOT_POLL_INTERVAL = 0.05
+
+
+class PandocError(RuntimeError):
+    pass
+
+
+class PandocTimeout(PandocError):
+    pass
+
+
+# Settings of this process (set by configure in every worker)
+_limit = None
+_timeout = DEFAULT_TIMEOUT
+
+
+def add_pandoc_arguments(parser):
+    parser.add_argument("--pandoc-jobs", type=int, default=0,
+                        help="Most pandoc processes running at once over all chapters (default: no limit)")
+    parser.add_argument("--pandoc-timeout", type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Seconds before a pandoc call is killed, 0 for none (default: {DEFAULT_TIMEOUT})")
+
+
+def make_limit(pandoc_jobs):
+    """
+    The semaphore shared by the worker processes for --pandoc-jobs, or None.
+    """
+    if not pandoc_jobs or pandoc_jobs < 1:
+        return None
+    return multiprocessing.BoundedSemaphore(pandoc_jobs)
+
+
+def configure(limit=None, timeout=DEFAULT_TIMEOUT):
+    """
+    Sets this process's pandoc slot semaphore and timeout (the worker pool initializer).
+    """
+    global _limit, _timeout
+    _limit = limit
+    _timeout = timeout
+
+
+def _pypandoc():
+    # Imported on first use, so the converters load without it (--check runs no pandoc)
+    import pypandoc
+    return pypandoc
+
+
+def pandoc_version():
+    return _pypandoc().get_pandoc_version()
+
+
+async def _acquire_slot():
+    # Polled rather than blocking, so a cancelled wait never holds a slot
+    if _limit is None:
+        return False
+    while not _limit.acquire(False):
+        await asyncio.sleep(SLOT_POLL_INTERVAL)
+    return True
+
+
+async def _feed(stream, data):
+    # If pandoc exits before reading all of its input, the write fails; the exit code
+    # and stderr say why, so leave the error to run_pandoc
+    try:
+        if data:
+            stream.write(data)
+            await stream.drain()
+        stream.close()
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+
+
+async def _relay_stderr(stream, label, lines):
+    prefix = f"  [pandoc {label}] " if label else "  [pandoc] "
+    while True:
+        line = await stream.readline()
+        if not line:
+            return
+        text = line.decode('utf-8', errors='replace').rstrip()
+        lines.append(text)
+        print(prefix + text, flush=True)
+
+
+async def run_pandoc(args, input_data=None, label="", timeout=None):
+    """
+    Runs pandoc with args, feeding input_data (bytes) on stdin. Returns its stdout.
+    Raises PandocTimeout after timeout seconds (default: the configured timeout) and
+    PandocError if pandoc fails; pandoc is killed whenever the call does not complete.
+    """
+    timeout = _timeout if timeout is None else timeout
+    has_slot = await _acquire_slot()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            _pypandoc().get_pandoc_path(), *args,
+            stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            # No console window per pandoc call on Windows
+            creationflags=0x08000000 if sys.platform == 'win32' else 0,
+        )
+        stderr_lines = []
+        try:
+            _, stdout, _, returncode = await asyncio.wait_for(asyncio.gather(
+                _feed(process.stdin, input_data),
+                process.stdout.read(),
+                _relay_stderr(process.stderr, label, stderr_lines),
+                process.wait(),
+            ), timeout or None)
+        except asyncio.TimeoutError:
+            raise PandocTimeout(f"pandoc timed out after {timeout:g} s{f' ({label})' if label else ''}")
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+        if returncode != 0:
+            detail = "\n".join(stderr_lines[-20:])
+            raise PandocError(f"pandoc exited with code {returncode}{f' ({label})' if label else ''}:\n{detail}")
+        return stdout
+    finally:
+        if has_slot:
+            _limit.release()
+
+
+def pandoc_args(to_format, from_format, outputfile=None, extra_args=None):
+    args = [f"--from={from_format}", f"--to={to_format}"]
+    if outputfile:
+        args.append(f"--output={outputfile}")
+    return args + list(extra_args or [])
+
+
+async def convert_text_async(source, to_format, from_format, outputfile=None, extra_args=None, label=""):
+    """
+    Like pypandoc.convert_text: converts source (str) and returns the output as text,
+    or writes it to outputfile (and returns "").
+    """
+    output = await run_pandoc(pandoc_args(to_format, from_format, outputfile, extra_args),
+                              source.encode('utf-8'), label)
+    return output.decode('utf-8')
+
+
+def convert_text(source, to_format, from_format, outputfile=None, extra_args=None, label=""):
+    """
+    Blocking convert_text_async, for a chapter's single pandoc call.
+    """
+    return asyncio.run(convert_text_async(source, to_format, from_format, outputfile, extra_args, label))
+
+
+def gather(coroutines):
+    """
+    Runs several pandoc calls (coroutines) concurrently and returns their results in
+    order. If one fails the others are cancelled, which kills their pandoc processes.
+    """
+    async def run_all():
+        tasks = [asyncio.ensure_future(c) for c in coroutines]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return asyncio.run(run_all())
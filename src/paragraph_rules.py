@@ -0,0 +1,167 @@
+from rule_registry import regex_conclusion
+
+# Paragraph-level post-processing rules shared by the python-docx post-processors and
+# the streaming one (ooxml_stream).
+#
+# Each body paragraph is classified once: its style name comes from a per-document
+# style-id cache and drawings are found with a compiled XPath instead of serializing
+# the paragraph, before python-docx builds any run objects. The resulting actions are
+# then run from a dispatch table, so the whole document is walked a single time.
+#
+# Fonts, sizes and alignment that a style can carry (headings, captions, figure
+# paragraphs) are set by the reference document (see reference_doc), not run by run.
+# The title page and figure details have their own custom styles (see
+# styles/custom_styles.lua), so they are not searched for here.
+
+# Headings whose number is separated from the title with a space instead of a tab
+NUMBERED_HEADINGS = ('Heading 1', 'Heading 2', 'Heading 3', 'Heading 4')
+
+
+def _xpath(expression):
+    from docx.oxml.ns import nsmap
+    from lxml import etree
+    return etree.XPath(expression, namespaces=nsmap)
+
+
+def body_paragraphs(body):
+    """
+    The w:p children of w:body (the same paragraphs as Document.paragraphs).
+    """
+    from docx.oxml.ns import qn
+    return list(body.iterchildren(qn('w:p')))
+
+
+def center_images(body):
+    """
+    Centres every body paragraph that holds a drawing or picture. Returns the count.
+    """
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+    from docx.text.paragraph import Paragraph
+
+    image_paragraphs = _xpath('./w:p[.//w:drawing or .//w:pict]')(body)
+    for p in image_paragraphs:
+        Paragraph(p, None).alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+    return len(image_paragraphs)
+
+
+def last_conclusion_index(paragraphs, rules):
+    """
+    Position of the last "Conclusion" Heading 3 among the given w:p elements, or -1.
+    """
+    target = -1
+    for index, p in enumerate(paragraphs):
+        if rules.style_name(p) == 'Heading 3':
+            text = p.text
+            if regex_conclusion.search(text) or text.strip().lower() == "conclusion":
+                target = index
+    return target
+
+
+class PublisherParagraphRules:
+    """
+    The publisher paragraph rules for one body paragraph at a time, in document order:
+    duplicate Heading 1 removal, image centring, Conclusion promotion and heading
+    spacing.
+
+    conclusion_index is the position (among the body paragraphs) of the last
+    "Conclusion" Heading 3, see last_conclusion_index.
+    """
+
+    def __init__(self, styles, conclusion_index=-1):
+        from docx.enum.style import WD_STYLE_TYPE
+
+        self.styles = styles
+        self.paragraph_type = WD_STYLE_TYPE.PARAGRAPH
+        self.conclusion_index = conclusion_index
+        self.index = 0
+        self.first_h1_removed = False
+        self._style_names = {}
+        self._has_drawing = _xpath('boolean(.//w:drawing | .//w:pict)')
+        self._run_tabs = _xpath('./w:r/w:tab')
+        self.actions = {
+            'remove': self.remove_duplicate_heading,
+            'center': self.center,
+            'conclusion': self.promote_conclusion,
+            'heading': self.format_heading,
+        }
+
+    def style_name(self, p):
+        style_id = p.style
+        if style_id not in self._style_names:
+            style = self.styles.get_by_id(style_id, self.paragraph_type)
+            self._style_names[style_id] = style.name if style is not None else None
+        return self._style_names[style_id]
+
+    def classify(self, p, index):
+        """
+        The names of the actions that apply to a paragraph, in the order they are run.
+        """
+        name = self.style_name(p) or ""
+        actions = []
+        if name == 'Heading 1' and not self.first_h1_removed:
+            actions.append('remove')
+            return actions
+        if self._has_drawing(p):
+            actions.append('center')
+        if index == self.conclusion_index:
+            actions.append('conclusion')
+            name = 'Heading 2'
+        if name in NUMBERED_HEADINGS:
+            actions.append('heading')
+        return actions
+
+    def apply(self, p):
+        """
+        Rewrites the w:p element in place. Returns False if it must be dropped.
+        """
+        from docx.text.paragraph import Paragraph
+
+        index = self.index
+        self.index += 1
+        actions = self.classify(p, index)
+        if not actions:
+            return True
+        paragraph = Paragraph(p, None)
+        for action in actions:
+            if self.actions[action](paragraph) is False:
+                return False
+        return True
+
+    def apply_to_body(self, body):
+        """
+        Runs the rules over all body paragraphs of a loaded document.
+        """
+        for p in body_paragraphs(body):
+            if not self.apply(p):
+                body.remove(p)
+
+    def remove_duplicate_heading(self, paragraph):
+        self.first_h1_removed = True
+        print("  Removed duplicate Heading 1 paragraph.")
+        return False
+
+    def center(self, paragraph):
+        from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+
+    def promote_conclusion(self, paragraph):
+        print(f"  Promoting Conclusion subsection: {paragraph.text.strip()}")
+        paragraph._p.style = self.styles['Heading 2'].style_id
+        paragraph.text = "Conclusion"
+        pPr = paragraph._p.pPr
+        if pPr is not None and pPr.numPr is not None:
+            pPr.remove(pPr.numPr)
+
+    def format_heading(self, paragraph):
+        from docx.oxml import OxmlElement
+
+        # Tabs between the number and the title become spaces in place, keeping the runs
+        tabs = self._run_tabs(paragraph._p)
+        for tab in tabs:
+            space = OxmlElement('w:t')
+            space.text = ' '
+            space.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+            tab.addprevious(space)
+            tab.getparent().remove(tab)
+        if tabs:
+            print(f"  Fixed spacing (Tab->Space) in: {paragraph.text[:30]}...")
@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asset_index import load_asset_index
+from book_jobs import chapter_numbers_from_args, job_count, select_chapters
+from latex_scanner import scan
+from rule_registry import graphics_pattern, label_pattern
+from section_index import find_section_files
+
+# Preflight check of the whole book (--check), without pandoc.
+#
+# Everything that makes a conversion stop partway through, or silently produce a broken
+# chapter, is looked for up front: sections that do not resolve to exactly one file,
+# \includegraphics that the image lookup cannot resolve, image files that are empty or
+# cut short, figure and bibliography blocks that are not closed (or closed twice), and
+# \label names used more than once in the book. Chapters are checked in parallel
+# threads (the work is reading files and scanning them once with latex_scanner), and
+# every problem is reported in one listing, also written to output/preflight.json.
+#
+# Neither pandoc nor pypandoc is imported here.
+
+PREFLIGHT_FILENAME = "preflight.json"
+
+ERROR = "error"
+WARNING = "warning"
+
+# Environments whose \begin and \end must pair up
+CHECKED_ENVIRONMENTS = ("figure", "figure*", "thebibliography")
+
+# Bytes read from each end of an image for the signature and end-marker checks
+IMAGE_PROBE_SIZE = 1024
+
+
+def add_check_arguments(parser):
+    parser.add_argument("--check", action="store_true",
+                        help="Check sections, images, figure and bibliography blocks and labels "
+                             "of the book without converting (no pandoc)")
+
+
+def problem(severity, kind, location, message):
+    return {"severity": severity, "kind": kind, "location": location, "message": message}
+
+
+def _line(text, offset):
+    return text.count('\n', 0, offset) + 1
+
+
+def image_problem(path):
+    """
+    Why an image file cannot be used (unreadable, empty or truncated), or None.
+    Only the format signature and end marker are read, the image is not decoded.
+    """
+    try:
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(IMAGE_PROBE_SIZE)
+            f.seek(max(0, size - IMAGE_PROBE_SIZE))
+            tail = f.read()
+    except OSError as e:
+        return f"cannot be read: {e}"
+    if size == 0:
+        return "is empty"
+
+    ext = os.path.splitext(path)[1].lower()
+    # Some tools pad files with zeros after the end marker
+    end = tail.rstrip(b'\x00')
+    if ext == '.png':
+        if not head.startswith(b'\x89PNG\r\n\x1a\n'):
+            return "is not a PNG file"
+        if not end.endswith(b'IEND\xaeB`\x82'):
+            return "is truncated (no PNG end chunk)"
+    elif ext in ('.jpg', '.jpeg'):
+        if not head.startswith(b'\xff\xd8'):
+            return "is not a JPEG file"
+        if not end.endswith(b'\xff\xd9'):
+            return "is truncated (no JPEG end marker)"
+    elif ext == '.gif':
+        if not head.startswith((b'GIF87a', b'GIF89a')):
+            return "is not a GIF file"
+        if not end.endswith(b';'):
+            return "is truncated (no GIF trailer)"
+    elif ext == '.pdf':
+        if not head.startswith(b'%PDF-'):
+            return "is not a PDF file"
+        if b'%%EOF' not in tail:
+            return "is truncated (no %%EOF)"
+    elif ext == '.bmp':
+        if not head.startswith(b'BM'):
+            return "is not a BMP file"
+        if len(head) >= 6 and size < int.from_bytes(head[2:6], 'little'):
+            return "is truncated (shorter than its header says)"
+    return None
+
+
+def check_section(text, images, location_of):
+    """
+    Problems of one section file, its resolved images and its labels as
+    [(label, location)].
+    """
+    found_problems = []
+    found = []
+    lexed = scan(text)
+
+    for name, offset in lexed.unclosed:
+        if name in CHECKED_ENVIRONMENTS:
+            found_problems.append((offset, problem(ERROR, "environment", location_of(offset),
+                                                   f"\\begin{{{name}}} is never closed")))
+    for name, offset in lexed.unopened:
+        if name in CHECKED_ENVIRONMENTS:
+            found_problems.append((offset, problem(ERROR, "environment", location_of(offset),
+                                                   f"\\end{{{name}}} without a matching \\begin{{{name}}}")))
+
+    for match in graphics_pattern.finditer(text):
+        ref_path = match.group(2).strip()
+        seen_notes = len(images.notes)
+        target = images.find(ref_path)
+        for note in images.notes[seen_notes:]:
+            found_problems.append((match.start(), problem(WARNING, "image", location_of(match.start()), note)))
+        if target is None:
+            found_problems.append((match.start(), problem(ERROR, "image", location_of(match.start()),
+                                                          f"no image found for '{ref_path}'")))
+        else:
+            found.append(target)
+
+    labels = [(match.group(1).strip(), location_of(match.start())) for match in label_pattern.finditer(text)]
+    # In the order of the file
+    found_problems.sort(key=lambda item: item[0])
+    return [p for _, p in found_problems], found, labels
+
+
+def check_chapter(chapter, latex_dir, assets):
+    """
+    Checks one chapter. Returns (problems, labels, images_checked, files_checked).
+    """
+    chapter_num = chapter['number']
+    chapter_dir = os.path.join(latex_dir, f"Chapter_{chapter_num}")
+    problems = []
+    labels = []
+    if not os.path.isdir(chapter_dir):
+        problems.append(problem(ERROR, "chapter", os.path.relpath(chapter_dir, latex_dir),
+                                f"chapter directory not found: {chapter_dir}"))
+        return problems, labels, 0, 0
+
+    chapter_files, section_problems = find_section_files(chapter.get('sections', []), chapter_dir,
+                                                         assets.files_in(chapter_dir))
+    for message in section_problems:
+        message = "; ".join(line.strip() for line in message.splitlines())
+        problems.append(problem(ERROR, "section", os.path.relpath(chapter_dir, latex_dir), message))
+
+    images = assets.chapter_images(chapter_dir, notes=[])
+    resolved = set()
+    for file_path in chapter_files:
+        name = os.path.relpath(file_path, latex_dir)
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            problems.append(problem(ERROR, "section", name, f"cannot be read: {e}"))
+            continue
+
+        def location_of(offset, name=name, text=text):
+            return f"{name}:{_line(text, offset)}"
+
+        section_problems, found, section_labels = check_section(text, images, location_of)
+        problems.extend(section_problems)
+        resolved.update(found)
+        labels.extend(section_labels)
+
+    for path in sorted(resolved):
+        reason = image_problem(path)
+        if reason:
+            problems.append(problem(ERROR, "image", os.path.relpath(path, latex_dir), f"image {reason}"))
+    return problems, labels, len(resolved), len(chapter_files)
+
+
+def duplicate_labels(chapter_labels):
+    """
+    One problem per \\label name defined more than once, over all chapters:
+    [(chapter, problem)].
+    """
+    seen = {}
+    for chapter, labels in chapter_labels:
+        for label, location in labels:
+            seen.setdefault(label, []).append((chapter, location))
+    duplicates = []
+    for label, places in seen.items():
+        if len(places) > 1:
+            _, first_location = places[0]
+            for chapter, location in places[1:]:
+                duplicates.append((chapter, problem(ERROR, "label", location,
+                                                    f"label '{label}' is already defined at {first_location}")))
+    return duplicates
+
+
+def check_book(metadata_path, output_dir, chapter_numbers=None, jobs=1, latex_dir="input/latex_files"):
+    """
+    Runs every check over the requested chapters (all when chapter_numbers is None),
+    prints the listing and writes it to output/preflight.json.
+    Returns the number of errors.
+    """
+    started = time.perf_counter()
+    if not os.path.exists(metadata_path):
+        print(f"Error: Metadata file not found at {metadata_path}")
+        return 1
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        book_data = json.load(f)
+    chapters = select_chapters(book_data.get("chapters", []), chapter_numbers)
+    if not chapters:
+        print("No chapters to check.")
+        return 1
+
+    assets = load_asset_index(latex_dir, output_dir)
+    with ThreadPoolExecutor(max_workers=max(1, min(job_count(jobs), len(chapters)))) as executor:
+        checked = list(executor.map(lambda c: check_chapter(c, latex_dir, assets), chapters))
+
+    by_chapter = {c['number']: problems for c, (problems, _, _, _) in zip(chapters, checked)}
+    for chapter_num, duplicate in duplicate_labels((c['number'], labels)
+                                                   for c, (_, labels, _, _) in zip(chapters, checked)):
+        by_chapter[chapter_num].append(duplicate)
+
+    listing = []
+    for chapter in chapters:
+        for entry in by_chapter[chapter['number']]:
+            listing.append(dict(entry, chapter=chapter['number']))
+    errors = sum(1 for entry in listing if entry['severity'] == ERROR)
+    warnings = len(listing) - errors
+    elapsed = time.perf_counter() - started
+
+    report_problems(chapters, by_chapter)
+    files = sum(n for _, _, _, n in checked)
+    images = sum(n for _, _, n, _ in checked)
+    print(f"Checked {len(chapters)} chapter(s), {files} section file(s) and {images} image(s) "
+          f"in {elapsed:.2f} s: {errors} error(s), {warnings} warning(s).")
+
+    os.makedirs(output_dir, exist_ok=True)
+    report_path = os.path.join(output_dir, PREFLIGHT_FILENAME)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump({"errors": errors, "warnings": warnings, "problems": listing}, f, indent=2)
+    return errors
+
+
+def report_problems(chapters, by_chapter):
+    for chapter in chapters:
+        problems = by_chapter[chapter['number']]
+        if not problems:
+            continue
+        print(f"Chapter {chapter['number']}: {chapter.get('title', '')}")
+        width = max(len(p['location']) for p in problems)
+        for p in problems:
+            print(f"  {p['severity'].upper():<8}{p['kind']:<12}{p['location']:<{width}}  {p['message']}")
+
+
+def run_check(args, metadata_file, output_dir):
+    """
+    The --check mode of the converters: exits with the check's status.
+    """
+    errors = check_book(metadata_file, output_dir, chapter_numbers_from_args(args), args.jobs)
+    sys.exit(1 if errors else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the book's sources without converting.")
+    parser.add_argument("--chapter", type=int, help="Specific chapter number to check (e.g. 1)")
+    parser.add_argument("--chapters", help="Chapter list to check, e.g. 1-5,8")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Number of chapters to check in parallel (default: CPU count)")
+    args = parser.parse_args()
+    args.check = True
+    run_check(args, "input/metadata.json", "output")
+
+
+if __name__ == "__main__":
+    main()
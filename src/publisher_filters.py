@@ -0,0 +1,195 @@
+from pandoc_ast import iter_blocks, map_block_lists, map_inline_lists, stringify, text_to_inlines
+from rule_registry import regex_conclusion, regex_eg, regex_vs, regex_fig_ref_explicit as regex_fig_ref
+
+# Publisher house rules applied to the pandoc AST instead of raw LaTeX / the DOCX.
+# Working on typed elements means none of these can match inside code or math.
+#
+# The title page and the figure details are not rewritten here: the preprocessors wrap
+# them in environments named after custom Word styles, which reach the AST as Divs and
+# are styled by pandoc's DOCX writer (see styles/custom_styles.lua).
+
+# Marks a line of the sections as a figure detail
+FIGURE_DETAIL_MARKER = "[FIGURE DETAIL]"
+
+# Custom Word styles (defined in styles/publisher.toml); keep in sync with
+# styles/custom_styles.lua
+FIGURE_DETAIL_STYLE = "FigureDetail"
+CHAPTER_NUMBER_STYLE = "ChapterNumber"
+CHAPTER_TITLE_STYLE = "ChapterTitle"
+
+# Figure details in the formats without Word styles (the ODT and HTML review copies)
+FIGURE_DETAIL_COLOR = "FF0000"
+
+PROSE_TYPES = ("Str", "Space", "SoftBreak")
+
+
+def _run_text(run):
+    parts = []
+    for inline in run:
+        if inline["t"] == "Str":
+            parts.append(inline["c"])
+        elif inline["t"] == "Space":
+            parts.append(" ")
+        else:
+            parts.append("\n")
+    return "".join(parts)
+
+
+def _rewrite_prose_run(run):
+    """
+    Applies e.g./vs. expansion and Figure/Table reference italics to a run of plain text.
+    """
+    if not run:
+        return run
+    text = _run_text(run)
+    new_text = regex_eg.sub("for example", text)
+    new_text = regex_vs.sub("versus", new_text)
+    refs = list(regex_fig_ref.finditer(new_text))
+    if new_text == text and not refs:
+        return run
+
+    inlines = []
+    pos = 0
+    for m in refs:
+        inlines.extend(text_to_inlines(new_text[pos:m.start()]))
+        inlines.append({"t": "Emph", "c": text_to_inlines(f"{m.group(1)} {m.group(2)}")})
+        pos = m.end()
+    inlines.extend(text_to_inlines(new_text[pos:]))
+    return inlines
+
+
+def rewrite_prose(inlines):
+    out = []
+    run = []
+    for inline in inlines:
+        if inline["t"] in PROSE_TYPES:
+            run.append(inline)
+            continue
+        out.extend(_rewrite_prose_run(run))
+        run = []
+        out.append(inline)
+    out.extend(_rewrite_prose_run(run))
+    return out
+
+
+def _strip_trailing_space(inlines):
+    while inlines and inlines[-1]["t"] in ("Space", "SoftBreak"):
+        inlines.pop()
+    return inlines
+
+
+def _strip_trailing_char(inlines, char):
+    """
+    Removes a trailing character from the last Str (plus surrounding trailing spaces).
+    Returns True if something was stripped.
+    """
+    _strip_trailing_space(inlines)
+    if not inlines or inlines[-1]["t"] != "Str" or not inlines[-1]["c"].endswith(char):
+        return False
+    last = inlines[-1]["c"][:-1]
+    if last:
+        inlines[-1]["c"] = last
+    else:
+        inlines.pop()
+    _strip_trailing_space(inlines)
+    return True
+
+
+def strip_title_colons(blocks):
+    """
+    "\\section{Overview:}" -> "Overview" for every heading below the chapter title.
+    """
+    for block in iter_blocks(blocks):
+        if block["t"] == "Header" and block["c"][0] >= 2:
+            _strip_trailing_char(block["c"][2], ":")
+
+
+def strip_caption_periods(blocks):
+    """
+    Figure and table captions never end in a full stop.
+    """
+    for block in iter_blocks(blocks):
+        if block["t"] not in ("Figure", "Table"):
+            continue
+        caption_blocks = block["c"][1][1]
+        if caption_blocks and caption_blocks[-1]["t"] in ("Plain", "Para"):
+            _strip_trailing_char(caption_blocks[-1]["c"], ".")
+
+
+def remove_duplicate_chapter_heading(blocks):
+    """
+    Drops the first level-1 heading: the structural \\chapter repeats the title page.
+    """
+    removed = []
+
+    def remove_first(block_list):
+        if removed:
+            return block_list
+        for i, block in enumerate(block_list):
+            if block["t"] == "Header" and block["c"][0] == 1:
+                removed.append(block)
+                return block_list[:i] + block_list[i + 1:]
+        return block_list
+
+    map_block_lists(blocks, remove_first)
+    if removed:
+        print("  Removed duplicate Heading 1 paragraph.")
+
+
+def promote_last_conclusion(blocks):
+    """
+    The last "Conclusion" subsection becomes an unnumbered section.
+    """
+    target = None
+    for block in iter_blocks(blocks):
+        if block["t"] == "Header" and block["c"][0] == 3:
+            text = stringify(block["c"][2])
+            if regex_conclusion.search(text) or text.strip().lower() == "conclusion":
+                target = block
+    if target is None:
+        return
+    print(f"  Promoting Conclusion subsection: {stringify(target['c'][2]).strip()}")
+    target["c"][0] = 2
+    classes = target["c"][1][1]
+    if "unnumbered" not in classes:
+        classes.append("unnumbered")
+    target["c"][2] = [{"t": "Str", "c": "Conclusion"}]
+
+
+def color_figure_details(blocks):
+    """
+    FigureDetail Divs become paragraphs in a red Span, for the formats where pandoc
+    does not apply custom Word styles.
+    """
+    style = [["style", f"color: #{FIGURE_DETAIL_COLOR}"]]
+
+    def color_list(block_list):
+        out = []
+        for block in block_list:
+            if block["t"] == "Div" and FIGURE_DETAIL_STYLE in block["c"][0][1]:
+                for inner in block["c"][1]:
+                    if inner["t"] in ("Para", "Plain"):
+                        inner = {"t": "Para", "c": [{"t": "Span", "c": [["", [], style], inner["c"]]}]}
+                    out.append(inner)
+                continue
+            out.append(block)
+        return out
+
+    map_block_lists(blocks, color_list)
+
+
+def apply_publisher_filters(doc, to_format="docx"):
+    """
+    Runs every publisher rule over a pandoc JSON AST (in place) and returns it.
+    Other formats than DOCX (the ODT and HTML review copies of convert_editions) show
+    the figure details in red and keep the plain title page paragraphs.
+    """
+    blocks = doc["blocks"]
+    map_inline_lists(blocks, rewrite_prose)
+    strip_title_colons(blocks)
+    strip_caption_periods(blocks)
+    remove_duplicate_chapter_heading(blocks)
+    promote_last_conclusion(blocks)
+    if to_format != "docx":
+        color_figure_details(blocks)
+    return doc
@@ -0,0 +1,248 @@
+import asyncio
+import hashlib
+import importlib.util
+import io
+import json
+import os
+import tomllib
+
+import pandoc_runner
+from build_cache import source_version
+
+# Reference documents compiled from declarative style files.
+#
+# A style file (styles/publisher.toml) describes the look of an edition: page size and
+# margins, the footer page number and the font, size, weight, colour, spacing and
+# alignment of each Word style pandoc uses (Normal, Heading 1-5, Source Code,
+# VerbatimChar, the captions, ...). It is compiled once into a reference.docx that
+# pandoc is given with --reference-doc, so every chapter comes out of pandoc already
+# styled instead of having its styles, page layout and footer rewritten (and its runs
+# formatted one by one) after each conversion.
+#
+# The compiled document is cached in output/.reference_docs/, named after a hash of the
+# style file's content, the pandoc version and this compiler, and part of the build
+# fingerprint of every chapter written with it: editing the style file rebuilds them.
+#
+# The compiler starts from a small document written by pandoc itself, so the styles
+# pandoc adds on its own (Source Code and the syntax highlighting styles) are in the
+# reference document too and take the style file's settings.
+
+STYLE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "styles")
+DEFAULT_STYLE_FILE = os.path.join(STYLE_DIR, "publisher.toml")
+# Gives the title page and figure detail paragraphs their custom styles
+CUSTOM_STYLE_FILTER = os.path.join(STYLE_DIR, "custom_styles.lua")
+REFERENCE_DOC_DIRNAME = ".reference_docs"
+# Bump when the compiler writes something different for the same style file
+REFERENCE_DOC_VERSION = 1
+
+# Seed document: pandoc's default reference plus the code block styles
+SEED_MARKDOWN = "Seed\n\n```python\nx = 1\n```\n"
+
+STYLE_KEYS = {"type", "based_on", "font", "size", "bold", "italic", "color", "line_spacing",
+              "space_before", "space_after", "align"}
+SECTIONS = {"page", "footer", "defaults", "styles"}
+ALIGNMENTS = {"left", "center", "right", "justify"}
+UNITS = {"mm": 36000, "cm": 360000, "in": 914400, "pt": 12700}
+
+
+def add_style_arguments(parser):
+    parser.add_argument("--style-file", default=DEFAULT_STYLE_FILE,
+                        help="Style file (TOML or JSON) compiled into the reference document pandoc styles "
+                             "the .docx with; 'none' for pandoc's defaults (default: styles/publisher.toml)")
+
+
+def load_style_file(path):
+    """
+    Reads a style file (.toml or .json) and checks its keys.
+    Raises ValueError with the problem if it is not valid.
+    """
+    with open(path, 'rb') as f:
+        if path.lower().endswith('.json'):
+            spec = json.load(f)
+        else:
+            try:
+                spec = tomllib.load(f)
+            except tomllib.TOMLDecodeError as e:
+                raise ValueError(str(e))
+
+    unknown = set(spec) - SECTIONS
+    if unknown:
+        raise ValueError(f"unknown section(s): {', '.join(sorted(unknown))}")
+    for name, style in [("defaults", spec.get("defaults", {}))] + list(spec.get("styles", {}).items()):
+        unknown = set(style) - STYLE_KEYS
+        if unknown:
+            raise ValueError(f"style '{name}': unknown key(s): {', '.join(sorted(unknown))}")
+        if style.get("align") not in ALIGNMENTS | {None}:
+            raise ValueError(f"style '{name}': align must be one of {', '.join(sorted(ALIGNMENTS))}")
+        if style.get("type") not in ("paragraph", "character", None):
+            raise ValueError(f"style '{name}': type must be 'paragraph' or 'character'")
+    # Checked without python-docx, so a bad style file is reported even where the
+    # reference document cannot be compiled
+    for key in ("width", "height", "margins"):
+        if key in spec.get("page", {}):
+            length_emu(spec["page"][key])
+    return spec
+
+
+def length_emu(value):
+    """
+    "210mm", "0.79in", "2cm" or "10pt" in EMU.
+    """
+    text = str(value).strip()
+    for unit, emu in UNITS.items():
+        if text.endswith(unit):
+            try:
+                return round(float(text[:-len(unit)]) * emu)
+            except ValueError:
+                break
+    raise ValueError(f"invalid length '{value}' (use mm, cm, in or pt)")
+
+
+def length(value):
+    """
+    A length (see length_emu) as a python-docx Length.
+    """
+    from docx.shared import Length
+
+    return Length(length_emu(value))
+
+
+def style_file_hash(spec):
+    h = hashlib.sha256()
+    h.update(source_version("reference_doc", REFERENCE_DOC_VERSION, __file__).encode('utf-8'))
+    h.update(f"pandoc:{pandoc_runner.pandoc_version()}\n".encode('utf-8'))
+    h.update(json.dumps(spec, sort_keys=True).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def apply_style(styles, style_name, spec):
+    """
+    Sets font, spacing and alignment of a style definition, adding the style when the
+    style file gives its type.
+    """
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    from docx.shared import Pt, RGBColor
+
+    # By name, or by style id (e.g. "VerbatimChar" for "Verbatim Char")
+    style = next((s for s in styles if s.name == style_name), None)
+    style = style or next((s for s in styles if s.style_id == style_name), None)
+    if style is None:
+        if not spec.get("type"):
+            print(f"  Warning: style '{style_name}' is not in the reference document and has no type; skipped.")
+            return
+        style_type = WD_STYLE_TYPE.PARAGRAPH if spec["type"] == "paragraph" else WD_STYLE_TYPE.CHARACTER
+        style = styles.add_style(style_name, style_type)
+        if spec.get("based_on"):
+            style.base_style = styles[spec["based_on"]]
+
+    if hasattr(style, 'font'):
+        style.font.name = spec["font"]
+        # Force rFonts to ensure Theme fallback (like Aptos) doesn't win
+        rPr = style.element.get_or_add_rPr()
+        rFonts = rPr.find(qn('w:rFonts'))
+        if rFonts is None:
+            rFonts = OxmlElement('w:rFonts')
+            rPr.append(rFonts)
+        for attr in ('w:ascii', 'w:hAnsi', 'w:eastAsia', 'w:cs'):
+            rFonts.set(qn(attr), spec["font"])
+        for attr in ('w:asciiTheme', 'w:hAnsiTheme', 'w:eastAsiaTheme', 'w:cstheme'):
+            rFonts.set(qn(attr), '')
+        style.font.size = Pt(spec["size"])
+        style.font.bold = spec["bold"]
+        style.font.italic = spec["italic"]
+        style.font.color.rgb = RGBColor.from_string(spec["color"])
+    if hasattr(style, 'paragraph_format'):
+        style.paragraph_format.space_before = Pt(spec["space_before"])
+        style.paragraph_format.space_after = Pt(spec["space_after"])
+        style.paragraph_format.line_spacing = spec["line_spacing"]
+        if spec.get("align"):
+            style.paragraph_format.alignment = getattr(WD_PARAGRAPH_ALIGNMENT, spec["align"].upper())
+
+
+def apply_page(section, page):
+    for key, attribute in (("width", "page_width"), ("height", "page_height")):
+        if key in page:
+            setattr(section, attribute, length(page[key]))
+    if "margins" in page:
+        margin = length(page["margins"])
+        section.top_margin = margin
+        section.bottom_margin = margin
+        section.left_margin = margin
+        section.right_margin = margin
+
+
+def add_page_number(footer_paragraph, footer):
+    """
+    PAGE field in the footer.
+    """
+    from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+    from docx.oxml import OxmlElement
+    from docx.oxml.ns import qn
+    from docx.shared import Pt
+
+    footer_paragraph.alignment = getattr(WD_PARAGRAPH_ALIGNMENT, footer.get("align", "center").upper())
+    fldSimple = OxmlElement('w:fldSimple')
+    fldSimple.set(qn('w:instr'), ' PAGE ')
+    run = footer_paragraph.add_run()
+    if footer.get("font"):
+        run.font.name = footer["font"]
+    if footer.get("size"):
+        run.font.size = Pt(footer["size"])
+    run._element.append(fldSimple)
+
+
+def compile_reference_doc(spec, path):
+    """
+    Writes the reference document of a loaded style file to path.
+    """
+    from docx import Document
+    from docx.oxml.ns import qn
+
+    seed = asyncio.run(pandoc_runner.run_pandoc(["--from=markdown", "--to=docx", "--output=-"],
+                                                SEED_MARKDOWN.encode('utf-8'), "reference doc"))
+    doc = Document(io.BytesIO(seed))
+
+    # Only the section properties of the body are used by pandoc
+    body = doc.element.body
+    for child in list(body):
+        if child.tag != qn('w:sectPr'):
+            body.remove(child)
+
+    defaults = spec.get("defaults", {})
+    for style_name, style in spec.get("styles", {}).items():
+        apply_style(doc.styles, style_name, {**defaults, **style})
+
+    section = doc.sections[0]
+    apply_page(section, spec.get("page", {}))
+    footer = spec.get("footer", {})
+    if footer.get("page_number"):
+        add_page_number(section.footer.paragraphs[0], footer)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    doc.save(temp_path)
+    os.replace(temp_path, path)
+
+
+def build_reference_doc(style_file, output_dir):
+    """
+    The reference document of a style file, compiled unless it is already cached.
+    Returns its path, or None if python-docx is missing. Raises ValueError or OSError
+    when the style file cannot be used.
+    """
+    if importlib.util.find_spec("docx") is None:
+        print("  Warning: python-docx not installed. The .docx files keep pandoc's default styles.")
+        return None
+
+    spec = load_style_file(style_file)
+    cache_dir = os.path.join(output_dir, REFERENCE_DOC_DIRNAME)
+    path = os.path.join(cache_dir, f"{style_file_hash(spec)}.docx")
+    if os.path.exists(path):
+        print(f"Reference document: {path} (cached, from {os.path.basename(style_file)})")
+        return path
+    os.makedirs(cache_dir, exist_ok=True)
+    compile_reference_doc(spec, path)
+    print(f"Reference document: {path} (compiled from {os.path.basename(style_file)})")
+    return path
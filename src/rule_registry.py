@@ -0,0 +1,131 @@
+import re
+import time
+
+from latex_scanner import AnyPattern, CommandPattern, EnvironmentPattern, RunPattern
+
+# LaTeX cleanup patterns, compiled once per process and shared by both converters,
+# plus per-rule counters (matches, bytes scanned, cumulative time) for --rule-stats.
+#
+# The rules' replacement functions depend on the chapter (image lookup, collected
+# references), so only the patterns live here; the converters bind them to rules.
+#
+# Commands with brace arguments and environments (citations, figure blocks, captions,
+# labels, headings, bibliography items, Figure~\ref references) are latex_scanner
+# patterns: they take nested braces and run in linear time on malformed input, where a
+# regex would stop at the first "}" or backtrack over the rest of the section.
+
+# Shared by both converters
+
+# \cite{...}, \citep[...]{...}, \citet{...}, \ref{...}, plus [cite: ...] and [cite_start]
+# found in input txt files
+citation_pattern = AnyPattern([
+    CommandPattern(("cite", "citep", "citet", "ref"), optional=True),
+    re.compile(r'\[cite:[^\]]+\]|\[cite_start\]'),
+])
+# \includegraphics[...]{...} or \includegraphics{...}; 1=options (None if absent), 2=path
+graphics_pattern = CommandPattern(("includegraphics",), optional=True)
+# Figure block + optional prompt comment:
+# \begin{figure} ... \end{figure} + optional (% Image Prompt: ...); 1=block, 3=prompt comment
+figure_block_pattern = EnvironmentPattern("figure", trailing=re.compile(r'\s*%\s*Image Prompt:[^\n]*', re.IGNORECASE))
+# Fuzzy image matching on "figure_d_d" (e.g. "figure_1_4" -> "figure_1_4_spiral.jpg")
+prefix_pattern = re.compile(r'^(figure_\d+_\d+)')
+# Section number named by a filename: "Section 1.1", "section_1.1", "Section.1.10"
+section_file_pattern = re.compile(r'section[\s._]*(\d+(?:\.\d+)*)', re.IGNORECASE)
+
+# Publisher converter: figure details and bibliography consolidation
+
+# "\textbf{Figure Placeholder: ...}": the bold commands of a figure block whose text
+# starts with the placeholder prefix
+placeholder_pattern = CommandPattern(("textbf",))
+placeholder_prefix = re.compile(r'Figure Placeholder:\s*', re.IGNORECASE)
+label_pattern = CommandPattern(("label",))
+caption_pattern = CommandPattern(("caption",))
+# \begin{thebibliography}{9} ... \end{thebibliography}; 2=the items
+bib_block_pattern = EnvironmentPattern("thebibliography", arguments=1)
+# \bibitem[label]{key}; 1=label (None if absent), 2=key. The entry's text runs to the
+# next \bibitem
+bib_item_pattern = CommandPattern(("bibitem",), optional=True)
+# Redundant References headers (the references are consolidated per chapter)
+references_header_pattern = re.compile(r'\\(section|subsection|subsubsection)\*?\{References\}\s*', re.IGNORECASE)
+# The header also takes the whitespace that follows it once figure blocks have been
+# rewritten, so its span in the structural sweep extends over those
+references_header_span = RunPattern(references_header_pattern, [figure_block_pattern])
+# [FIGURE DETAIL] notes written in the sections: a run of lines starting with the marker
+figure_detail_pattern = re.compile(r'\[FIGURE DETAIL\][^\n]*(?:\n[ \t]*\[FIGURE DETAIL\][^\n]*)*')
+
+# Publisher style rules on raw LaTeX (the AST engine applies these in publisher_filters)
+
+regex_eg = re.compile(r'\be\.g\.', re.IGNORECASE)
+regex_vs = re.compile(r'\bvs\.', re.IGNORECASE)
+regex_fig_ref_explicit = re.compile(r'\b(Figure|Table)\s+(\d+\.\d+)')
+# Figure~\ref{...} / Table \ref{...}; 1=Figure or Table, 2=separator, 3=label
+regex_fig_ref_latex = CommandPattern(("ref",), prefix=re.compile(r'\b(Figure|Table)(~|\s+)'))
+# Whole headings (the title colon rule); 1=title, match.name=command
+heading_pattern = CommandPattern(("section", "subsection", "subsubsection", "paragraph"))
+# A numbered "Conclusion" heading ("3.4 Conclusion"), promoted to an unnumbered section
+regex_conclusion = re.compile(r'^\s*[\d\.]+\s+Conclusion\s*$', re.IGNORECASE)
+
+
+class RuleStats:
+    """
+    Per-rule counters: number of matches, bytes of text the rule ran over and
+    cumulative time in seconds. Counters are plain dicts so they can be returned
+    from worker processes and merged.
+    """
+
+    def __init__(self):
+        self.counters = {}
+
+    def record(self, name, matches=0, scanned=0, seconds=0.0):
+        counter = self.counters.get(name)
+        if counter is None:
+            counter = self.counters[name] = {"matches": 0, "bytes": 0, "seconds": 0.0}
+        counter["matches"] += matches
+        counter["bytes"] += scanned
+        counter["seconds"] += seconds
+
+    def timed(self, name, pattern, method, text, *args):
+        """
+        Calls pattern.<method>(text, *args) and records it. Returns the result.
+        """
+        start = time.perf_counter()
+        result = getattr(pattern, method)(text, *args)
+        if method == 'finditer':
+            # Matched here, while timed, rather than as the caller iterates
+            result = list(result)
+        elapsed = time.perf_counter() - start
+        if isinstance(result, list):
+            matches = len(result)
+        else:
+            matches = 1 if result else 0
+        self.record(name, matches, len(text), elapsed)
+        return result
+
+    def reset(self):
+        self.counters = {}
+
+    def snapshot(self):
+        return {name: dict(counter) for name, counter in self.counters.items()}
+
+    def merge(self, counters):
+        for name, counter in (counters or {}).items():
+            self.record(name, counter["matches"], counter["bytes"], counter["seconds"])
+
+    def report(self):
+        """
+        Prints the counters, most expensive rule first.
+        """
+        if not self.counters:
+            print("Rule stats: no rules ran.")
+            return
+        rows = sorted(self.counters.items(), key=lambda item: item[1]["seconds"], reverse=True)
+        width = max(len(name) for name, _ in rows)
+        print("Rule stats:")
+        print(f"  {'rule':<{width}}  {'matches':>9}  {'KB scanned':>11}  {'time (ms)':>10}")
+        for name, counter in rows:
+            print(f"  {name:<{width}}  {counter['matches']:>9}  {counter['bytes'] / 1024:>11.1f}"
+                  f"  {counter['seconds'] * 1000:>10.2f}")
+
+
+# Counters of this process; convert_chapter resets them per chapter and returns a snapshot
+rule_stats = RuleStats()
@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+
+import pandoc_runner
+from pandoc_ast import dedupe_identifiers, latex_to_ast_async, make_document, shift_headers
+
+SECTION_CACHE_DIRNAME = ".section_cache"
+DEFAULT_CACHE_SIZE_MB = 512
+
+# Sections are parsed on their own, so macros defined in one section would not be
+# visible in another. Chapters that define macros are converted in one piece instead.
+macro_definition_pattern = re.compile(r'\\(newcommand|renewcommand|providecommand|def|let|DeclareMathOperator|newenvironment)\b')
+
+# Number of pandoc processes a single chapter may run at once for cache misses
+MAX_PARALLEL_MISSES = 4
+
+
+def section_cache_dir(output_dir):
+    return os.path.join(output_dir, SECTION_CACHE_DIRNAME)
+
+
+def can_use_section_cache(pieces):
+    """
+    Returns False if splitting the chapter would change its meaning (macro definitions).
+    """
+    return not any(macro_definition_pattern.search(piece) for piece in pieces)
+
+
+def _piece_key(latex):
+    h = hashlib.sha256()
+    h.update(f"pandoc:{pandoc_runner.pandoc_version()}\n".encode('utf-8'))
+    h.update(latex.encode('utf-8'))
+    return h.hexdigest()
+
+
+def _load_piece(cache_dir, key):
+    path = os.path.join(cache_dir, f"{key}.json")
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            doc = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Bump the mtime: it is the "last used" time for LRU eviction
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return doc
+
+
+def _store_piece(cache_dir, key, doc):
+    path = os.path.join(cache_dir, f"{key}.json")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(doc, f)
+    os.replace(temp_path, path)
+
+
+def convert_pieces(pieces, cache_dir, label=""):
+    """
+    Converts each LaTeX piece to a pandoc AST, reusing cached ASTs keyed by content hash.
+    Returns (docs, hits) where docs is in the same order as pieces.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = [_piece_key(piece) for piece in pieces]
+    docs = [_load_piece(cache_dir, key) for key in keys]
+    misses = [i for i, doc in enumerate(docs) if doc is None]
+
+    async def convert_misses():
+        # At most MAX_PARALLEL_MISSES pandoc calls of this chapter at once
+        slots = asyncio.Semaphore(MAX_PARALLEL_MISSES)
+
+        async def convert(i):
+            async with slots:
+                doc = await latex_to_ast_async(pieces[i], label=label)
+            _store_piece(cache_dir, keys[i], doc)
+            docs[i] = doc
+
+        await asyncio.gather(*(convert(i) for i in misses))
+
+    if misses:
+        pandoc_runner.gather([convert_misses()])
+
+    return docs, len(pieces) - len(misses)
+
+
+def assemble_chapter_ast(title_piece, body_pieces, cache_dir, label=""):
+    """
+    Assembles a chapter AST from separately converted pieces.
+
+    The title piece holds the structural \\chapter; body pieces (sections, bibliography)
+    were parsed without it, so their headings are shifted one level down to match a
+    whole-chapter conversion. Numbering is applied by the DOCX writer on the assembled
+    document, so section numbers stay correct whatever the section order.
+    """
+    docs, hits = convert_pieces([title_piece] + body_pieces, cache_dir, label)
+    print(f"  Section cache: {hits}/{len(docs)} pieces reused")
+
+    blocks = list(docs[0]["blocks"])
+    for doc in docs[1:]:
+        blocks.extend(shift_headers(doc["blocks"], 1))
+    dedupe_identifiers(blocks)
+    return make_document(blocks, docs[0]["pandoc-api-version"])
+
+
+def evict_lru(cache_dir, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+    """
+    Removes least recently used pieces until the cache fits in max_size_mb.
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith('.json'):
+            continue
+        st = entry.stat()
+        entries.append((st.st_mtime_ns, st.st_size, entry.path))
+        total += st.st_size
+
+    limit = max_size_mb * 1024 * 1024
+    if total <= limit:
+        return
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except OSError:
+            pass
+    print(f"Section cache: evicted {removed} least recently used pieces.")
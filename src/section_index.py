@@ -0,0 +1,164 @@
+import os
+
+from rule_registry import section_file_pattern
+
+# Section file lookup.
+#
+# Every filename in a chapter directory is parsed once into the section numbers it names
+# ("Section_1.1.tex", "section 1.1 draft.tex" -> "1.1"), instead of compiling a regex per
+# section and scanning the whole directory listing for each one.
+
+
+def normalize_section_number(number):
+    """
+    "1.1", "01.1." and 1.1 all become "1.1".
+    """
+    parts = str(number).strip().rstrip('.').split('.')
+    return ".".join(str(int(part)) if part.isdigit() else part for part in parts)
+
+
+class SectionIndex:
+    """
+    Maps normalized section numbers to the files of one chapter directory.
+    A number named by several files resolves to the .tex file if there is exactly one.
+    """
+
+    def __init__(self, chapter_dir, filenames):
+        self.chapter_dir = chapter_dir
+        self.files = {}
+        for fname in sorted(filenames):
+            for match in section_file_pattern.finditer(fname):
+                number = normalize_section_number(match.group(1))
+                names = self.files.setdefault(number, [])
+                if fname not in names:
+                    names.append(fname)
+
+    def candidates(self, number):
+        """
+        Filenames for a section, narrowed to the .tex files when there are any.
+        """
+        names = self.files.get(normalize_section_number(number), [])
+        tex_names = [n for n in names if n.lower().endswith('.tex')]
+        return tex_names or names
+
+    def find(self, number):
+        """
+        The path of the section's file, or None if it is missing or ambiguous.
+        """
+        names = self.candidates(number)
+        if len(names) != 1:
+            return None
+        return os.path.join(self.chapter_dir, names[0])
+
+
+def find_section_files(sections, chapter_dir, dir_files):
+    """
+    Resolves every metadata section of a chapter to its file.
+    Returns (paths, problems): paths in section order for the sections that resolved,
+    and one message per missing or ambiguous section, so all of them can be reported
+    together.
+    """
+    index = SectionIndex(chapter_dir, dir_files)
+    paths = []
+    problems = []
+    for section in sections:
+        section_num = section.get('number')
+        names = index.candidates(section_num)
+        if not names:
+            problems.append(f"Missing file for Section {section_num} in {chapter_dir}\n"
+                            f"       Expected file containing 'Section {section_num}'")
+        elif len(names) > 1:
+            problems.append(f"Ambiguous files for Section {section_num} in {chapter_dir}: {', '.join(names)}")
+        else:
+            paths.append(os.path.join(chapter_dir, names[0]))
+    return paths, problems
+
+
+# File index in metadata.json.
+#
+# generate_metadata records, per chapter, the directory it resolved the sections in (with
+# the directory's mtime) and each section's file with its size, mtime and content hash:
+#   chapter["files"] = {"dir": ..., "dir_mtime_ns": ..., "sections": {"1.1": {"path", "size", "mtime_ns", "sha256"}}}
+# While the directory's mtime is unchanged no file was added, removed or renamed in it,
+# so the recorded paths still resolve the sections and the converters use them without
+# listing the directory. The hashes seed the build cache's FileHashCache, which keeps
+# checking each file's size and mtime before trusting one.
+
+FILE_INDEX_KEY = "files"
+
+
+def without_file_index(chapter):
+    """
+    A chapter's metadata entry without the file index, whose mtimes change whenever a
+    file is saved (the entry is part of the chapter's build fingerprint).
+    """
+    return {key: value for key, value in chapter.items() if key != FILE_INDEX_KEY}
+
+
+def index_chapter_files(chapter, chapter_dir, hashes, previous=None):
+    """
+    Resolves and hashes a chapter's section files, sets each section's "file_path" and
+    the chapter's file index. previous is the chapter's last file index: its paths are
+    kept while the directory's mtime is unchanged, and hashes (a FileHashCache) only
+    re-reads files whose size or mtime changed. Returns the problems found.
+    """
+    sections = chapter.get('sections', [])
+    try:
+        dir_mtime_ns = os.stat(chapter_dir).st_mtime_ns
+    except OSError:
+        for section in sections:
+            section["file_path"] = None
+        chapter.pop(FILE_INDEX_KEY, None)
+        return [f"Chapter directory not found: {chapter_dir}"]
+
+    previous = previous or {}
+    known = previous.get("sections", {})
+    reuse = (previous.get("dir") == chapter_dir and previous.get("dir_mtime_ns") == dir_mtime_ns
+             and all(normalize_section_number(s.get('number')) in known for s in sections))
+    index = None if reuse else SectionIndex(chapter_dir, os.listdir(chapter_dir))
+
+    problems = []
+    entries = {}
+    for section in sections:
+        number = normalize_section_number(section.get('number'))
+        if reuse:
+            path = known[number]["path"]
+        else:
+            names = index.candidates(number)
+            if len(names) != 1:
+                problems.append(f"{'Ambiguous' if names else 'No'} file for Section {section.get('number')} in {chapter_dir}")
+                section["file_path"] = None
+                continue
+            path = os.path.join(chapter_dir, names[0])
+        section["file_path"] = path
+        hashes.digest(path)
+        entries[number] = {"path": path, **hashes.updated[os.path.abspath(path)]}
+
+    chapter[FILE_INDEX_KEY] = {"dir": chapter_dir, "dir_mtime_ns": dir_mtime_ns, "sections": entries}
+    return problems
+
+
+def indexed_section_files(chapter, chapter_dir):
+    """
+    (paths, hashes) of a chapter's section files from its file index, or None if there
+    is no index, it does not cover every section or a file was added, removed or renamed
+    in the directory since it was written. hashes is keyed like FileHashCache.
+    """
+    index = chapter.get(FILE_INDEX_KEY)
+    if not index or os.path.normpath(index.get("dir", "")) != os.path.normpath(chapter_dir):
+        return None
+    try:
+        if os.stat(chapter_dir).st_mtime_ns != index.get("dir_mtime_ns"):
+            return None
+    except OSError:
+        return None
+    entries = index.get("sections", {})
+    paths = []
+    hashes = {}
+    for section in chapter.get('sections', []):
+        entry = entries.get(normalize_section_number(section.get('number')))
+        if entry is None:
+            return None
+        paths.append(entry["path"])
+        hashes[os.path.abspath(entry["path"])] = {key: entry[key] for key in ("size", "mtime_ns", "sha256")}
+    return paths, hashes
@@ -0,0 +1,255 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Time per pipeline stage of a chapter (section lookup, preprocessing, the pandoc call,
+# post-processing), so benchmarks can time each stage separately.
+# Like the rule counters in rule_registry, convert_chapter resets them per chapter and
+# the result dict carries a snapshot back from the worker process.
+#
+# With --profile every stage also becomes an event with wall and CPU time (of this
+# process and of the pandoc subprocesses it waited for), bytes in and out and the peak
+# RSS so far. convert_book collects the events of all chapters and writes them as a JSON
+# report and as a Chrome trace-event file (chrome://tracing or https://ui.perfetto.dev).
+
+METADATA_LOAD = "metadata_load"
+ASSET_INDEX = "asset_index"
+REFERENCE_DOC = "reference_doc"
+SECTION_LOOKUP = "section_lookup"
+PREPROCESS = "preprocess"
+PREPROCESS_FILE = "preprocess_file"
+OPTIMIZE_IMAGES = "optimize_images"
+TITLE_PAGE = "title_page"
+BIBLIOGRAPHY = "bibliography"
+ASSEMBLE_LATEX = "assemble_latex"
+PANDOC = "pandoc"
+STYLE_FILTERS = "style_filters"
+WRITE_TARGET = "write_target"
+POST_PROCESS = "post_process_docx"
+MERGE_BOOK = "merge_book"
+
+PROFILE_FILENAME = "profile.json"
+TRACE_FILENAME = "profile.trace.json"
+PROFILE_VERSION = 1
+
+
+def peak_rss():
+    """
+    (peak RSS of this process, peak RSS of the largest finished child) in bytes;
+    None where the platform does not report it.
+    """
+    if resource is not None:
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+                resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+    try:
+        import psutil
+    except ImportError:
+        return None, None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss), None
+
+
+def _children_cpu():
+    # CPU time of finished (waited for) child processes; always 0 on Windows
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class StageTimes:
+    """
+    Cumulative seconds per stage name (plain dict, so it can be merged across chapters),
+    plus one event per stage run when profiling.
+    """
+
+    def __init__(self):
+        self.seconds = {}
+        self.events = []
+        self.profiling = False
+        self.chapter = None
+        self.depth = 0
+
+    def _checkpoint(self):
+        if not self.profiling:
+            return (time.perf_counter(),)
+        return time.perf_counter(), time.time(), time.process_time(), _children_cpu()
+
+    def _finish(self, name, start, detail=None, bytes_in=None, bytes_out=None, depth=None):
+        end = self._checkpoint()
+        wall = end[0] - start[0]
+        self.record(name, wall)
+        if not self.profiling:
+            return
+        rss, child_rss = peak_rss()
+        self.events.append({
+            "name": name,
+            "detail": detail,
+            "chapter": self.chapter,
+            "depth": self.depth if depth is None else depth,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "start": start[1],
+            "wall": wall,
+            "cpu": end[2] - start[2],
+            "child_cpu": end[3] - start[3],
+            "bytes_in": bytes_in,
+            "bytes_out": bytes_out,
+            "peak_rss": rss,
+            "child_peak_rss": child_rss,
+        })
+
+    @contextmanager
+    def stage(self, name, detail=None, bytes_in=None):
+        """
+        Times the block as one stage. The yielded dict takes "bytes_out" (and may
+        update "bytes_in") for the profile.
+        """
+        sizes = {"bytes_in": bytes_in, "bytes_out": None}
+        start = self._checkpoint()
+        self.depth += 1
+        try:
+            yield sizes
+        finally:
+            self.depth -= 1
+            self._finish(name, start, detail, sizes["bytes_in"], sizes["bytes_out"])
+
+    def parts(self, name):
+        return StageParts(self, name)
+
+    def record(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def reset(self, profiling=False, chapter=None):
+        self.seconds = {}
+        self.events = []
+        self.profiling = profiling
+        self.chapter = chapter
+        self.depth = 0
+
+    def snapshot(self):
+        return dict(self.seconds)
+
+    def merge(self, seconds):
+        for name, value in (seconds or {}).items():
+            self.record(name, value)
+
+
+class StageParts:
+    """
+    Consecutive parts of a stage ("post_process_docx/load", ".../styles", ...) without
+    wrapping each step in a with-block: done(part) closes the part that ran since the
+    previous call.
+    """
+
+    def __init__(self, times, name):
+        self.times = times
+        self.name = name
+        self.start = times._checkpoint()
+
+    def done(self, part, bytes_in=None, bytes_out=None):
+        self.times._finish(f"{self.name}/{part}", self.start, None, bytes_in, bytes_out,
+                           depth=self.times.depth)
+        self.start = self.times._checkpoint()
+
+
+# Stage times of this process
+stage_times = StageTimes()
+
+
+def summarize_events(events):
+    """
+    Totals per stage name and per chapter (top-level stages only, so nested stages
+    and parts are not counted twice).
+    """
+    stages = {}
+    chapters = {}
+    for event in events:
+        total = stages.setdefault(event["name"], {
+            "count": 0, "wall": 0.0, "cpu": 0.0, "child_cpu": 0.0, "bytes_in": 0, "bytes_out": 0, "peak_rss": 0})
+        total["count"] += 1
+        for key in ("wall", "cpu", "child_cpu", "bytes_in", "bytes_out"):
+            total[key] += event[key] or 0
+        total["peak_rss"] = max(total["peak_rss"], event["peak_rss"] or 0, event["child_peak_rss"] or 0)
+        if event["chapter"] is not None and event["depth"] == 0:
+            chapter = chapters.setdefault(str(event["chapter"]), {"wall": 0.0, "cpu": 0.0, "child_cpu": 0.0})
+            for key in ("wall", "cpu", "child_cpu"):
+                chapter[key] += event[key]
+    return stages, chapters
+
+
+def chrome_trace(events):
+    """
+    The events in Chrome's trace-event format: one complete ("X") event per stage,
+    one row per worker process.
+    """
+    origin = min((e["start"] for e in events), default=0.0)
+    trace = []
+    for pid in sorted({e["pid"] for e in events}):
+        trace.append({"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": f"process {pid}"}})
+    for event in events:
+        name = event["name"] if not event["detail"] else f"{event['name']} {event['detail']}"
+        args = {key: event[key] for key in ("chapter", "cpu", "child_cpu", "bytes_in", "bytes_out",
+                                             "peak_rss", "child_peak_rss") if event[key] is not None}
+        trace.append({
+            "name": name,
+            "cat": f"chapter {event['chapter']}" if event["chapter"] is not None else "book",
+            "ph": "X",
+            "ts": round((event["start"] - origin) * 1e6),
+            "dur": round(event["wall"] * 1e6),
+            "pid": event["pid"],
+            "tid": event["tid"],
+            "args": args,
+        })
+    return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+
+def write_profile(output_dir, converter, events, rule_counters=None):
+    """
+    Writes output/profile.json (events, totals per stage and chapter, rule counters)
+    and output/profile.trace.json. Returns the two paths.
+    """
+    stages, chapters = summarize_events(events)
+    profile = {
+        "version": PROFILE_VERSION,
+        "converter": converter,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stages": stages,
+        "chapters": chapters,
+        "rules": rule_counters or {},
+        "events": events,
+    }
+    profile_path = os.path.join(output_dir, PROFILE_FILENAME)
+    trace_path = os.path.join(output_dir, TRACE_FILENAME)
+    with open(profile_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2)
+    with open(trace_path, 'w', encoding='utf-8') as f:
+        json.dump(chrome_trace(events), f)
+    return profile_path, trace_path
+
+
+def report_profile(events):
+    """
+    Prints the totals per stage, slowest first.
+    """
+    stages, _ = summarize_events(events)
+    if not stages:
+        print("Profile: no stages ran.")
+        return
+    rows = sorted(stages.items(), key=lambda item: item[1]["wall"], reverse=True)
+    width = max(len(name) for name, _ in rows)
+    print("Profile:")
+    print(f"  {'stage':<{width}}  {'runs':>5}  {'wall (ms)':>10}  {'cpu (ms)':>9}  {'child cpu':>10}"
+          f"  {'KB in':>9}  {'KB out':>9}  {'peak MB':>8}")
+    for name, total in rows:
+        print(f"  {name:<{width}}  {total['count']:>5}  {total['wall'] * 1000:>10.1f}  {total['cpu'] * 1000:>9.1f}"
+              f"  {total['child_cpu'] * 1000:>10.1f}  {total['bytes_in'] / 1024:>9.1f}  {total['bytes_out'] / 1024:>9.1f}"
+              f"  {total['peak_rss'] / (1024 * 1024):>8.1f}")
@@ -0,0 +1,172 @@
+import json
+import os
+import re
+import time
+
+from generate_metadata import generate_metadata
+from rule_registry import section_file_pattern
+from section_index import normalize_section_number, without_file_index
+
+# --watch: rebuild chapters when their files are saved.
+#
+# The LaTeX tree, metadata.json and the manuscript are polled by mtime (no watcher
+# service needed). A burst of saves is collected until the files have been quiet for
+# the debounce interval, the changed files are mapped to their chapters and only those
+# chapters are rebuilt. The process stays up between builds, so imports, the pandoc
+# version lookup and the on-disk caches (build manifest, asset index, section cache)
+# stay warm.
+
+DEFAULT_INTERVAL = 1.0
+DEFAULT_DEBOUNCE = 0.5
+
+chapter_dir_pattern = re.compile(r'^Chapter_(\d+)$', re.IGNORECASE)
+
+
+def add_watch_arguments(parser):
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and rebuild chapters whose files change (all chapters unless selected)")
+    parser.add_argument("--watch-interval", type=float, default=DEFAULT_INTERVAL,
+                        help=f"Seconds between polls in --watch mode (default: {DEFAULT_INTERVAL})")
+
+
+def scan_mtimes(latex_dir, extra_paths):
+    """
+    {path: mtime_ns} for every file under latex_dir and the extra files that exist.
+    """
+    mtimes = {}
+    for path in extra_paths:
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    for root, _, files in os.walk(latex_dir):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                pass
+    return mtimes
+
+
+def changed_paths(before, after):
+    return {path for path in before.keys() | after.keys() if before.get(path) != after.get(path)}
+
+
+def wait_until_quiet(latex_dir, extra_paths, current, debounce):
+    """
+    Polls until nothing changed for one debounce interval; returns the last scan.
+    """
+    while True:
+        time.sleep(debounce)
+        later = scan_mtimes(latex_dir, extra_paths)
+        if later == current:
+            return current
+        current = later
+
+
+def _load_chapters(metadata_path):
+    try:
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            return {c['number']: c for c in json.load(f).get("chapters", [])}
+    except (OSError, ValueError) as e:
+        print(f"Warning: Could not read {metadata_path}: {e}")
+        return {}
+
+
+def chapters_for_files(paths, latex_dir, chapters):
+    """
+    Chapter numbers a set of changed files belongs to. A .tex file counts only if its
+    name is matched to one of the chapter's sections; any other file (images) counts
+    for the chapter folder it is in.
+    """
+    numbers = set()
+    base = os.path.abspath(latex_dir)
+    for path in paths:
+        rel = os.path.relpath(os.path.abspath(path), base)
+        if rel.startswith(os.pardir):
+            continue
+        match = chapter_dir_pattern.match(rel.split(os.sep)[0])
+        if not match or int(match.group(1)) not in chapters:
+            continue
+        number = int(match.group(1))
+        name = os.path.basename(path)
+        if name.lower().endswith('.tex'):
+            sections = {normalize_section_number(s.get('number')) for s in chapters[number].get('sections', [])}
+            named = {normalize_section_number(m.group(1)) for m in section_file_pattern.finditer(name)}
+            if not sections & named:
+                continue
+        numbers.add(number)
+    return numbers
+
+
+def chapters_with_new_metadata(old, new):
+    """
+    Chapters whose metadata entry changed; the file index only records saved files,
+    which are matched to their chapters by chapters_for_files.
+    """
+    return {number for number, chapter in new.items()
+            if number not in old or without_file_index(old[number]) != without_file_index(chapter)}
+
+
+def watch_book(build, chapter_numbers, latex_dir, metadata_path, manuscript_path,
+               interval=DEFAULT_INTERVAL, debounce=DEFAULT_DEBOUNCE):
+    """
+    Runs build(chapter_numbers) for the selected chapters (None = all), then polls for
+    changes and calls build(changed_chapter_numbers) until interrupted with Ctrl+C.
+    build returns (output_paths, failed_chapter_numbers); failed chapters (and a
+    sys.exit in the converters) do not stop the watch.
+    """
+    selected = set(chapter_numbers) if chapter_numbers is not None else None
+    extra_paths = [metadata_path, manuscript_path]
+
+    def build_once(numbers):
+        try:
+            _, failed = build(numbers)
+        except SystemExit:
+            failed = True
+        if failed:
+            print("Build failed (see errors above); waiting for the next change.")
+
+    def run(numbers):
+        if selected is not None:
+            numbers = sorted(set(numbers) & selected)
+        if not numbers:
+            return
+        print(f"Rebuilding chapter(s): {', '.join(str(n) for n in numbers)}")
+        build_once(numbers)
+
+    try:
+        build_start = scan_mtimes(latex_dir, extra_paths)
+        build_once(chapter_numbers)
+        state = build_start
+        chapters = _load_chapters(metadata_path)
+        print(f"Watching {latex_dir}, {metadata_path} and {manuscript_path} for changes (Ctrl+C to stop)...")
+
+        while True:
+            time.sleep(interval)
+            current = scan_mtimes(latex_dir, extra_paths)
+            if current == state:
+                continue
+            current = wait_until_quiet(latex_dir, extra_paths, current, debounce)
+            changed = changed_paths(state, current)
+            state = current
+
+            if manuscript_path in changed:
+                print(f"{manuscript_path} changed, regenerating {metadata_path}...")
+                generate_metadata(manuscript_path, metadata_path)
+                changed.add(metadata_path)
+                state = scan_mtimes(latex_dir, extra_paths)
+
+            numbers = set()
+            if metadata_path in changed:
+                new_chapters = _load_chapters(metadata_path)
+                numbers |= chapters_with_new_metadata(chapters, new_chapters)
+                chapters = new_chapters
+            numbers |= chapters_for_files(changed - {metadata_path, manuscript_path}, latex_dir, chapters)
+            if numbers:
+                run(sorted(numbers))
+            else:
+                print(f"{len(changed)} file(s) changed, no chapter affected.")
+    except KeyboardInterrupt:
+        print("Stopped watching.")
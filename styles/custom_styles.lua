@@ -0,0 +1,40 @@
+-- Paragraphs and runs in the publisher's custom Word styles.
+--
+-- The preprocessors wrap the title page and figure details in LaTeX environments named
+-- after a Word style (\begin{FigureDetail} ... \end{FigureDetail}). Pandoc's LaTeX
+-- reader turns those into Divs (or Spans) with the environment name as class; here
+-- they get pandoc's custom-style attribute, so the DOCX writer gives the paragraphs
+-- that style. The styles themselves are defined in styles/publisher.toml.
+--
+-- A paragraph holding an image outside a figure (an \includegraphics in the text) is
+-- centred like the figures, in the ImageParagraph style.
+--
+-- Keep the names of CUSTOM_STYLES in sync with the *_STYLE names in
+-- src/publisher_filters.py.
+
+local CUSTOM_STYLES = {
+  FigureDetail = true,
+  ChapterNumber = true,
+  ChapterTitle = true,
+}
+
+local IMAGE_PARAGRAPH = 'ImageParagraph'
+
+local function set_custom_style(element)
+  for _, class in ipairs(element.classes) do
+    if CUSTOM_STYLES[class] then
+      element.attributes['custom-style'] = class
+      return element
+    end
+  end
+end
+
+local function center_image_paragraph(para)
+  local has_image = false
+  para:walk({Image = function() has_image = true end})
+  if has_image then
+    return pandoc.Div({para}, {['custom-style'] = IMAGE_PARAGRAPH})
+  end
+end
+
+return {{Div = set_custom_style, Span = set_custom_style}, {Para = center_image_paragraph}}
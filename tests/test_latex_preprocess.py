@@ -0,0 +1,123 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
+
+from convert_to_pub_docx import latex_rules
+from latex_preprocess import Preprocessor, literal_rule, regex_rule
+from rule_registry import (RuleStats, bib_block_pattern, citation_pattern, figure_block_pattern, figure_detail_pattern,
+                           graphics_pattern, references_header_pattern, references_header_span)
+
+# The phased sweeps of latex_preprocess must give exactly what the converters got from
+# running every cleanup rule as its own sub() over the whole file, in the same order.
+# The rules are the pipeline's (book_pipeline.convert_chapter) with fixed replacement
+# functions in place of the image and reference lookups.
+#
+# The corpus is prose without code or math: the sweeps leave those regions alone on
+# purpose, which the plain sub() chain does not.
+
+QUOTES_AND_MARKERS = [("open_quotes", "``", '"'), ("close_quotes", "''", '"'), ("em_dash", "—", "-"),
+                      ("bold_markers", "**", "")]
+
+
+def figure_block(match):
+    block = match.group(1)
+    return block if "keep" in block else "Figure omitted" + (match.group(3) or "")
+
+
+CITATION_RULES = [regex_rule("citation", citation_pattern, '', ["\\cite", "\\ref", "[cite"], atomic=True)]
+STRUCTURE_RULES = [
+    regex_rule("figure_block", figure_block_pattern, figure_block, ["\\begin"]),
+    regex_rule("figure_detail", figure_detail_pattern, lambda m: "\\textit{" + m.group(0) + "}", ["[FIGURE DETAIL]"]),
+    regex_rule("graphics", graphics_pattern, lambda m: "\\includegraphics{images/" + m.group(2) + "}",
+               ["\\includegraphics"]),
+    regex_rule("references_header", references_header_pattern, '', ["\\s"], span_regex=references_header_span),
+    regex_rule("bibliography", bib_block_pattern, '', ["\\begin{thebibliography}"]),
+]
+PROSE_RULES = latex_rules() + [literal_rule(*rule) for rule in QUOTES_AND_MARKERS]
+
+
+def sequential(text):
+    for rule in CITATION_RULES + STRUCTURE_RULES + latex_rules():
+        # regex_rule's apply is the rule's sub() over whatever text it is given
+        text = rule.apply(text)
+    for _, literal, replacement in QUOTES_AND_MARKERS:
+        text = text.replace(literal, replacement)
+    return text
+
+
+# Text that only matches once something in between is gone, or next to a replacement
+EDGE_CASES = [
+    "word\\cite{x}e.g. more",
+    "e.\\cite{x}g. and v\\citep[p. 2]{a}s. too",
+    "e.g.vs. and vs.e.g.",
+    "Figure 1.1Figure 2.2, e.g.Figure 1.1 and Figure\\cite{x} 1.1",
+    "`\\cite{x}` and '[cite: 4]' and *\\ref{a}*",
+    "\\section{References\\cite{x}}\n\n\\begin{thebibliography}{9}\\bibitem{a} A.\\end{thebibliography}\ntext",
+    "\\section*{References}\n\\cite{x}\n\\begin{figure}\\includegraphics{a.png}\\end{figure}\n\nAfter",
+    "\\caption{A caption \\cite{x}.} \\section{A title: \\citet{y}} \\subsection{Done:}",
+    "x**vs. and E.G.e.g. and ``quoted''—dash",
+    "\\begin{figure}keep\\includegraphics[width=1in]{b.jpg}\\end{figure}\n% Image Prompt: a cat\ne.g.",
+]
+
+WORDS = ["word", " ", "\n", "\n\n", "e.g.", "E.G.", "vs.", "e.", "g.", "v", "s.", "Figure", "Table", " 1.1", "1.2",
+         "~", ":", ".", "References", "``", "''", "`", "'", "—", "**", "*", "x", "1", ",", "keep", "\\%"]
+CITATIONS = ["\\cite{x}", "\\citep[p. 3]{a,b}", "\\ref{fig:1}", "[cite: 3]", "[cite_start]", "\\citet{k}"]
+
+
+def inline(rng, depth):
+    roll = rng.random()
+    if roll < 0.55 or depth > 2:
+        return rng.choice(WORDS)
+    if roll < 0.8:
+        return rng.choice(CITATIONS)
+    if roll < 0.88:
+        return "\\textbf{" + words(rng, depth + 1, 3) + "}"
+    if roll < 0.94:
+        return "\\includegraphics" + rng.choice(["", "[width=1in]"]) + "{" + rng.choice(["a.png", "b.jpg"]) + "}"
+    return "\\emph{" + words(rng, depth + 1, 3) + "}"
+
+
+def words(rng, depth, most):
+    return "".join(inline(rng, depth) for _ in range(rng.randint(0, most)))
+
+
+def block(rng):
+    roll = rng.random()
+    if roll < 0.4:
+        return words(rng, 0, 6)
+    if roll < 0.5:
+        command = rng.choice(["\\section", "\\subsection", "\\subsubsection", "\\paragraph", "\\section*"])
+        return command + "{" + words(rng, 1, 4) + "}"
+    if roll < 0.58:
+        return "\\caption{" + words(rng, 1, 4) + "}"
+    if roll < 0.68:
+        return ("\\begin{figure}" + words(rng, 1, 3) + rng.choice(["", "\\includegraphics{a.png}"]) + words(rng, 1, 3)
+                + "\\end{figure}" + rng.choice(["", "\n% Image Prompt: a cat\n", " % Image Prompt: x\n"]))
+    if roll < 0.74:
+        return rng.choice(["\\section*{References}", "\\subsection{References}", "\\section{references}"]) + \
+            rng.choice(["", "\n", " \n\n"])
+    if roll < 0.8:
+        items = "".join(f"\\bibitem{{k{i}}} " + words(rng, 1, 3) for i in range(rng.randint(0, 2)))
+        return "\\begin{thebibliography}{9}" + items + "\\end{thebibliography}"
+    if roll < 0.86:
+        return "\n[FIGURE DETAIL] " + words(rng, 1, 4) + "\n"
+    return words(rng, 0, 4)
+
+
+def corpus(count=3000, seed=5):
+    rng = random.Random(seed)
+    return EDGE_CASES + ["".join(block(rng) for _ in range(rng.randint(1, 8))) for _ in range(count)]
+
+
+def test_sweeps_match_sequential_passes():
+    preprocessor = Preprocessor([CITATION_RULES, STRUCTURE_RULES, PROSE_RULES], RuleStats())
+    for text in corpus():
+        assert preprocessor.run(text) == sequential(text), text
+
+
+def test_word_boundary_after_removed_citation():
+    preprocessor = Preprocessor([CITATION_RULES, STRUCTURE_RULES, PROSE_RULES], RuleStats())
+    assert preprocessor.run("word\\cite{x}e.g.") == "worde.g."
+    assert preprocessor.run("e.g.vs.") == "for examplevs."